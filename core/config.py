@@ -0,0 +1,179 @@
+"""
+Config store, loads config.json once and reloads it when the file changes
+"""
+import collections
+import copy
+import logging
+import os
+
+from core.exceptions import InvalidJSONException
+from core.filemanager import FileManager
+
+
+class ConfigStore:
+    """
+    Holds the parsed config and the keys that changed since they were last handed out
+    Values are checked against the type of their default in config.example.json
+    """
+    logger = logging.getLogger("Config")
+
+    # Missing keys that were reported already, shared by every village
+    missing = set()
+
+    # Sections that are not checked against the template
+    unchecked = ["build", "villages"]
+
+    def __init__(self, path="config.json", template_path="config.example.json"):
+        """
+        Create the store, nothing is read until the config is used
+        """
+        self.path = path
+        self.template_path = template_path
+        self.template = None
+        self.data = None
+        self.mtime = None
+        # Copy of the last loaded or saved config, changes are compared against it
+        self.snapshot = None
+        # Changed keys: (section, parameter) or ("villages", village_id, parameter)
+        self.changes = set()
+
+    def modified(self):
+        """
+        Modification time of the config file, None if it does not exist
+        """
+        try:
+            return os.path.getmtime(FileManager.get_path(self.path))
+        except OSError:
+            return None
+
+    def load(self):
+        """
+        The current config, only parsed again when the file changed
+        An invalid file (while it is being edited) keeps the last valid config
+        """
+        mtime = self.modified()
+        if self.data is not None and mtime == self.mtime:
+            return self.data
+        if self.template is None:
+            self.template = FileManager.load_json_file(self.template_path) or {}
+        try:
+            data = FileManager.load_json_file(self.path, object_pairs_hook=collections.OrderedDict)
+        except InvalidJSONException:
+            if self.data is None:
+                raise
+            self.logger.error("%s is not valid JSON, using the last valid config", self.path)
+            self.mtime = mtime
+            return self.data
+        if data is None:
+            return self.data
+        self.validate(data)
+        if self.snapshot is not None:
+            changes = self.diff(self.snapshot, data)
+            if changes:
+                self.logger.info("Config file changed, %d settings updated", len(changes))
+            self.changes.update(changes)
+        self.snapshot = copy.deepcopy(data)
+        self.data = data
+        self.mtime = mtime
+        return data
+
+    def save(self, config):
+        """
+        Writes the config file, the store keeps using the written config
+        """
+        FileManager.save_json_file(config, self.path)
+        if self.snapshot is not None:
+            self.changes.update(self.diff(self.snapshot, config))
+        self.snapshot = copy.deepcopy(config)
+        self.data = config
+        self.mtime = self.modified()
+
+    def pop_changes(self):
+        """
+        The keys that changed since the last call
+        """
+        changes = self.changes
+        self.changes = set()
+        return changes
+
+    def validate(self, data):
+        """
+        Adds missing keys with their default and replaces values of the wrong type
+        """
+        for section, defaults in self.template.items():
+            if section in self.unchecked or not isinstance(defaults, dict):
+                continue
+            values = data.setdefault(section, collections.OrderedDict())
+            for parameter, default in defaults.items():
+                if parameter not in values:
+                    values[parameter] = copy.deepcopy(default)
+                elif not self.compatible(values[parameter], default):
+                    self.warn(
+                        (section, parameter),
+                        "Configuration parameter %s:%s should be of type %s, using the default %r",
+                        section, parameter, type(default).__name__, default,
+                    )
+                    values[parameter] = copy.deepcopy(default)
+
+    @staticmethod
+    def compatible(value, default):
+        """
+        Checks if a value has the type of its default, None means detect or not set
+        """
+        if value is None or default is None:
+            return True
+        if isinstance(default, bool) or isinstance(value, bool):
+            return isinstance(value, bool) and isinstance(default, bool)
+        if isinstance(default, (int, float)):
+            return isinstance(value, (int, float))
+        return isinstance(value, type(default))
+
+    @staticmethod
+    def diff(old, new):
+        """
+        Keys that were added, removed or changed between two configs
+        """
+        changes = set()
+        for section in set(old) | set(new):
+            before = old.get(section, {})
+            after = new.get(section, {})
+            if not isinstance(before, dict) or not isinstance(after, dict):
+                if before != after:
+                    changes.add((section,))
+                continue
+            for parameter in set(before) | set(after):
+                if section == "villages":
+                    village_before = before.get(parameter, {}) or {}
+                    village_after = after.get(parameter, {}) or {}
+                    for entry in set(village_before) | set(village_after):
+                        if village_before.get(entry, None) != village_after.get(entry, None):
+                            changes.add((section, parameter, entry))
+                elif before.get(parameter, None) != after.get(parameter, None):
+                    changes.add((section, parameter))
+        return changes
+
+    @staticmethod
+    def warn(key, message, *args, logger=None):
+        """
+        Logs a config problem once
+        """
+        if key in ConfigStore.missing:
+            return
+        ConfigStore.missing.add(key)
+        (logger or ConfigStore.logger).warning(message, *args)
+
+    @staticmethod
+    def value(config, section, parameter, default=None, logger=None):
+        """
+        Value of a config key, a missing key is reported once
+        """
+        if section not in config:
+            ConfigStore.warn((section,), "Configuration section %s does not exist!", section, logger=logger)
+            return default
+        if parameter not in config[section]:
+            ConfigStore.warn(
+                (section, parameter), "Configuration parameter %s:%s does not exist!", section, parameter,
+                logger=logger
+            )
+            return default
+        return config[section][parameter]
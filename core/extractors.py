@@ -167,6 +167,35 @@ class Extractor:
 
         return builder.group(1).count('<a class="btn btn-cancel"')
 
+    @staticmethod
+    def build_queue_times(res):
+        """
+        Finish times of the building queue and the moment the first entry can be completed for free
+        """
+        if type(res) != str:
+            res = res.text
+        output = {"ends": [], "free_from": None}
+        builder = re.search('(?s)<table id="build_queue"(.+?)</table>', res)
+        if builder:
+            output["ends"] = sorted(int(x) for x in re.findall(r'data-endtime="(\d+)"', builder.group(1)))
+        free = re.search(r'(?s)\d+,\s*\'BuildInstantFree.+?data-available-from="(\d+)"', res)
+        if free:
+            output["free_from"] = int(free.group(1))
+        return output
+
+    @staticmethod
+    def research_queue_end(res):
+        """
+        Finish time of the running smith research, None if the smith is idle
+        """
+        if type(res) != str:
+            res = res.text
+        research = re.search(r'(?s)id="current_research"(.+?)</table>', res)
+        if not research:
+            return None
+        ends = [int(x) for x in re.findall(r'data-endtime="(\d+)"', research.group(1))]
+        return max(ends) if ends else None
+
     @staticmethod
     def active_recruit_queue(res):
         """
@@ -177,6 +206,81 @@ class Extractor:
         builder = re.findall(r'(?s)TrainOverview\.cancelOrder\((\d+)\)', res)
         return builder
 
+    @staticmethod
+    def recruit_queue_ends(res):
+        """
+        Detects when the recruitment queue of every building on the train screen finishes
+        """
+        if type(res) != str:
+            res = res.text
+        output = {}
+        parts = re.split(r'id="trainqueue_wrap_(\w+)"', res)
+        for building, body in zip(parts[1::2], parts[2::2]):
+            ends = [int(x) for x in re.findall(r'data-endtime="(\d+)"', body)]
+            if ends:
+                output[building] = max(ends)
+            elif re.search(r'TrainOverview\.cancelOrder\((\d+)\)', body):
+                output[building] = None
+        return output
+
+    @staticmethod
+    def scavenge_mass_data(res):
+        """
+        Reads the option data and the villages (troops at home, option states) of the mass scavenge page
+        """
+        if type(res) != str:
+            res = res.text
+        start = res.find("new ScavengeMassScreen(")
+        if start == -1:
+            return None
+        decoder = json.JSONDecoder(strict=False)
+        position = start + len("new ScavengeMassScreen(")
+        output = {"options": {}, "villages": [], "pages": 0}
+        while position < len(res):
+            while res[position] in " \t\r\n,":
+                position += 1
+            if res[position] == ")":
+                break
+            try:
+                value, position = decoder.raw_decode(res, position)
+            except ValueError:
+                break
+            if type(value) == dict and any(type(x) == dict and "loot_factor" in x for x in value.values()):
+                output["options"] = value
+            elif type(value) == list and any(type(x) == dict and "village_id" in x for x in value):
+                output["villages"] = value
+        pages = re.findall(r'mode=scavenge_mass(?:&amp;|&)page=(\d+)', res)
+        output["pages"] = max([int(x) for x in pages]) if pages else 0
+        return output
+
+    @staticmethod
+    def mass_recruit_form(res):
+        """
+        Reads the form of the mass recruitment screen
+        Returns the form action, hidden fields and the unit inputs per village
+        """
+        if type(res) != str:
+            res = res.text
+        form = re.search(r'(?s)<form[^>]+action="([^"]*mode=mass[^"]*)"[^>]*>(.+?)</form>', res)
+        if not form:
+            return None
+        action, body = form.groups()
+        output = {"action": action.replace("&amp;", "&"), "hidden": {}, "fields": {}}
+        for tag in re.findall(r'<input[^>]+>', body):
+            name = re.search(r'name="([^"]+)"', tag)
+            if not name:
+                continue
+            name = name.group(1)
+            field = re.search(r'\[(\d+)\]\[(\w+)\]', name)
+            if field:
+                output["fields"].setdefault(field.group(1), {})[field.group(2)] = name
+            elif 'type="hidden"' in tag:
+                value = re.search(r'value="([^"]*)"', tag)
+                output["hidden"][name] = value.group(1) if value else ""
+        pages = re.findall(r'mode=mass(?:&amp;|&)page=(\d+)', res)
+        output["pages"] = max([int(x) for x in pages]) if pages else 0
+        return output
+
     @staticmethod
     def village_ids_from_overview(res):
         """
@@ -223,14 +327,82 @@ class Extractor:
         return 0
 
     @staticmethod
-    def report_table(res):
+    def report_list(res):
         """
-        Fetches information from a report
+        Fetches report metadata from the report list (id, subject and icons)
         """
         if type(res) != str:
             res = res.text
-        data = re.findall(r'(?s)class="report-link" data-id="(\d+)"', res)
-        return data
+        output = []
+        for row in re.findall(r'(?s)<tr[^>]*>(.+?)</tr>', res):
+            report_id = re.search(r'class="report-link" data-id="(\d+)"', row)
+            if not report_id:
+                continue
+            subject = re.search(r'(?s)<span class="quickedit-label"[^>]*>(.+?)</span>', row)
+            subject = re.sub(r'(?s)<.+?>', '', subject.group(1)).strip() if subject else ""
+            output.append({
+                "id": report_id.group(1),
+                "subject": subject,
+                "icons": re.findall(r'graphic/(?:command|report)/(\w+)\.(?:png|webp)', row),
+            })
+        return output
+
+    @staticmethod
+    def market_merchants(res):
+        """
+        Detects the amount of merchants at home on the market screen
+        """
+        if type(res) != str:
+            res = res.text
+        data = re.search(r'id="market_merchant_available_count"[^>]*>\s*(\d+)', res)
+        if data:
+            return int(data.group(1))
+        return None
+
+    @staticmethod
+    def market_call_form(res):
+        """
+        Reads the form of the market "call resources" page
+        Returns the form action, hidden fields and the resource inputs per source village
+        """
+        if type(res) != str:
+            res = res.text
+        form = re.search(r'(?s)<form[^>]+action="([^"]*mode=call[^"]*)"[^>]*>(.+?)</form>', res)
+        if not form:
+            return None
+        action, body = form.groups()
+        output = {"action": action.replace("&amp;", "&"), "hidden": {}, "fields": {}, "select": {}}
+        for tag in re.findall(r'<input[^>]+>', body):
+            name = re.search(r'name="([^"]+)"', tag)
+            if not name:
+                continue
+            name = name.group(1)
+            value = re.search(r'value="([^"]*)"', tag)
+            value = value.group(1) if value else "on"
+            field = re.search(r'\[(\d+)\]\[(wood|stone|iron)\]', name)
+            if field:
+                output["fields"].setdefault(field.group(1), {})[field.group(2)] = name
+            elif 'type="checkbox"' in tag:
+                village = re.search(r'(\d+)', name + " " + value)
+                if village:
+                    output["select"][village.group(1)] = (name, value)
+            elif 'type="hidden"' in tag:
+                output["hidden"][name] = value
+        return output
+
+    @staticmethod
+    def market_send_confirm(res):
+        """
+        Reads the confirmation form of a market transport
+        """
+        if type(res) != str:
+            res = res.text
+        form = re.search(r'(?s)<form[^>]+action="([^"]*action=send[^"]*)"[^>]*>(.+?)</form>', res)
+        if not form:
+            return None
+        action, body = form.groups()
+        hidden = dict(re.findall(r'<input[^>]+type="hidden"[^>]+name="([^"]+)"[^>]+value="([^"]*)"', body))
+        return action.replace("&amp;", "&"), hidden
 
     @staticmethod
     def get_daily_reward(res):
@@ -245,3 +417,71 @@ class Extractor:
         if reward_count_unlocked and res["chests"][reward_count_unlocked]["is_collected"]:
             return reward_count_unlocked
         return None
+
+    @staticmethod
+    def farm_assistant_send_link(res):
+        """
+        Detects the AJAX endpoint used by the farm assistant to send templates
+        """
+        if type(res) != str:
+            res = res.text
+        data = re.search(r'Accountmanager\.send_units_link\s*=\s*[\'"](.+?)[\'"]', res)
+        if data:
+            return data.group(1).replace("\\/", "/").replace("&amp;", "&")
+        return None
+
+    @staticmethod
+    def farm_assistant_templates(res):
+        """
+        Detects the A/B templates of the farm assistant (in page order)
+        """
+        if type(res) != str:
+            res = res.text
+        form = re.search(r'(?s)<form[^>]+action="[^"]*action=edit_all.+?</form>', res)
+        if not form:
+            return []
+        form = form.group(0)
+        template_ids = re.findall(r'name="template\[(\d+)\]\[id\]"', form)
+        templates = []
+        for template_id in template_ids:
+            units = {}
+            for unit, amount in re.findall(
+                    r'name="(\w+)\[%s\]"[^>]*value="(\d*)"' % template_id, form
+            ):
+                units[unit] = int(amount) if amount else 0
+            templates.append({"id": template_id, "units": units})
+        return templates
+
+    @staticmethod
+    def farm_assistant_rows(res):
+        """
+        Detects all farms listed by the farm assistant
+        Includes the last report state, last haul, known wall level and scouted resources
+        """
+        if type(res) != str:
+            res = res.text
+        output = {}
+        for vid, row in re.findall(r'(?s)<tr[^>]+id="village_(\d+)"(.+?)</tr>', res):
+            dot = re.search(r'graphic/dots/(\w+)\.png', row)
+            max_loot = re.search(r'max_loot/(\d)\.png', row)
+            cells = [
+                re.sub(r'(?s)<.+?>', '', cell).strip()
+                for cell in re.findall(r'(?s)<td[^>]*>(.*?)</td>', row)
+            ]
+            wall = None
+            if len(cells) > 6:
+                wall = int(cells[6]) if cells[6].isdigit() else None
+            resources = {}
+            row = row.replace('<span class="grey">.</span>', "")
+            for res_type, amount in re.findall(
+                    r'(wood|stone|iron)"[^>]*>\s*(?:</span>)?\s*(?:<span[^>]*>)?\s*(\d+)', row
+            ):
+                resources[res_type] = int(amount)
+            output[vid] = {
+                "id": vid,
+                "dot": dot.group(1) if dot else None,
+                "full_loot": max_loot.group(1) == "1" if max_loot else False,
+                "wall": wall,
+                "resources": resources,
+            }
+        return output
@@ -7,6 +7,12 @@ from core.exceptions import InvalidJSONException, FileNotFoundException
 class FileManager:
     """Provides methods for file and directory management."""
 
+    # Directory of the account when running multiple accounts (supervisor.py), None for the project root
+    account_root = None
+    # Files that belong to a single account, world data is shared between accounts
+    account_paths = ("cache", "config.json", "config.bak")
+    shared_paths = ("cache/world",)
+
     @staticmethod
     def get_root():
         """Returns the root directory of the project."""
@@ -14,7 +20,14 @@ class FileManager:
 
     @staticmethod
     def get_path(path):
-        """Returns the full path of a file or directory in the project."""
+        """Returns the full path of a file or directory in the project.
+        Account files are placed in the account directory if one is set."""
+        if FileManager.account_root and not os.path.isabs(path):
+            parts = os.path.normpath(path).split(os.sep)
+            in_account = any(parts[:len(p.split("/"))] == p.split("/") for p in FileManager.account_paths)
+            shared = any(parts[:len(p.split("/"))] == p.split("/") for p in FileManager.shared_paths)
+            if in_account and not shared:
+                return os.path.join(FileManager.account_root, path)
         return os.path.join(FileManager.get_root(), path)
 
     @staticmethod
@@ -31,16 +44,14 @@ class FileManager:
     @staticmethod
     def create_directories(directories):
         """Creates a list of directories in the root directory if they do not exist."""
-        root_directory = FileManager.get_root()
         for directory in directories:
-            directory = os.path.join(root_directory, directory)
-            FileManager.create_directory(directory)
+            FileManager.create_directory(FileManager.get_path(directory))
 
     @staticmethod
     def list_directory(directory, ends_with=None):
         """Returns a list of files in a directory. If ends_with is specified, only files ending with the specified
         string will be returned."""
-        full_path = os.path.join(FileManager.get_root(), directory)
+        full_path = FileManager.get_path(directory)
         files = os.listdir(full_path)
         if ends_with:
             files = [f for f in files if f.endswith(ends_with)]
@@ -49,7 +60,7 @@ class FileManager:
     @staticmethod
     def __open_file(path, mode="r"):
         """Opens a file in the specified mode. Private do NOT use outside filemanager."""
-        full_path = os.path.join(FileManager.get_root(), path)
+        full_path = FileManager.get_path(path)
         try:
             return open(full_path, mode)
         except:
@@ -58,7 +69,7 @@ class FileManager:
     @staticmethod
     def read_file(path):
         """Reads the contents of a file and returns the data. Returns None if the file does not exist."""
-        full_path = os.path.join(FileManager.get_root(), path)
+        full_path = FileManager.get_path(path)
 
         if not FileManager.path_exists(full_path):
             return None
@@ -69,7 +80,7 @@ class FileManager:
     @staticmethod
     def read_lines(path):
         """Reads the contents of a file and returns the lines. Returns None if the file does not exist."""
-        full_path = os.path.join(FileManager.get_root(), path)
+        full_path = FileManager.get_path(path)
 
         if not FileManager.path_exists(full_path):
             return None
@@ -80,7 +91,7 @@ class FileManager:
     @staticmethod
     def remove_file(path):
         """Removes a file if it exists."""
-        full_path = os.path.join(FileManager.get_root(), path)
+        full_path = FileManager.get_path(path)
 
         if FileManager.path_exists(full_path):
             os.remove(full_path)
@@ -88,7 +99,7 @@ class FileManager:
     @staticmethod
     def load_json_file(path, **kwargs):
         """Loads a JSON file and returns the data. Returns None if the file does not exist."""
-        full_path = os.path.join(FileManager.get_root(), path)
+        full_path = FileManager.get_path(path)
 
         if not FileManager.path_exists(full_path):
             return None
@@ -102,16 +113,28 @@ class FileManager:
     @staticmethod
     def save_json_file(data, path, **kwargs):
         """Saves data to a JSON file. If the file does not exist, it will be created."""
-        full_path = os.path.join(FileManager.get_root(), path)
+        full_path = FileManager.get_path(path)
 
         with FileManager.__open_file(full_path, mode="w") as file:
             json.dump(data, file, indent=2, sort_keys=False, **kwargs)
 
+    @staticmethod
+    def save_json_file_atomic(data, path):
+        """Saves data to a JSON file, a crash while writing leaves the previous file intact."""
+        full_path = FileManager.get_path(path)
+        temp_path = full_path + ".tmp"
+
+        with FileManager.__open_file(temp_path, mode="w") as file:
+            json.dump(data, file, separators=(",", ":"))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, full_path)
+
     @staticmethod
     def copy_file(src_path, dest_path):
         """Copies a file from the source path to the destination path."""
-        full_src_path = os.path.join(FileManager.get_root(), src_path)
-        full_dest_path = os.path.join(FileManager.get_root(), dest_path)
+        full_src_path = FileManager.get_path(src_path)
+        full_dest_path = FileManager.get_path(dest_path)
 
         if not FileManager.path_exists(full_src_path):
             return False
@@ -1,23 +1,25 @@
-import asyncio
-
-import telegram
+import logging
+import queue
+import threading
 
 from core.filemanager import FileManager
 from core.exceptions import InvalidJSONException
 
 
 class _Notification:
+    """
+    Telegram notifications, sent in the background
+    The config is read on the first message, telegram is only imported when notifications are enabled
+    """
     bot = None
     enabled = False
     channel_id = None
     token = None
 
     def __init__(self):
-        self.get_config()
-
-        if self.enabled:
-            self.loop = asyncio.new_event_loop()
-            self.bot = telegram.Bot(token=self.token)
+        self.loaded = False
+        self.messages = queue.Queue()
+        self.worker = None
 
     def get_config(self):
         try:
@@ -30,13 +32,47 @@ class _Notification:
             self.enabled = notification_config.get("enabled", False)
             self.channel_id = notification_config.get("channel_id")
             self.token = notification_config.get("token")
+        self.loaded = True
 
     def send(self, message):
-        if not self.enabled or not self.bot:
+        if not self.loaded:
+            self.get_config()
+        if not self.enabled:
             return
 
-        task = self.loop.create_task(self.send_async(message))
-        self.loop.run_until_complete(task)
+        if not self.worker:
+            self.worker = threading.Thread(target=self.run, name="Notification", daemon=True)
+            self.worker.start()
+        self.messages.put(message)
+
+    def flush(self, timeout=10):
+        """
+        Waits (at most timeout seconds) until the queued messages are sent
+        """
+        if not self.worker:
+            return
+        done = threading.Event()
+        threading.Thread(target=lambda: (self.messages.join(), done.set()), daemon=True).start()
+        done.wait(timeout)
+
+    def run(self):
+        """
+        Sends the queued messages
+        """
+        import asyncio
+
+        import telegram
+
+        loop = asyncio.new_event_loop()
+        self.bot = telegram.Bot(token=self.token)
+        while True:
+            message = self.messages.get()
+            try:
+                loop.run_until_complete(self.send_async(message))
+            except Exception as e:
+                logging.getLogger("Notification").warning("Unable to send notification: %s", str(e))
+            finally:
+                self.messages.task_done()
 
     async def send_async(self, message):
         await self.bot.send_message(chat_id=self.channel_id, text=message)
@@ -34,6 +34,8 @@ class WebWrapper:
     auth_endpoint = None
     reporter = None
     delay = 1.0
+    # Amount of responses received, used for throughput statistics
+    requests_made = 0
 
     def __init__(self, url, server=None, endpoint=None, reporter_enabled=False, reporter_constr=None):
         """
@@ -57,6 +59,7 @@ class WebWrapper:
             del self.headers['x-csrf-token']
         self.headers['Referer'] = response.url
         self.last_response = response
+        self.requests_made += 1
         get_h = re.search(r'&h=(\w+)', response.text)
         if get_h:
             self.last_h = get_h.group(1)
@@ -116,7 +119,13 @@ class WebWrapper:
         session_data = FileManager.load_json_file("cache/session.json")
         if session_data:
             self.web.cookies.update(session_data['cookies'])
+            # Opening the game right away is what a browser does, the first request is not delayed
+            priority_mode = self.priority_mode
+            self.priority_mode = True
             get_test = self.get_url("game.php?screen=overview")
+            self.priority_mode = priority_mode
+            if get_test is None:
+                return False
             if "game.php" in get_test.url:
                 return True
             self.logger.warning("Current session cache not valid")
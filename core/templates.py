@@ -1,13 +1,74 @@
 """
 Manages template files
 """
+import os
+
+from core.exceptions import FileNotFoundException
 from core.filemanager import FileManager
 
 
+class BuilderTemplate:
+    """
+    Compiled builder template, a list of (building, level) entries
+    """
+    def __init__(self, lines):
+        """
+        Compiles the "building:level" lines of a builder template
+        """
+        self.entries = []
+        # Highest level the template builds per building
+        self.targets = {}
+        for line in lines:
+            building, level = line.split(":")
+            level = int(level)
+            self.entries.append((building, level))
+            self.targets[building] = max(level, self.targets.get(building, 0))
+
+    def queue(self, skip=()):
+        """
+        A fresh build queue for a village, leaving out the buildings in skip
+        """
+        return [entry for entry in self.entries if entry[0] not in skip]
+
+
+class TroopTemplate:
+    """
+    Compiled troop template, the steps with their building requirement and the upgrades wanted up to each step
+    """
+    def __init__(self, steps):
+        """
+        Compiles the steps of a troop template
+        """
+        self.steps = steps
+        self.requirements = [(step["building"], int(step["level"])) for step in steps]
+        self.upgrades = []
+        wanted = {}
+        for step in steps:
+            wanted = dict(wanted)
+            for unit, level in step.get("upgrades", {}).items():
+                if unit not in wanted or level > wanted[unit]:
+                    wanted[unit] = level
+            self.upgrades.append(wanted)
+
+    def step_index(self, levels):
+        """
+        Index of the last step the building levels allow, -1 if none
+        """
+        index = -1
+        for building, level in self.requirements:
+            if building not in levels or level > levels[building]:
+                break
+            index += 1
+        return index
+
+
 class TemplateManager:
     """
     Template manager file
     """
+    # Compiled templates shared by every village: {path: (mtime, template)}
+    compiled = {}
+
     @staticmethod
     def get_template(category, template="basic", output_json=False):
         """
@@ -18,3 +79,34 @@ class TemplateManager:
         if output_json:
             return FileManager.load_json_file(path)
         return FileManager.read_file(path).strip().split()
+
+    @staticmethod
+    def get_compiled(category, template, compiler, output_json=False):
+        """
+        Compiled version of a template, only compiled again when the file changes
+        """
+        path = f"templates/{category}/{template}.txt"
+        try:
+            mtime = os.path.getmtime(FileManager.get_path(path))
+        except OSError:
+            raise FileNotFoundException
+        cached = TemplateManager.compiled.get(path, None)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        compiled = compiler(TemplateManager.get_template(category, template, output_json=output_json))
+        TemplateManager.compiled[path] = (mtime, compiled)
+        return compiled
+
+    @staticmethod
+    def builder(template="purple_predator"):
+        """
+        Compiled builder template
+        """
+        return TemplateManager.get_compiled("builder", template, BuilderTemplate)
+
+    @staticmethod
+    def troops(template="basic"):
+        """
+        Compiled troop template
+        """
+        return TemplateManager.get_compiled("troops", template, TroopTemplate, output_json=True)
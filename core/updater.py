@@ -4,7 +4,7 @@ Update checking logic
 
 import json
 import os.path
-import time
+import threading
 import requests
 import logging
 
@@ -12,7 +12,7 @@ import logging
 def check_update():
     """
     If enabled, check whether the config template version matches the one on github
-    Notify and 5 seconds sleep if update is available
+    Notify if update is available
     """
     get_local_config_template_version = os.path.join(
         os.path.dirname(__file__),
@@ -32,15 +32,27 @@ def check_update():
                 return
     with open(get_local_config_template_version, "r", encoding="utf-8") as local_cf:
         parsed = json.load(fp=local_cf)
-        get_remote_version = requests.get(
-            "https://raw.githubusercontent.com/stefan2200/TWB/master/config.example.json"
-        ).json()
+        try:
+            get_remote_version = requests.get(
+                "https://raw.githubusercontent.com/stefan2200/TWB/master/config.example.json", timeout=(10, 30)
+            ).json()
+        except (requests.RequestException, ValueError) as e:
+            logging.debug("Unable to check for updates: %s", str(e))
+            return
         if parsed["build"]["version"] != get_remote_version["build"]["version"]:
             logging.warning(
                 "There is a new version of the bot available. \n"
                 "Download the latest release from: \n"
                 "https://github.com/stefan2200/TWB"
             )
-            time.sleep(5)
         else:
             logging.info("The bot is up-to-date")
+
+
+def check_update_background():
+    """
+    Checks for updates without delaying the start of the bot
+    """
+    thread = threading.Thread(target=check_update, name="UpdateCheck", daemon=True)
+    thread.start()
+    return thread
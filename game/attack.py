@@ -10,41 +10,21 @@ from datetime import datetime
 from datetime import timedelta
 
 from core.filemanager import FileManager
+from game.farm_assistant import FarmAssistant
 
 
 class AttackManager:
     """
     Attackmanager class
     """
-    map = None
-    village_id = None
-    troopmanager = None
-    wrapper = None
-    targets = {}
+    __slots__ = (
+        "map", "village_id", "troopmanager", "wrapper", "targets", "max_farms", "template", "extra_farm",
+        "repman", "target_high_points", "farm_radius", "farm_minpoints", "farm_maxpoints", "ignored",
+        "ignored_villages", "scout_farm_amount", "forced_peace_time", "use_farm_assistant", "farm_assistant",
+        "loot_model", "planned_targets", "travel", "scout_planner", "farm_solver", "_unknown_ignored", "farm_planner",
+        "farm_high_prio_wait", "farm_default_wait", "farm_low_prio_wait",
+    )
     logger = logging.getLogger("Attacks")
-    max_farms = 15
-    template = {"light": 2}
-    extra_farm = []
-    repman = None
-    target_high_points = False
-    farm_radius = 50
-    farm_minpoints = 0
-    farm_maxpoints = 1000
-    ignored = []
-    ignored_villages = []
-
-    # Configures the amount of spies used to detect if villages are safe to farm
-    scout_farm_amount = 5
-
-    forced_peace_time = None
-
-    # blocks villages which cannot be attacked at the moment (too low points, beginners protection etc..)
-    _unknown_ignored = []
-
-    # Don't mess with these they are in the config file
-    farm_high_prio_wait = 1200
-    farm_default_wait = 3600
-    farm_low_prio_wait = 7200
 
     def __init__(self, wrapper=None, village_id=None, troopmanager=None, map=None):
         """
@@ -54,6 +34,65 @@ class AttackManager:
         self.village_id = village_id
         self.troopmanager = troopmanager
         self.map = map
+        self.targets = {}
+        self.max_farms = 15
+        self.template = {"light": 2}
+        self.extra_farm = []
+        # Shared report manager of the account
+        self.repman = None
+        self.target_high_points = False
+        self.farm_radius = 50
+        self.farm_minpoints = 0
+        self.farm_maxpoints = 1000
+        self.ignored = []
+        self.ignored_villages = []
+
+        # Configures the amount of spies used to detect if villages are safe to farm
+        self.scout_farm_amount = 5
+
+        self.forced_peace_time = None
+
+        # Send farms through the farm assistant (screen=am_farm) when available
+        self.use_farm_assistant = False
+        self.farm_assistant = None
+
+        # Ranks targets and sizes templates by the expected haul (game.loot.LootModel)
+        self.loot_model = None
+
+        # Farms assigned to this village by the account wide planner (None: all targets)
+        self.planned_targets = None
+        # Account wide planner that assigns the farms right before this village farms (game.farm_planner.FarmPlanner)
+        self.farm_planner = None
+
+        # Local travel time tables (game.travel.TravelCalculator)
+        self.travel = None
+
+        # Batches scouts within a budget instead of sending them right away (game.scout_planner.ScoutPlanner)
+        self.scout_planner = None
+
+        # Replaces the template by the cheapest troops that farm a scouted village without losses (game.farm_solver.FarmSolver)
+        self.farm_solver = None
+
+        # blocks villages which cannot be attacked at the moment (too low points, beginners protection etc..)
+        self._unknown_ignored = []
+
+        # Don't mess with these they are in the config file
+        self.farm_high_prio_wait = 1200
+        self.farm_default_wait = 3600
+        self.farm_low_prio_wait = 7200
+
+    def get_state(self):
+        """
+        State kept over a restart (checkpoint)
+        """
+        return {"ignored": self.ignored, "unknown_ignored": self._unknown_ignored}
+
+    def set_state(self, state):
+        """
+        Restores the state of a checkpoint
+        """
+        self.ignored = list(state.get("ignored", []))
+        self._unknown_ignored = list(state.get("unknown_ignored", []))
 
     def enough_in_village(self, units):
         """
@@ -74,9 +113,20 @@ class AttackManager:
             # Disable farming is disabled in config or no troops available
             return False
         self.get_targets()
+        if self.loot_model:
+            self.rank_targets()
+        self.planned_targets = self.farm_planner.plan_for(self) if self.farm_planner else None
+        assistant = self.get_farm_assistant()
+        targets = self.targets
+        if self.planned_targets is not None:
+            targets = [t for t in targets if t[0]["id"] in self.planned_targets]
         ignored = []
         # Limits the amount of villages that are farmed from the current village
-        for target in self.targets[0: self.max_farms]:
+        for target in targets[0: self.max_farms]:
+            if assistant and target[0]["id"] in assistant.farms:
+                if self.send_farm_assistant(target) != -1:
+                    continue
+                # Neither A nor B can be sent (or the farm has a wall), try the rally point templates
             if type(self.template) == list:
                 f = False
                 for template in self.template:
@@ -94,12 +144,33 @@ class AttackManager:
                 out_res = self.send_farm(target, self.template)
                 if out_res == -1:
                     break
+        if self.scout_planner:
+            self.scout_planner.dispatch(self)
 
     def send_farm(self, target, template):
         """
         Send a farming run
         """
-        target, _ = target
+        target, distance = target
+        solved = None
+        if self.farm_solver:
+            solved = self.farm_solver.template(target["id"], distance, self.troopmanager.troops, template)
+            if solved is False:
+                self.logger.debug(
+                    "Not farming %s because it can not be farmed without losses", target["id"]
+                )
+                return 0
+            if solved:
+                template = solved
+        if self.loot_model and not solved:
+            template = self.loot_model.size_template(
+                target["id"], distance, template, available=self.troopmanager.troops
+            )
+            if not template:
+                self.logger.debug(
+                    "Not farming %s because it is expected to be empty", target["id"]
+                )
+                return 0
         missing = self.enough_in_village(template)
         if not missing:
             cached = self.can_attack(vid=target["id"], clear=False)
@@ -145,6 +216,103 @@ class AttackManager:
             return -1
         return 0
 
+    def get_farm_assistant(self):
+        """
+        Returns the farm assistant if it is enabled and available
+        Falls back to the rally point if not (returns None)
+        """
+        if not self.use_farm_assistant:
+            return None
+        if not self.farm_assistant:
+            self.farm_assistant = FarmAssistant(wrapper=self.wrapper, village_id=self.village_id)
+        if not self.farm_assistant.update(targets=[target[0]["id"] for target in self.targets]):
+            return None
+        templates = self.template if type(self.template) == list else [self.template]
+        for index, template in enumerate(templates[0:2]):
+            self.farm_assistant.sync_template(index, template)
+        return self.farm_assistant
+
+    def send_farm_assistant(self, target):
+        """
+        Send a farming run using the farm assistant
+        Template B is preferred for villages that returned a full haul
+        """
+        target, _ = target
+        farm = self.farm_assistant.farms[target["id"]]
+        if farm["dot"] in ["yellow", "red"]:
+            self.logger.debug(
+                "Farm assistant reports losses on %s, ignoring", target["id"]
+            )
+            return 0
+        if farm["wall"]:
+            # The A/B templates are not sized for a wall, the rally point templates (and farm solver) handle it
+            self.logger.debug(
+                "Farm assistant reports wall level %d on %s, using the rally point", farm["wall"], target["id"]
+            )
+            return -1
+        if self.forced_peace_time and not self.travel:
+            # Travel time is unknown without the rally point, let it check the timer
+            return -1
+
+        templates = list(self.farm_assistant.templates[0:2])
+        if farm["full_loot"]:
+            templates.reverse()
+        elif farm["resources"]:
+            # Smallest template that carries the scouted resources first
+            scouted = sum(farm["resources"].values())
+            templates.sort(
+                key=lambda option: (self.farm_assistant.carry(option) < scouted, self.farm_assistant.carry(option))
+            )
+        template = None
+        for option in templates:
+            units = {u: a for u, a in option["units"].items() if a > 0}
+            if units and not self.enough_in_village(units):
+                template = option
+                break
+        if not template:
+            self.logger.debug(
+                "Not sending assistant farm to %s because not enough units", target["id"]
+            )
+            return -1
+
+        if self.arrives_in_forced_peace(target["id"], template["units"]):
+            return 0
+        cached = self.can_attack(vid=target["id"], clear=False)
+        if not cached:
+            return 0
+        if not self.farm_assistant.send(target["id"], template):
+            self.logger.debug(
+                "Ignoring target %s because unable to attack", target["id"]
+            )
+            self._unknown_ignored.append(target["id"])
+            return 0
+
+        units = {u: a for u, a in template["units"].items() if a > 0}
+        self.logger.info(
+            "Attacking %s -> %s (farm assistant %s: %s)",
+            self.village_id, target["id"], "A" if template is self.farm_assistant.templates[0] else "B", str(units)
+        )
+        self.wrapper.reporter.report(
+            self.village_id,
+            "TWB_FARM",
+            "Attacking %s -> %s (%s)" % (self.village_id, target["id"], str(units)),
+        )
+        for u in units:
+            self.troopmanager.troops[u] = str(
+                int(self.troopmanager.troops[u]) - units[u]
+            )
+        self.attacked(
+            target["id"],
+            scout=True,
+            safe=True,
+            high_profile=farm["full_loot"]
+            or (cached["high_profile"] if type(cached) == dict else False),
+            low_profile=cached["low_profile"]
+            if type(cached) == dict and "low_profile" in cached
+            else False,
+        )
+        return 1
+
     def get_targets(self):
         """
         Gets all possible farming targets based on distance
@@ -225,6 +393,20 @@ class AttackManager:
         )
         self.targets = sorted(output, key=lambda x: x[1])
 
+    def rank_targets(self):
+        """
+        Orders the targets by expected loot per troop-hour instead of distance
+        """
+        template = self.template[0] if type(self.template) == list else self.template
+        scored = []
+        for target in self.targets:
+            village, distance = target
+            scored.append(
+                (self.loot_model.score(village["id"], distance, template), target)
+            )
+        scored.sort(key=lambda x: x[0], reverse=True)
+        self.targets = [target for _, target in scored]
+
     def attacked(self, vid, scout=False, high_profile=False, safe=True, low_profile=False):
         """
         The farm was sent and this is a callback on what happened
@@ -241,7 +423,10 @@ class AttackManager:
     def scout(self, vid):
         """
         Attempt to send scouts to a farm
+        Only queues the request if the scout planner is used
         """
+        if self.scout_planner:
+            return self.scout_planner.request(vid)
         if "spy" not in self.troopmanager.troops or int(self.troopmanager.troops["spy"]) < self.scout_farm_amount:
             self.logger.debug(
                 "Cannot scout %s at the moment because insufficient unit: spy", vid
@@ -343,10 +528,26 @@ class AttackManager:
                 return False
         return True
 
+    def arrives_in_forced_peace(self, vid, troops):
+        """
+        Checks (without any request) if an attack would arrive after the forced peace timer
+        """
+        if not self.forced_peace_time or not self.travel:
+            return False
+        duration = self.travel.travel_time(self.village_id, vid, troops)
+        if duration is None:
+            return False
+        if datetime.now() + timedelta(seconds=duration) > self.forced_peace_time:
+            self.logger.info("Attack would arrive after the forced peace timer, not sending attack!")
+            return True
+        return False
+
     def attack(self, vid, troops=None):
         """
         Send a TW attack
         """
+        if self.arrives_in_forced_peace(vid, troops if troops else self.troopmanager.troops):
+            return "forced_peace"
         url = f"game.php?village={self.village_id}&screen=place&target={vid}"
         pre_attack = self.wrapper.get_url(url)
         pre_data = {}
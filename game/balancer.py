@@ -0,0 +1,245 @@
+"""
+Account wide resource balancing
+Moves resources between own villages before anything is traded with other players
+"""
+import logging
+import time
+
+from core.extractors import Extractor
+from game.travel import TravelCalculator
+
+
+class ResourceBalancer:
+    """
+    Plans and sends transports from villages with a surplus to villages that are waiting for resources
+    """
+    logger = logging.getLogger("Balancer")
+    resources = ["wood", "stone", "iron"]
+
+    merchant_capacity = 1000
+    # Minutes per field of a merchant (world speed 1)
+    merchant_speed = 6
+
+    # Villages without a request for a resource keep this part of their storage
+    keep_ratio = 0.5
+    # Transports smaller than this are not worth the merchants
+    min_transport = 250
+    # Max duration of a transport in hours
+    max_duration = 2
+
+    def __init__(self, wrapper=None, world_speed=1.0):
+        """
+        Create the resource balancer
+        """
+        self.wrapper = wrapper
+        # Merchants at home per village as read while planning
+        self.at_home = {}
+        self.travel = TravelCalculator(world_speed=world_speed)
+        self.travel.default_speeds = dict(self.travel.default_speeds, merchant=self.merchant_speed)
+
+    @staticmethod
+    def location(village):
+        """
+        Map location of an own village
+        """
+        return int(village.game_data["village"]["x"]), int(village.game_data["village"]["y"])
+
+    def merchants(self, village_id):
+        """
+        Merchants at home in a village, read from the market screen
+        """
+        result = self.wrapper.get_url(f"game.php?village={village_id}&screen=market")
+        merchants = Extractor.market_merchants(result) if result else None
+        if merchants is None:
+            self.logger.debug("Unable to read the merchants of village %s", village_id)
+            return 0
+        return merchants
+
+    def demand(self, resman, now):
+        """
+        Resources a village is waiting for at this moment, minus what is already on its way
+        Requests are made on the last snapshot, production since then is taken into account
+        """
+        amount = resman.projection.at(now, reserved=False)
+        output = {}
+        for res in self.resources:
+            needed = sum(
+                int(requested.get(res, 0)) for requested in resman.requested.values()
+            )
+            needed -= amount[res] - int(resman.projection.amount[res])
+            room = resman.storage - amount[res]
+            output[res] = int(max(0, min(needed, room) - resman.incoming_amount(res)))
+        return output
+
+    def supply(self, resman, demand, now):
+        """
+        Resources a village can miss at this moment without slowing itself down
+        """
+        amount = resman.projection.at(now)
+        output = {}
+        for res in self.resources:
+            if demand[res] > 0:
+                output[res] = 0
+                continue
+            output[res] = int(max(0, amount[res] - resman.storage * self.keep_ratio))
+        return output
+
+    def plan(self, villages):
+        """
+        Greedy min-cost transport, the shortest merchant travel times are filled first
+        Only villages with something to spare are asked for their merchants
+        Returns a list of (source, target, resources, duration)
+        """
+        now = time.time()
+        villages = [v for v in villages if v.resman and v.resman.projection and v.game_data]
+        demand = {v.village_id: self.demand(v.resman, now) for v in villages}
+        if not any(any(entry.values()) for entry in demand.values()):
+            return []
+        supply = {v.village_id: self.supply(v.resman, demand[v.village_id], now) for v in villages}
+        capacity = {}
+        self.at_home = {}
+        for v in villages:
+            merchants = self.merchants(v.village_id) if any(supply[v.village_id].values()) else 0
+            self.at_home[v.village_id] = merchants
+            capacity[v.village_id] = merchants * self.merchant_capacity
+
+        edges = []
+        for source in villages:
+            if not capacity[source.village_id] or not any(supply[source.village_id].values()):
+                continue
+            for target in villages:
+                if target is source or not any(demand[target.village_id].values()):
+                    continue
+                distance = self.travel.distance(self.location(source), self.location(target))
+                duration = self.travel.duration(distance, {"merchant": 1})
+                if duration <= self.max_duration * 3600:
+                    edges.append((duration, source.village_id, target.village_id))
+        edges.sort()
+
+        transports = []
+        for duration, source, target in edges:
+            shipment = {}
+            for res in self.resources:
+                amount = min(supply[source][res], demand[target][res], capacity[source])
+                if amount <= 0:
+                    continue
+                shipment[res] = amount
+                supply[source][res] -= amount
+                demand[target][res] -= amount
+                capacity[source] -= amount
+            if sum(shipment.values()) >= self.min_transport:
+                transports.append((source, target, shipment, duration))
+                # Merchants are only partially loaded on the last trip
+                capacity[source] -= (-sum(shipment.values())) % self.merchant_capacity
+            else:
+                for res, amount in shipment.items():
+                    supply[source][res] += amount
+                    demand[target][res] += amount
+                    capacity[source] += amount
+        return transports
+
+    def confirm(self, source, shipment):
+        """
+        Checks if a transport left when the game did not answer, the merchants of the source have to be gone
+        Returns None if the merchants can not be read
+        """
+        merchants = self.wrapper.get_url(f"game.php?village={source}&screen=market")
+        merchants = Extractor.market_merchants(merchants) if merchants else None
+        if merchants is None:
+            return None
+        needed = -(-sum(shipment.values()) // self.merchant_capacity)
+        return merchants <= self.at_home.get(source, 0) - needed
+
+    def call(self, target, shipments):
+        """
+        Calls resources from multiple villages at once from the market call screen
+        Returns {source: True if called, False if not called, None if unknown}
+        Sources are only False when it is certain nothing left, so they can be sent again
+        """
+        url = f"game.php?village={target}&screen=market&mode=call"
+        form = Extractor.market_call_form(self.wrapper.get_url(url))
+        if not form:
+            return {source: False for source in shipments}
+        data = dict(form["hidden"])
+        called = []
+        for source, shipment in shipments.items():
+            if source not in form["fields"]:
+                continue
+            if source in form["select"]:
+                name, value = form["select"][source]
+                data[name] = value
+            for res, amount in shipment.items():
+                if res in form["fields"][source]:
+                    data[form["fields"][source][res]] = str(amount)
+            called.append(source)
+        if called:
+            if "h" not in data:
+                data["h"] = self.wrapper.last_h
+            result = self.wrapper.post_url(form["action"], data=data)
+            if result and '<div class="error_box">' in result.text:
+                self.logger.debug("Calling resources to %s was refused", target)
+                return {source: False for source in shipments}
+            if not result:
+                # The game might have accepted the call before the connection was lost
+                self.logger.debug("No answer when calling resources to %s, checking the merchants", target)
+                return {
+                    source: self.confirm(source, shipment) if source in called else False
+                    for source, shipment in shipments.items()
+                }
+        return {source: source in called for source in shipments}
+
+    def send(self, source, target_location, shipment):
+        """
+        Sends a single transport from the market send screen
+        Returns True if the game accepted the transport, None if that is unknown
+        """
+        data = {res: str(shipment.get(res, 0)) for res in self.resources}
+        data.update({"x": target_location[0], "y": target_location[1], "target_type": "coord", "input": ""})
+        url = f"game.php?village={source}&screen=market&try=confirm_send"
+        result = self.wrapper.post_url(url, data=data)
+        confirm = Extractor.market_send_confirm(result) if result else None
+        if not confirm:
+            return False
+        action, hidden = confirm
+        result = self.wrapper.post_url(action, data=hidden)
+        if not result:
+            return self.confirm(source, shipment)
+        return '<div class="error_box">' not in result.text
+
+    def run(self, villages):
+        """
+        Plans and sends all transports, grouped per target village
+        Returns the transports the game accepted
+        """
+        by_id = {v.village_id: v for v in villages}
+        transports = self.plan(villages)
+        if not transports:
+            self.logger.debug("No transports between own villages needed")
+            return []
+        sent = []
+        per_target = {}
+        for source, target, shipment, duration in transports:
+            per_target.setdefault(target, {})[source] = (shipment, duration)
+
+        for target, entries in per_target.items():
+            called = self.call(target, {source: shipment for source, (shipment, _) in entries.items()})
+            for source, (shipment, duration) in entries.items():
+                accepted = called[source]
+                if accepted is False:
+                    accepted = self.send(source, self.location(by_id[target]), shipment)
+                if accepted is None:
+                    # Not sent again and not booked, the next plan reads the merchants again
+                    self.logger.warning("Unable to tell if transport %s -> %s left", source, target)
+                    continue
+                if not accepted:
+                    self.logger.warning("Transport %s -> %s failed", source, target)
+                    continue
+                self.logger.info(
+                    "Sent %s from %s to %s (arrives in %d minutes)", shipment, source, target, duration / 60
+                )
+                sent.append((source, target, shipment, duration))
+                by_id[target].resman.projection.add_incoming(time.time() + duration, shipment)
+                for res, amount in shipment.items():
+                    by_id[source].resman.actual[res] -= amount
+                    by_id[source].resman.projection.amount[res] -= amount
+        return sent
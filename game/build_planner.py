@@ -0,0 +1,212 @@
+"""
+Build order planning
+Simulates resources, build times and queue slots to find the fastest order of the next template entries
+Template entries are (building, level) tuples
+"""
+import itertools
+import math
+import time
+
+from game.loot import LootModel
+
+
+class BuildPlanner:
+    """
+    Tries every order of the next template entries that keeps the levels of each building in order
+    and picks the one that finishes all of them first
+    """
+    resources = ["wood", "stone", "iron"]
+
+    # Cost growth per level (wood, stone, iron)
+    cost_factors = {
+        "main": (1.26, 1.275, 1.26),
+        "barracks": (1.26, 1.28, 1.26),
+        "stable": (1.26, 1.28, 1.26),
+        "garage": (1.26, 1.28, 1.26),
+        "snob": (2.0, 2.0, 2.0),
+        "smith": (1.26, 1.275, 1.26),
+        "place": (1.26, 1.275, 1.26),
+        "statue": (1.26, 1.275, 1.26),
+        "market": (1.26, 1.275, 1.26),
+        "wood": (1.25, 1.275, 1.245),
+        "stone": (1.27, 1.265, 1.27),
+        "iron": (1.252, 1.275, 1.24),
+        "farm": (1.3, 1.32, 1.29),
+        "storage": (1.265, 1.27, 1.245),
+        "hide": (1.25, 1.25, 1.25),
+        "wall": (1.26, 1.275, 1.26),
+        "watchtower": (1.17, 1.17, 1.18),
+        "church": (1.26, 1.28, 1.26),
+    }
+    # Build time growth per level
+    time_factor = 1.2
+    # Every headquarters level speeds up construction
+    main_speed_factor = 1.05
+
+    # More entries gets expensive fast (entries! orders)
+    max_entries = 6
+    # Re-plan when the resources differ this much from the prediction
+    max_divergence = 0.2
+    # Resources are compared with this margin against rounding errors
+    precision = 0.01
+
+    def __init__(self, lookahead=4):
+        """
+        Create the build planner
+        """
+        self.lookahead = min(lookahead, self.max_entries)
+        self.signature = None
+        self.snapshot = None
+        self.plan = None
+
+    def entry_cost(self, costs, levels, entry, planned):
+        """
+        Cost and build time of the next level of a template entry (one level per entry, like the builder)
+        The game only shows the next level, later levels are grown with the cost factors
+        """
+        building = entry[0]
+        data = costs[building]
+        steps = planned.get(building, 0)
+        factors = self.cost_factors.get(building, (1.26, 1.275, 1.26))
+        cost = {res: data[res] * math.pow(factors[i], steps) for i, res in enumerate(self.resources)}
+        build_time = data["build_time"] * math.pow(self.time_factor, steps)
+        build_time /= math.pow(self.main_speed_factor, planned.get("main", 0))
+        return building, cost, build_time
+
+    def simulate(self, order, costs, levels, state, waits, queue_len):
+        """
+        Finish time of an order of template entries
+        state: {"when", "amount", "rates", "storage"}, waits: finish times of the current queue
+        """
+        # Seconds from now, keeps the resource math precise
+        when = 0.0
+        amount = dict(state["amount"])
+        rates = dict(state["rates"])
+        storage = state["storage"]
+        events = []
+        finishes = sorted(wait - state["when"] for wait in waits)
+        last_finish = max([when] + finishes)
+        planned = {}
+
+        def advance(until):
+            nonlocal when, amount, rates, storage, events
+            while events and events[0][0] <= until:
+                moment, building, level = events.pop(0)
+                for res in self.resources:
+                    amount[res] = min(max(storage, amount[res]), amount[res] + rates[res] * (moment - when))
+                when = moment
+                if building in self.resources:
+                    rates[building] *= LootModel.production(level) / LootModel.production(level - 1)
+                elif building == "storage":
+                    storage *= LootModel.storage_capacity(level) / LootModel.storage_capacity(level - 1)
+            for res in self.resources:
+                amount[res] = min(max(storage, amount[res]), amount[res] + rates[res] * (until - when))
+            when = until
+
+        for entry in order:
+            building, cost, build_time = self.entry_cost(costs, levels, entry, planned)
+            start = when
+            # A queue slot has to be free
+            busy = sorted(f for f in finishes if f > start)
+            if len(busy) >= queue_len:
+                start = busy[len(busy) - queue_len]
+            advance(start)
+            # Wait for resources (production changes when queued resource buildings finish)
+            while any(amount[res] < cost[res] - self.precision for res in self.resources):
+                # Costs above the storage need a storage upgrade that is still queued
+                if any(cost[res] > storage for res in self.resources):
+                    if not events:
+                        return math.inf
+                    advance(events[0][0])
+                    continue
+                waiting = [
+                    (cost[res] - amount[res]) / rates[res] if rates[res] else math.inf
+                    for res in self.resources if amount[res] < cost[res] - self.precision
+                ]
+                ready = when + max(waiting)
+                if ready == math.inf:
+                    return math.inf
+                if events and events[0][0] < ready:
+                    advance(events[0][0])
+                else:
+                    advance(ready)
+            for res in self.resources:
+                amount[res] -= cost[res]
+            last_finish = max(last_finish, when) + build_time
+            finishes.append(last_finish)
+            planned[building] = planned.get(building, 0) + 1
+            events.append((last_finish, building, levels[building] + planned[building]))
+            events.sort()
+        return state["when"] + last_finish
+
+    def orders(self, window):
+        """
+        All orders of the window that keep the levels of every building in order
+        The template order comes first
+        """
+        for order in itertools.permutations(range(len(window))):
+            seen = {}
+            valid = True
+            for index in order:
+                building = window[index][0]
+                if seen.get(building, -1) > index:
+                    valid = False
+                    break
+                seen[building] = index
+            if valid:
+                yield [window[index] for index in order]
+
+    def diverged(self, state):
+        """
+        Checks if the resources differ too much from what the last plan expected
+        """
+        if not self.snapshot:
+            return True
+        seconds = state["when"] - self.snapshot["when"]
+        for res in self.resources:
+            expected = min(
+                self.snapshot["storage"], self.snapshot["amount"][res] + self.snapshot["rates"][res] * seconds
+            )
+            if abs(state["amount"][res] - expected) > self.max_divergence * max(expected, 1):
+                return True
+        return False
+
+    def best_order(self, queue, costs, levels, state, waits, queue_len):
+        """
+        The fastest order of the first template entries, cached until the state diverges
+        """
+        # Entries that can not be built right now (requirements, max level) are left out of the plan
+        window = [
+            (building, level) for building, level in queue[0:self.lookahead]
+            if building in costs and costs[building].get("can_build", False)
+            and building in levels and level > levels[building]
+        ]
+        signature = (tuple(window), tuple(sorted(levels.items())), len(waits), queue_len)
+        if self.plan is not None and signature == self.signature and not self.diverged(state):
+            return self.plan
+        best = window
+        best_finish = self.simulate(window, costs, levels, state, waits, queue_len)
+        for order in self.orders(window):
+            finish = self.simulate(order, costs, levels, state, waits, queue_len)
+            if finish < best_finish:
+                best, best_finish = order, finish
+        self.signature = signature
+        self.snapshot = state
+        self.plan = best
+        return best
+
+    @staticmethod
+    def state_from(game_state, projection=None):
+        """
+        Resource state of a village from the game state
+        """
+        village = game_state["village"]
+        return {
+            "when": time.time(),
+            "amount": {res: float(village[res]) for res in BuildPlanner.resources},
+            "rates": {
+                res: projection.rates[res] if projection else float(village.get(f"{res}_prod", 0) or 0)
+                for res in BuildPlanner.resources
+            },
+            "storage": float(village["storage_max"]),
+        }
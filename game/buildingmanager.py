@@ -7,35 +7,18 @@ import re
 import time
 
 from core.extractors import Extractor
+from game.build_planner import BuildPlanner
 
 
 class BuildingManager:
     """
     Core class for building management
     """
-    logger = None
-    levels = {}
-
-    # Amount of building in the queue to look ahead into
-    # Increasing this will gain massive points but lack of resources
-    max_lookahead = 2
-
-    queue = []
-    waits = []
-    waits_building = []
-
-    costs = {}
-
-    wrapper = None
-    village_id = None
-    game_state = {}
-
-    # Can be increased with a premium account
-    max_queue_len = 2
-    resman = None
-    raw_template = None
-
-    can_build_three_min = False
+    __slots__ = (
+        "logger", "levels", "max_lookahead", "queue", "waits", "waits_building", "costs", "wrapper",
+        "village_id", "game_state", "max_queue_len", "resman", "template", "can_build_three_min", "planner",
+        "timers",
+    )
 
     def __init__(self, wrapper, village_id):
         """
@@ -43,6 +26,31 @@ class BuildingManager:
         """
         self.wrapper = wrapper
         self.village_id = village_id
+        self.logger = None
+        self.levels = {}
+
+        # Amount of building in the queue to look ahead into
+        # Increasing this will gain massive points but lack of resources
+        self.max_lookahead = 2
+
+        self.queue = []
+        self.waits = []
+        self.waits_building = []
+
+        self.costs = {}
+        self.game_state = {}
+
+        # Can be increased with a premium account
+        self.max_queue_len = 2
+        self.resman = None
+        # Compiled builder template the queue was created from
+        self.template = None
+
+        self.can_build_three_min = False
+        # Reorders the first queue entries to the fastest build order (BuildPlanner)
+        self.planner = None
+        # Queue timers of the village, the main screen is skipped while the queue is full
+        self.timers = None
 
     def create_update_links(self, extracted_buildings):
         """
@@ -62,6 +70,11 @@ class BuildingManager:
         """
         Start a building manager run
         """
+        if build and self.timers and self.logger and not self.timers.due("build"):
+            self.logger.info(
+                "Building queue full for another %d seconds", self.timers.remaining("build")
+            )
+            return False
         main_data = self.wrapper.get_action(village_id=self.village_id, action="main")
         self.game_state = Extractor.game_state(main_data)
         vname = self.game_state["village"]["name"]
@@ -73,12 +86,14 @@ class BuildingManager:
             return self.start_update(build=build, set_village_name=set_village_name)
         self.costs = Extractor.building_data(main_data)
         self.costs = self.create_update_links(self.costs)
+        self.update_timers(main_data)
 
         if self.resman:
             self.resman.update(self.game_state)
             if "building" in self.resman.requested:
                 # new run, remove request
                 self.resman.requested["building"] = {}
+            self.resman.release("building")
         if set_village_name and vname != set_village_name:
             self.wrapper.post_url(
                 url=f"game.php?village={self.village_id}&screen=main&action=change_name",
@@ -118,6 +133,7 @@ class BuildingManager:
             r = self.max_queue_len - 1
         else:
             r = self.max_queue_len - len(self.waits)
+        self.apply_build_plan()
         for x in range(r):
             result = self.get_next_building_action()
             if not result:
@@ -125,14 +141,35 @@ class BuildingManager:
                     "No build more operations where executed (%d current, %d left)",
                     len(self.waits), len(self.queue)
                 )
+                self.update_timers()
                 return False
         # Check for instant build after putting something in the queue
         main_data = self.wrapper.get_action(village_id=self.village_id, action="main")
         if self.complete_actions(main_data.text):
             self.can_build_three_min = True
             return self.start_update(build=build, set_village_name=set_village_name)
+        self.update_timers(main_data)
         return True
 
+    def update_timers(self, main_data=None):
+        """
+        Registers when the next building slot frees up or the first entry can be completed for free
+        Without main screen data the finish times of the bot's own queue are used
+        """
+        if not self.timers:
+            return
+        if main_data:
+            queue = Extractor.build_queue_times(main_data)
+        else:
+            queue = {"ends": [w for w in self.waits if w > time.time()], "free_from": None}
+        when = None
+        if len(queue["ends"]) >= self.max_queue_len:
+            when = queue["ends"][0]
+            # A free instant completion also frees a slot
+            if queue["free_from"] and queue["free_from"] < when:
+                when = queue["free_from"]
+        self.timers.set("build", when)
+
     def complete_actions(self, text):
         """
         Automatically finish a building if the world allows it
@@ -166,6 +203,27 @@ class BuildingManager:
             self.logger.debug("Building finish time: %s", str(f_time))
             return f_time
 
+    def get_state(self):
+        """
+        State kept over a restart (checkpoint)
+        """
+        return {
+            "levels": self.levels,
+            "waits": self.waits,
+            "waits_building": self.waits_building,
+            "logger": self.logger.name if self.logger else None,
+        }
+
+    def set_state(self, state):
+        """
+        Restores the state of a checkpoint, a full queue is not checked again until it frees up
+        """
+        self.levels = state.get("levels", {})
+        self.waits = state.get("waits", [])
+        self.waits_building = state.get("waits_building", [])
+        if state.get("logger", None):
+            self.logger = logging.getLogger(state["logger"])
+
     def is_queued(self):
         """
         Checks if a building is already queued
@@ -186,11 +244,11 @@ class BuildingManager:
                 or build_item["wood"] > self.resman.storage
                 or build_item["stone"] > self.resman.storage
         ):
-            build_data = "storage:%d" % (int(self.levels["storage"]) + 1)
+            build_data = ("storage", int(self.levels["storage"]) + 1)
             if (
                     len(self.queue)
                     and "storage"
-                    not in [x.split(":")[0] for x in self.queue[0: self.max_lookahead]]
+                    not in [x[0] for x in self.queue[0: self.max_lookahead]]
                     and int(self.levels["storage"]) != 30
             ):
                 self.queue.insert(0, build_data)
@@ -222,6 +280,9 @@ class BuildingManager:
             r = False
         if not r:
             self.logger.debug(f"Requested resources: {self.resman.requested}")
+            self.resman.reserve("building", build_item)
+        else:
+            self.resman.release("building")
         return r
 
     def get_level(self, building):
@@ -245,6 +306,24 @@ class BuildingManager:
 
         return "%d:%02d:%02d" % (hour, minutes, seconds)
 
+    def apply_build_plan(self):
+        """
+        Puts the first queue entries in the order the planner expects to finish first
+        """
+        if not self.planner or not self.queue or not self.costs:
+            return
+        window = self.queue[0:self.planner.lookahead]
+        state = BuildPlanner.state_from(self.game_state, self.resman.projection if self.resman else None)
+        order = self.planner.best_order(
+            window, self.costs, self.levels, state, [w for w in self.waits if w > time.time()], self.max_queue_len
+        )
+        rest = list(window)
+        for entry in order:
+            rest.remove(entry)
+        if order + rest != window:
+            self.logger.info("Build order changed to %s", ", ".join("%s:%d" % entry for entry in order))
+        self.queue[0:len(window)] = order + rest
+
     def get_next_building_action(self, index=0):
         """
         Calculates the next best possible building action
@@ -259,11 +338,11 @@ class BuildingManager:
             return False
 
         if self.resman and self.resman.in_need_of("pop"):
-            build_data = "farm:%d" % (int(self.levels["farm"]) + 1)
+            build_data = ("farm", int(self.levels["farm"]) + 1)
             if (
                     len(self.queue)
                     and "farm"
-                    not in [x.split(":")[0] for x in self.queue[0: self.max_lookahead]]
+                    not in [x[0] for x in self.queue[0: self.max_lookahead]]
                     and int(self.levels["farm"]) != 30
             ):
                 self.queue.insert(0, build_data)
@@ -271,9 +350,7 @@ class BuildingManager:
                 return self.get_next_building_action(0)
 
         if len(self.queue):
-            entry = self.queue[index]
-            entry, min_lvl = entry.split(":")
-            min_lvl = int(min_lvl)
+            entry, min_lvl = self.queue[index]
             if min_lvl <= self.levels[entry]:
                 self.queue.pop(index)
                 return self.get_next_building_action(index)
@@ -327,6 +404,12 @@ class BuildingManager:
                 if self.resman and "building" in self.resman.requested:
                     # Build something, remove request
                     self.resman.requested["building"] = {}
+                if self.resman:
+                    self.resman.release("building")
                 return True
+            elif self.planner and check["can_build"]:
+                # The planned order is followed strictly, skipping ahead would delay the planned entry
+                self.logger.debug("Waiting for planned entry %s", entry)
+                return False
             else:
                 return self.get_next_building_action(index + 1)
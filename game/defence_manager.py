@@ -7,50 +7,51 @@ from core.extractors import Extractor
 
 
 class DefenceManager:
-    wrapper = None
-    village_id = None
-    units = None
-    map = None
-
-    under_attack = False
-    auto_evacuate = False
-    attacks = []
-
-    # list of village_id, attack_state
-    my_other_villages = {}
-    allow_support_send = True
-    allow_support_recv = True
+    __slots__ = (
+        "wrapper", "village_id", "units", "map", "under_attack", "auto_evacuate", "attacks",
+        "my_other_villages", "allow_support_send", "allow_support_recv", "flags", "runs", "logger",
+        "manage_flags_enabled", "support_factor", "current_flag", "_can_change_flag", "_sf_logged", "supported",
+    )
 
     defensive_units = ["spear", "sword", "archer", "marcher", "spy"]
 
     hide_units = ["snob", "axe"]
 
-    flags = {}
-
-    runs = 0
-    logger = None
-    manage_flags_enabled = False
-    support_factor = 0.25
     support_max_villages = 2
 
-    # flag_index, flag_level
-    current_flag = []
-
-    _can_change_flag = False
-
     # increased production
     set_flag_not_under_attack = 1
     # increased defence
     set_flag_under_attack = 4
 
-    _sf_logged = False
-
-    supported = []
-
     def __init__(self, village_id=None, wrapper=None):
         self.village_id = village_id
         self.wrapper = wrapper
+        self.units = None
+        self.map = None
+
+        self.under_attack = False
+        self.auto_evacuate = False
+        self.attacks = []
+
+        # list of village_id, attack_state
+        self.my_other_villages = {}
+        self.allow_support_send = True
+        self.allow_support_recv = True
+
+        self.flags = {}
+
+        self.runs = 0
         self.logger = logging.getLogger("Defence Manager")
+        self.manage_flags_enabled = False
+        self.support_factor = 0.25
+
+        # flag_index, flag_level
+        self.current_flag = []
+
+        self._can_change_flag = False
+        self._sf_logged = False
+        self.supported = []
 
     def support_other(self, requesting_village):
 
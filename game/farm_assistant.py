@@ -0,0 +1,144 @@
+"""
+Farm assistant (Loot Assistant) management
+Sends farms using one AJAX request per target instead of the rally point flow
+"""
+import logging
+import random
+import time
+
+from core.extractors import Extractor
+from game.simulator import Simulator
+
+
+class FarmAssistant:
+    """
+    Farm assistant class
+    """
+    wrapper = None
+    village_id = None
+    logger = logging.getLogger("Farm Assistant")
+
+    # Delay range (in seconds) between two sends, multiplied by the delay factor
+    send_delay = (0.4, 1.2)
+    # Max amount of farm list pages read per update
+    max_pages = 3
+    # Seconds the farm list is used before it is read again
+    refresh_interval = 1800
+
+    def __init__(self, wrapper=None, village_id=None):
+        """
+        Create the farm assistant
+        """
+        self.wrapper = wrapper
+        self.village_id = village_id
+        self.available = False
+        self.templates = []
+        self.farms = {}
+        self.last_update = 0
+        # Farm targets of the village when the farm list was read
+        self.targets = None
+
+    def update(self, targets=None):
+        """
+        Reads the A/B templates and the farm list
+        The list is read again after refresh_interval or when the farm targets of the village changed
+        Returns False if the farm assistant is not available on this account
+        """
+        targets = set(targets) if targets is not None else None
+        if self.last_update and targets == self.targets and time.time() - self.last_update < self.refresh_interval:
+            return self.available
+        self.last_update = time.time()
+        self.targets = targets
+
+        url = f"game.php?village={self.village_id}&screen=am_farm"
+        result = self.wrapper.get_url(url)
+        if not result or not Extractor.farm_assistant_send_link(result):
+            self.logger.debug("Farm assistant is not available for village %s", self.village_id)
+            self.available = False
+            return False
+
+        self.templates = Extractor.farm_assistant_templates(result)
+        if len(self.templates) < 2:
+            self.logger.warning("Unable to read farm assistant templates, using rally point instead")
+            self.available = False
+            return False
+
+        self.farms = Extractor.farm_assistant_rows(result)
+        for page in range(1, self.max_pages):
+            if f"Farm_page={page}" not in result.text:
+                break
+            result = self.wrapper.get_url(f"{url}&order=distance&dir=asc&Farm_page={page}")
+            if not result:
+                break
+            self.farms.update(Extractor.farm_assistant_rows(result))
+
+        self.available = True
+        self.logger.info(
+            "Farm assistant lists %d farms (A: %s B: %s)",
+            len(self.farms), self.templates[0]["units"], self.templates[1]["units"]
+        )
+        return True
+
+    @staticmethod
+    def carry(template):
+        """
+        Carry capacity of a template
+        """
+        return sum(
+            Simulator.pool[unit]["load"] * amount
+            for unit, amount in template["units"].items()
+            if unit in Simulator.pool
+        )
+
+    def sync_template(self, index, units):
+        """
+        Sets the units of template A (0) or B (1) if the template is still empty
+        """
+        if any(self.templates[index]["units"].values()):
+            return False
+        new_units = {}
+        for unit in self.templates[index]["units"]:
+            new_units[unit] = units.get(unit, 0)
+        if not any(new_units.values()):
+            return False
+        self.templates[index]["units"] = new_units
+
+        data = {"h": self.wrapper.last_h}
+        for template in self.templates:
+            data[f"template[{template['id']}][id]"] = template["id"]
+            for unit, amount in template["units"].items():
+                data[f"{unit}[{template['id']}]"] = str(amount)
+        self.wrapper.post_url(
+            url=f"game.php?village={self.village_id}&screen=am_farm&action=edit_all&mode=farm",
+            data=data,
+        )
+        self.logger.info("Set farm assistant template %s to %s", "AB"[index], str(new_units))
+        return True
+
+    def send(self, target, template):
+        """
+        Sends a template to a farm using a single AJAX request
+        """
+        self.wrapper.priority_mode = True
+        try:
+            time.sleep(random.uniform(*self.send_delay) * self.wrapper.delay)
+            result = self.wrapper.get_api_action(
+                village_id=self.village_id,
+                action="farm",
+                params={"screen": "am_farm", "mode": "farm", "json": "1"},
+                data={
+                    "target": target,
+                    "template_id": template["id"],
+                    "source": self.village_id,
+                },
+            )
+        finally:
+            self.wrapper.priority_mode = False
+
+        if type(result) != dict or result.get("error"):
+            self.logger.debug(
+                "Farm assistant send %s -> %s failed: %s",
+                self.village_id, target, str(result.get("error") if type(result) == dict else result)
+            )
+            return False
+        return result
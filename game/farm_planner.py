@@ -0,0 +1,111 @@
+"""
+Account wide farm planning
+Makes sure villages sharing the same farms do not all attack them
+"""
+import logging
+
+from game.travel import TravelCalculator
+
+
+class FarmPlanner:
+    """
+    Assigns every farm target to a single source village per cycle
+    The farms are assigned again right before every village farms, with its current targets and troops
+    """
+    logger = logging.getLogger("FarmPlanner")
+
+    def __init__(self):
+        """
+        Create the farm planner
+        """
+        self.plan = {}
+        # Attack managers of all villages, by village id
+        self.managers = {}
+        # Farms of the villages that already farmed this cycle, they keep them
+        self.farmed = {}
+
+    @staticmethod
+    def travel_time(attack, target, distance, template):
+        """
+        Travel time of a template, from the tables of the village if available
+        """
+        travel = attack.travel if attack.travel else TravelCalculator()
+        duration = travel.travel_time(attack.village_id, target, template)
+        if duration is None:
+            duration = travel.duration(distance, template)
+        return duration
+
+    @staticmethod
+    def capacity(attack):
+        """
+        The amount of farms a village can send with the troops at home
+        """
+        troops = attack.troopmanager.troops
+        templates = attack.template if type(attack.template) == list else [attack.template]
+        sendable = 0
+        for template in templates:
+            units = {u: template[u] for u in template if template[u] > 0}
+            if not units:
+                continue
+            sendable = max(
+                sendable, min(int(troops.get(u, 0)) // units[u] for u in units)
+            )
+        return min(attack.max_farms, sendable)
+
+    def start_cycle(self, attack_managers):
+        """
+        Starts a new cycle, none of the villages farmed yet
+        """
+        self.managers = {attack.village_id: attack for attack in attack_managers}
+        self.farmed = {}
+
+    def plan_for(self, attack):
+        """
+        Assigns the farms right before a village farms
+        Farms of villages that already farmed this cycle are not assigned again
+        Returns the farms of the village
+        """
+        self.managers[attack.village_id] = attack
+        self.assign(
+            [manager for vid, manager in self.managers.items() if vid not in self.farmed],
+            exclude=set().union(*self.farmed.values()),
+        )
+        planned = set(self.plan.get(attack.village_id, []))
+        self.farmed[attack.village_id] = planned
+        self.logger.info("Village %s was assigned %d farms", attack.village_id, len(planned))
+        return planned
+
+    def assign(self, attack_managers, exclude=None):
+        """
+        Greedy matching of farms to villages on travel time, farms in exclude are skipped
+        Publishes the result to the attack manager of every village
+        """
+        exclude = exclude or set()
+        edges = []
+        capacity = {}
+        for attack in attack_managers:
+            if not attack.targets:
+                continue
+            capacity[attack.village_id] = self.capacity(attack)
+            template = attack.template[0] if type(attack.template) == list else attack.template
+            for village, distance in attack.targets:
+                if village["id"] in exclude:
+                    continue
+                edges.append((
+                    self.travel_time(attack, village["id"], distance, template), attack.village_id, village["id"]
+                ))
+        edges.sort()
+
+        self.plan = {vid: [] for vid in capacity}
+        assigned = set()
+        for _, source, target in edges:
+            if target in assigned or capacity[source] <= 0:
+                continue
+            self.plan[source].append(target)
+            capacity[source] -= 1
+            assigned.add(target)
+
+        for attack in attack_managers:
+            if attack.village_id in self.plan:
+                attack.planned_targets = set(self.plan[attack.village_id])
+        return self.plan
@@ -0,0 +1,175 @@
+"""
+Zero loss farm templates
+Uses the battle simulator to find the cheapest troops that beat the scouted defence of a farm without losses
+"""
+import logging
+import math
+
+from game.simulator import HAS_NUMPY, BatchSimulator, Simulator
+
+
+class FarmSolver:
+    """
+    Finds the cheapest composition that wins against the last known defence of a farm without losses
+    and carries the expected loot
+    Simulation results are cached per farm for the newest intel and the last few troop availability buckets
+    """
+    logger = logging.getLogger("FarmSolver")
+
+    # Units that are used for farms
+    units = ["spear", "sword", "axe", "archer", "light", "marcher", "heavy"]
+    # Luck used in the simulation, a solution is also free of losses when the attack is unlucky
+    luck = -25
+    # Amounts per unit are tried on a grid growing with this factor
+    grid_factor = 1.5
+    # Troop amounts are rounded down to this many steps per doubling, small changes reuse the cached result
+    bucket_steps = 4
+    # Troop buckets kept per village, the oldest one is dropped first
+    cache_buckets = 4
+
+    def __init__(self, repman=None, loot_model=None):
+        """
+        Create the solver, combinations of two unit types are only tried when NumPy is available
+        """
+        self.repman = repman
+        self.loot_model = loot_model
+        self.batch = BatchSimulator() if HAS_NUMPY else None
+        self.simulator = Simulator()
+        # {vid: (intel version, {troop bucket: [(cost, carry, units), ...]})} winning compositions without losses
+        # Only the results of the newest intel are kept
+        self.cache = {}
+
+    def intel(self, vid):
+        """
+        Last known defence and wall of a village from the report index
+        Returns (version, defence, wall), None if the defence was never seen
+        The version holds the time of both reports, a newer report that only saw the wall also changes it
+        """
+        if not self.repman:
+            return None
+        village = self.repman.village(vid)
+        if not village or not village["defence"]:
+            return None
+        wall = village["wall"]["level"] if village["wall"] else 0
+        version = (village["defence"]["when"], village["wall"]["when"] if village["wall"] else None)
+        return version, village["defence"]["units"], wall
+
+    def bucket(self, amount):
+        """
+        Rounds an amount down to the availability bucket
+        """
+        if amount < 1:
+            return 0
+        step = math.floor(math.log2(amount) * self.bucket_steps) / self.bucket_steps
+        return int(math.pow(2, step))
+
+    def grid(self, maximum):
+        """
+        Amounts of a unit that are tried, up to the available amount
+        """
+        output = []
+        amount = 1
+        while amount < maximum:
+            output.append(amount)
+            amount = max(amount + 1, int(amount * self.grid_factor))
+        if maximum >= 1:
+            output.append(maximum)
+        return output
+
+    def candidates(self, available):
+        """
+        Compositions of one unit type, and of two types when the batch simulator is available
+        """
+        grids = {unit: self.grid(available.get(unit, 0)) for unit in self.units if available.get(unit, 0)}
+        output = [{unit: amount} for unit, amounts in grids.items() for amount in amounts]
+        if self.batch:
+            types = list(grids)
+            for index, first in enumerate(types):
+                for second in types[index + 1:]:
+                    for first_amount in grids[first]:
+                        for second_amount in grids[second]:
+                            output.append({first: first_amount, second: second_amount})
+        return output
+
+    @staticmethod
+    def cost(units):
+        """
+        Troop time of a composition: population times the speed of its slowest unit
+        """
+        population = sum(Simulator.pool[unit]["food"] * amount for unit, amount in units.items())
+        return population * max(Simulator.pool[unit]["speed"] for unit in units)
+
+    @staticmethod
+    def carry(units):
+        """
+        Carry capacity of a composition
+        """
+        return sum(Simulator.pool[unit]["load"] * amount for unit, amount in units.items())
+
+    def safe_compositions(self, candidates, defence, wall):
+        """
+        The candidates that destroy the defence without losing a unit
+        """
+        if not candidates:
+            return []
+        if self.batch:
+            result = self.batch.simulate_batch(candidates, [defence], wall=wall, luck=self.luck)
+            won = result["defender_losses"].sum(axis=1) >= result["defender"].sum(axis=1)
+            safe = won & (result["attacker_losses"].sum(axis=1) == 0)
+            return [candidate for candidate, ok in zip(candidates, safe) if ok]
+        output = []
+        for candidate in candidates:
+            result = self.simulator.simulate(candidate, defence, wall, False, 100, self.luck)
+            won = sum(result["defender"]["losses"].values()) >= sum(result["defender"]["quantity"].values())
+            if won and not any(result["attacker"]["losses"].values()):
+                output.append(candidate)
+        return output
+
+    def solve(self, vid, available, loot=0):
+        """
+        Cheapest composition that wins against the defence of a village without losses
+        and carries the loot (the most carrying safe composition if none carries all of it)
+        Returns None if the defence of the village is unknown, False if no safe composition exists
+        """
+        intel = self.intel(vid)
+        if not intel:
+            return None
+        version, defence, wall = intel
+        bucketed = {unit: self.bucket(int(available.get(unit, 0))) for unit in self.units}
+        key = tuple(bucketed[unit] for unit in self.units)
+        if vid not in self.cache or self.cache[vid][0] != version:
+            self.cache[vid] = (version, {})
+        results = self.cache[vid][1]
+        if key in results:
+            # Most recently used last
+            results[key] = results.pop(key)
+        else:
+            safe = self.safe_compositions(self.candidates(bucketed), defence, wall)
+            results[key] = sorted(
+                [(self.cost(units), self.carry(units), units) for units in safe], key=lambda entry: (entry[0], -entry[1])
+            )
+            while len(results) > self.cache_buckets:
+                results.pop(next(iter(results)))
+            self.logger.debug(
+                "%s: %d safe compositions against %s (wall %d)", vid, len(results[key]), str(defence), wall
+            )
+        solutions = results[key]
+        if not solutions:
+            return False
+        for cost, carry, units in solutions:
+            if carry >= (loot or 0):
+                return dict(units)
+        return dict(max(solutions, key=lambda entry: (entry[1], -entry[0]))[2])
+
+    def template(self, vid, distance, available, template):
+        """
+        Zero loss farm template for a village
+        The loot is predicted by the loot model, without one the static template sets the haul
+        Returns None if the defence is unknown, False if the village can not be farmed without losses
+        """
+        loot = None
+        if self.loot_model:
+            loot = self.loot_model.expected_loot(vid, distance, template)
+        if loot is None:
+            loot = self.carry({unit: amount for unit, amount in template.items() if unit in Simulator.pool})
+        return self.solve(vid, available, loot=loot)
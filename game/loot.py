@@ -0,0 +1,195 @@
+"""
+Loot prediction for farms
+Estimates the resources of a farm on arrival using scout and attack reports
+"""
+import math
+import time
+
+from game.simulator import Simulator
+from game.travel import TravelCalculator
+
+
+class LootModel:
+    """
+    Predicts loot and sizes farm templates based on the expected haul
+    """
+    resources = ["wood", "stone", "iron"]
+
+    # Farms predicted to have less than this amount of resources are skipped
+    min_loot = 100
+    # Limits how much a farm template can be shrunk or grown
+    min_scale = 0.25
+    max_scale = 3.0
+
+    # Units that are never scaled (not carrying loot or only sent once)
+    fixed_units = ["spy", "knight", "ram", "catapult", "snob"]
+
+    def __init__(self, repman=None, travel=None, world_speed=1.0):
+        """
+        Create the loot model
+        """
+        self.repman = repman
+        self.travel = travel if travel else TravelCalculator(world_speed=world_speed)
+        self.world_speed = world_speed
+
+    @staticmethod
+    def production(level):
+        """
+        Resources produced per hour by a resource building (world speed 1)
+        """
+        if not level:
+            return 5
+        return 30 * math.pow(1.163118, level - 1)
+
+    @staticmethod
+    def storage_capacity(level):
+        """
+        Storage capacity per resource
+        """
+        if not level:
+            return 1000
+        return 1000 * math.pow(1.2294934, level - 1)
+
+    @staticmethod
+    def hidden(level):
+        """
+        Amount of resources per type protected by the hiding place
+        """
+        if not level:
+            return 0
+        return 150 * math.pow(1.3335, level - 1)
+
+    def reports_for(self, vid):
+        """
+        All timestamped reports on a village, oldest first
+        """
+        if not self.repman:
+            return []
+        output = []
+        for entry in self.repman.reports_on(vid):
+            if entry["extra"].get("when", None):
+                output.append(entry)
+        return sorted(output, key=lambda x: int(x["extra"]["when"]))
+
+    def advance(self, amount, buildings, seconds):
+        """
+        Adds production over a period of time, capped by the storage
+        """
+        capacity = self.storage_capacity(buildings.get("storage", 0))
+        output = {}
+        for res in self.resources:
+            produced = self.production(buildings.get(res, 0)) * self.world_speed * seconds / 3600
+            output[res] = min(max(capacity, amount[res]), amount[res] + produced)
+        return output
+
+    def intel(self, vid):
+        """
+        Replays the reports on a village
+        Returns the known building levels and the estimated resources at a given time
+        """
+        buildings = {}
+        amount = None
+        when = None
+        for entry in self.reports_for(vid):
+            extra = entry["extra"]
+            if extra.get("buildings", None):
+                buildings = extra["buildings"]
+            if extra.get("resources", None):
+                amount = {res: int(extra["resources"].get(res, 0)) for res in self.resources}
+                when = int(extra["when"])
+                continue
+            if amount is None:
+                continue
+            amount = self.advance(amount, buildings, int(extra["when"]) - when)
+            when = int(extra["when"])
+            for res, looted in extra.get("loot", {}).items():
+                if res in amount:
+                    amount[res] = max(0, amount[res] - int(looted))
+        return buildings, amount, when
+
+    def predict(self, vid, arrival):
+        """
+        Predicts the lootable resources per type on arrival
+        None if there is no usable intel on the village
+        """
+        buildings, amount, when = self.intel(vid)
+        if amount is None:
+            return None
+        amount = self.advance(amount, buildings, max(0, arrival - when))
+        hidden = self.hidden(buildings.get("hide", 0))
+        return {res: int(max(0, amount[res] - hidden)) for res in self.resources}
+
+    @staticmethod
+    def carry(units):
+        """
+        Total carry capacity of a set of units
+        """
+        return sum(Simulator.pool[u]["load"] * units[u] for u in units if u in Simulator.pool)
+
+    @staticmethod
+    def population(units):
+        """
+        Total population used by a set of units
+        """
+        return sum(Simulator.pool[u]["food"] * units[u] for u in units if u in Simulator.pool)
+
+    def travel_time(self, distance, units):
+        """
+        Travel time in seconds, based on the slowest unit
+        """
+        return self.travel.duration(distance, units)
+
+    def expected_loot(self, vid, distance, template):
+        """
+        Expected total haul on arrival, None if the farm was never scouted or attacked
+        """
+        predicted = self.predict(vid, time.time() + self.travel_time(distance, template))
+        if predicted is None:
+            return None
+        return sum(predicted.values())
+
+    def scale(self, expected, template):
+        """
+        Factor the template has to be scaled with to carry the expected loot
+        """
+        capacity = self.carry(template)
+        if expected is None or not capacity:
+            return 1.0
+        return min(self.max_scale, max(self.min_scale, expected / capacity))
+
+    def score(self, vid, distance, template):
+        """
+        Expected loot per troop-hour, unknown farms are expected to fill the template
+        """
+        expected = self.expected_loot(vid, distance, template)
+        capacity = self.carry(template)
+        if expected is None:
+            expected = capacity
+        scale = self.scale(expected, template)
+        hours = 2 * self.travel_time(distance, template) / 3600
+        population = self.population(template) * scale
+        if not hours or not population:
+            return 0
+        return min(expected, capacity * scale) / (population * hours)
+
+    def size_template(self, vid, distance, template, available=None):
+        """
+        Scales the farm template to the expected loot
+        Returns None if the farm is expected to be empty
+        """
+        expected = self.expected_loot(vid, distance, template)
+        if expected is None:
+            return template
+        if expected < self.min_loot:
+            return None
+        scale = self.scale(expected, template)
+        output = {}
+        for unit, amount in template.items():
+            if unit in self.fixed_units or unit not in Simulator.pool:
+                output[unit] = amount
+                continue
+            sized = max(1, int(math.ceil(amount * scale)))
+            if available and sized > amount:
+                sized = min(sized, max(amount, int(available.get(unit, 0))))
+            output[unit] = sized
+        return output
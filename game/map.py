@@ -13,13 +13,8 @@ class Map:
     """
     Class to manage the world around you
     """
-    wrapper = None
-    village_id = None
-    map_data = []
-    villages = {}
-    my_location = None
-    map_pos = {}
-    last_fetch = 0
+    __slots__ = ("wrapper", "village_id", "map_data", "villages", "my_location", "map_pos", "last_fetch")
+    # Hours between map fetches
     fetch_delay = 8
 
     def __init__(self, wrapper=None, village_id=None):
@@ -28,6 +23,30 @@ class Map:
         """
         self.wrapper = wrapper
         self.village_id = village_id
+        self.map_data = []
+        self.villages = {}
+        self.my_location = None
+        self.map_pos = {}
+        self.last_fetch = 0
+
+    def get_state(self):
+        """
+        State kept over a restart (checkpoint), the villages themselves are in the map cache
+        """
+        return {"last_fetch": self.last_fetch, "my_location": self.my_location, "villages": list(self.villages)}
+
+    def set_state(self, state):
+        """
+        Restores the state of a checkpoint from the map cache, the map is fetched again if that fails
+        """
+        for vid in state.get("villages", []):
+            entry = self.in_cache(vid)
+            if entry:
+                self.villages[vid] = entry
+                self.map_pos[vid] = entry["location"]
+        self.my_location = state.get("my_location", None)
+        if self.villages and self.my_location:
+            self.last_fetch = state.get("last_fetch", 0)
 
     def get_map(self):
         """
@@ -0,0 +1,168 @@
+"""
+Account wide recruitment
+Recruits for all villages at once from the mass recruitment screen
+"""
+import logging
+import time
+
+from core.extractors import Extractor
+
+
+class MassRecruiter:
+    """
+    Plans the recruitment of every village and sends it through the mass recruitment form
+    """
+    logger = logging.getLogger("MassRecruit")
+
+    # Max amount of mass recruitment pages read per run
+    max_pages = 20
+    # Seconds the unit data (costs, build times, research) of a village is used before the train screen is read again
+    unit_data_interval = 3600
+    # Buildings that change the build times when upgraded
+    recruit_buildings = ["barracks", "stable", "garage"]
+
+    def __init__(self, wrapper=None):
+        """
+        Create the mass recruiter
+        """
+        self.wrapper = wrapper
+        # None until the mass recruitment screen was read once
+        self.supported = None
+        # Time and recruitment building levels of the last train screen read per village
+        self.unit_data = {}
+
+    def read(self, village_id, page=0):
+        """
+        Reads a page of the mass recruitment screen
+        None if the page could not be loaded, False if it loaded without the mass recruitment form
+        """
+        url = f"game.php?village={village_id}&screen=train&mode=mass"
+        if page > 0:
+            url += f"&page={page}"
+        result = self.wrapper.get_url(url)
+        # A page without game data (expired session) says nothing about the mass recruitment screen
+        if not result or not Extractor.game_state(result):
+            return None
+        return Extractor.mass_recruit_form(result) or False
+
+    def orders(self, village, buildings, horizon):
+        """
+        Recruitment plan of a single village from its last known state
+        The unit data (costs, build times and research) is read from the train screen again
+        after unit_data_interval or when a recruitment building was upgraded
+        """
+        units = village.units
+        levels = [village.builder.get_level(building) for building in self.recruit_buildings] if village.builder else []
+        last = self.unit_data.get(village.village_id, None)
+        queue_ends = {building: None for building in buildings}
+        if not units.recruit_data or not last or last[1] != levels or time.time() - last[0] > self.unit_data_interval:
+            snapshot = units.recruit_snapshot()
+            if snapshot is None:
+                return {}
+            self.unit_data[village.village_id] = (time.time(), levels)
+            for building, end in snapshot.items():
+                if end and building in units.wait_for[units.village_id]:
+                    units.set_busy(building, end)
+            queue_ends = dict({building: 0 for building in buildings}, **snapshot)
+        else:
+            units.game_data = village.game_data
+        return units.recruitment_orders(buildings, queue_ends, village.disabled_units, horizon)
+
+    def submit(self, form, plans):
+        """
+        Sends all orders of the villages on a single form page
+        Returns the submitted orders per village and building, and if the game accepted all of them
+        """
+        data = dict(form["hidden"])
+        submitted = {}
+        for village_id, plan in plans.items():
+            fields = form["fields"].get(str(village_id), None)
+            if not fields:
+                continue
+            submitted[village_id] = {}
+            for building, units in plan.items():
+                units = {unit: amount for unit, amount in units.items() if unit in fields}
+                for unit, amount in units.items():
+                    data[fields[unit]] = str(amount)
+                if units:
+                    submitted[village_id][building] = units
+        if submitted:
+            if "h" not in data:
+                data["h"] = self.wrapper.last_h
+            result = self.wrapper.post_url(form["action"], data=data)
+            # An error or a page without game data (expired session) leaves it unknown what was queued
+            if not result or '<div class="error_box">' in result.text or not Extractor.game_state(result):
+                return submitted, False
+        return submitted, True
+
+    def verify(self, units, plan):
+        """
+        Registers the orders of a village that were queued, read from its train screen
+        Used when the game refused (part of) a mass recruitment
+        """
+        before = dict(units.wait_for[units.village_id])
+        queue_ends = units.recruit_snapshot()
+        if queue_ends is None:
+            return
+        for building, planned in plan.items():
+            end = queue_ends.get(building, None)
+            if end and end > max(time.time(), before.get(building, 0)):
+                units.recruited(building, planned, end)
+            else:
+                self.logger.warning("Recruitment of %s in %s was not queued", str(planned), units.village_id)
+
+    def run(self, villages, horizon=3600):
+        """
+        Mass recruitment for all villages that can recruit
+        Returns False if the mass recruitment screen is not available (use the per village recruitment instead)
+        """
+        if self.supported is False or not villages:
+            return False
+        form = self.read(villages[0].village_id)
+        if form is None:
+            self.logger.warning("Unable to read the mass recruitment screen, trying again next cycle")
+            return True
+        if not form or not form["fields"]:
+            self.logger.info("Mass recruitment not available, recruiting per village")
+            self.supported = False
+            return False
+        self.supported = True
+
+        plans = {}
+        for village in villages:
+            buildings = village.recruit_buildings()
+            if not buildings:
+                continue
+            plan = self.orders(village, buildings, horizon)
+            if plan:
+                plans[village.village_id] = plan
+        if not plans:
+            self.logger.info("Recruitment up-to-date or waiting for resources")
+            return True
+
+        by_id = {v.village_id: v for v in villages}
+        page = 0
+        remaining = dict(plans)
+        while remaining:
+            submitted, accepted = self.submit(form, remaining)
+            for village_id, plan in submitted.items():
+                remaining.pop(village_id)
+                units = by_id[village_id].units
+                if not accepted:
+                    self.verify(units, plan)
+                    continue
+                for building, planned in plan.items():
+                    # Only the submitted units, the rest of the queue stays free
+                    busy = max(time.time(), units.wait_for[units.village_id][building]) + sum(
+                        amount * int(units.recruit_data[unit]["build_time"]) for unit, amount in planned.items()
+                    )
+                    units.recruited(building, planned, busy)
+            page += 1
+            if page > form["pages"] or page >= self.max_pages:
+                break
+            form = self.read(villages[0].village_id, page)
+            if not form:
+                break
+        if remaining:
+            self.logger.warning("Villages %s were not found on the mass recruitment screen", list(remaining))
+        return True
@@ -14,11 +14,19 @@ class ReportManager:
     """
     Class to "efficiently" manage reports
     """
-    wrapper = None
-    village_id = None
-    game_state = None
-    logger = None
-    last_reports = {}
+    __slots__ = ("wrapper", "village_id", "game_state", "logger", "last_reports", "index", "index_changed")
+
+    # Max requests (list pages and reports) spent on reading older reports per tab and run
+    backfill_budget = 10
+    # Older reports are never read beyond this page
+    backfill_pages = 20
+
+    # Report list tabs holding the reports the farm and defence logic use
+    read_modes = ["attack", "defense"]
+    # List icons of reports that are never downloaded (support, trade)
+    ignored_icons = ["support", "trade", "return"]
+    # Skipped report ids kept in the cursor per tab, older ones are below the backfill position anyway
+    max_skipped = 500
 
     def __init__(self, wrapper=None, village_id=None):
         """
@@ -26,6 +34,48 @@ class ReportManager:
         """
         self.wrapper = wrapper
         self.village_id = village_id
+        self.game_state = None
+        self.logger = None
+        # Reports that were read from the cache or processed, by report id
+        self.last_reports = {}
+        self.index = None
+        self.index_changed = False
+
+    def get_index(self):
+        """
+        The per village report index, built from the local report cache if it was never stored
+        """
+        if self.index is None:
+            self.index = ReportCache.get_index()
+            if self.index is None:
+                if not self.logger:
+                    self.logger = logging.getLogger("Reports")
+                self.index = ReportCache.build_index()
+                self.logger.info("Indexed reports of %d villages", len(self.index))
+                ReportCache.set_index(self.index)
+        return self.index
+
+    def village(self, vid):
+        """
+        Index entry of a village: report ids, newest report, newest defence and wall
+        None if there is no report on the village
+        """
+        return self.get_index().get(vid, None)
+
+    def reports_on(self, vid):
+        """
+        All reports on a village, only the reports of this village are read from the cache
+        """
+        entry = self.village(vid)
+        if not entry:
+            return []
+        output = []
+        for report_id in entry["reports"]:
+            if report_id not in self.last_reports:
+                self.last_reports[report_id] = ReportCache.get_cache(report_id)
+            if self.last_reports[report_id]:
+                output.append(self.last_reports[report_id])
+        return output
 
     def has_resources_left(self, vid):
         """
@@ -33,9 +83,8 @@ class ReportManager:
         Used by the farm manager script
         """
         possible_reports = []
-        for repid in self.last_reports:
-            entry = self.last_reports[repid]
-            if vid == entry["dest"] and entry["extra"].get("when", None):
+        for entry in self.reports_on(vid):
+            if entry["extra"].get("when", None):
                 possible_reports.append(entry)
         # self.logger.debug(f"Considered {len(possible_reports)} reports")
         if len(possible_reports) == 0:
@@ -53,13 +102,19 @@ class ReportManager:
             return True, entry["extra"]["resources"]
         return False, {}
 
+    def last_seen(self, vid):
+        """
+        Timestamp of the newest report on a village
+        """
+        entry = self.village(vid)
+        return entry["seen"] if entry else None
+
     def safe_to_engage(self, vid):
         """
         Calculates if a village is safe to engage without custom interaction
         Just sending a 0 losses attack overrides this behaviour
         """
-        for repid in self.last_reports:
-            entry = self.last_reports[repid]
+        for entry in self.reports_on(vid):
             if vid == entry["dest"]:
                 if entry["type"] == "attack" and entry["losses"] == {}:
                     return 1
@@ -92,49 +147,155 @@ class ReportManager:
                     return 0  # Disengage if anything was lost!
         return -1
 
-    def read(self, page=0, full_run=False):
+    def read(self, full_run=False):
         """
-        Read some (or all if you like) reports
+        Read new reports and continue reading older ones (if any are left)
+        Only the report tabs the farm and defence logic use are read
+        full_run restarts reading older reports from the first page
         """
         if not self.logger:
             self.logger = logging.getLogger("Reports")
 
-        if len(self.last_reports) == 0:
-            self.logger.info("First run, re-reading cache entries")
-            self.last_reports = ReportCache.cache_grab()
-            self.logger.info("Got %d reports from cache", len(self.last_reports))
-        offset = page * 12
-        url = f"game.php?village={self.village_id}&screen=report&mode=all"
+        cursor = ReportCache.get_cursor()
+        for mode in self.read_modes:
+            state = cursor.get(mode, None)
+            if not state:
+                state = {"high": 0, "backfill": None}
+            state.setdefault("skipped", [])
+            if full_run:
+                state["backfill"] = {"page": 1, "low": None, "until": 0}
+            self.read_new(mode, state)
+            if state["backfill"]:
+                self.read_old(mode, state)
+            if self.index_changed:
+                ReportCache.set_index(self.index)
+                self.index_changed = False
+            cursor[mode] = state
+            ReportCache.set_cursor(cursor)
+
+    def known(self, report_id, state):
+        """
+        Checks if a report was already read (or skipped) without loading the report history
+        """
+        if int(report_id) in state["skipped"]:
+            return True
+        return report_id in self.last_reports or ReportCache.has_cache(report_id)
+
+    def consumes(self, entry):
+        """
+        Checks on the list metadata if the full report is worth a request
+        """
+        for icon in entry["icons"]:
+            if icon in self.ignored_icons:
+                return False
+        return True
+
+    def list_page(self, mode, page):
+        """
+        Gets the report list metadata of a single report tab page
+        """
+        url = f"game.php?village={self.village_id}&screen=report&mode={mode}"
         if page > 0:
-            url += f"&from={offset}"
+            url += f"&from={page * 12}"
         result = self.wrapper.get_url(url)
         self.game_state = Extractor.game_state(result)
-        new = 0
-
-        ids = Extractor.report_table(result)
-        for report_id in ids:
-            if report_id in self.last_reports:
-                continue
-            new += 1
-            url = f"game.php?village={self.village_id}&screen=report&mode=all&group_id=0&view={report_id}"
-            data = self.wrapper.get_url(url)
-
-            get_type = re.search(r'class="report_(\w+)', data.text)
-            if get_type:
-                report_type = get_type.group(1)
-                if report_type == "ReportAttack":
-                    self.attack_report(data.text, report_id)
-                    continue
+        return Extractor.report_list(result)
 
-                else:
-                    res = self.put(report_id, report_type=report_type)
-                    self.last_reports[report_id] = res
-        if new == 12 or full_run and page < 20:
+    def read_new(self, mode, state):
+        """
+        Reads the newest pages of a report tab until the highest known report is found
+        Without a cursor only the first page is read, the rest is left to the backfill
+        """
+        high = state["high"]
+        newest = high
+        page = 0
+        while True:
+            entries = self.list_page(mode, page)
+            reached = not high
+            for entry in entries:
+                report_id = int(entry["id"])
+                if report_id <= high:
+                    reached = True
+                    break
+                newest = max(newest, report_id)
+                self.ingest(mode, entry, state)
+            if reached or len(entries) < 12:
+                break
+            if page + 1 >= self.backfill_pages:
+                # Too many new reports, read whatever is left in between later on
+                state["backfill"] = {"page": page + 1, "low": None, "until": high}
+                break
             page += 1
-            self.logger.debug(
-                "%d new reports where added, also checking page %d", new, page
-            )
-            return self.read(page, full_run=full_run)
+        if not high and entries and len(entries) == 12 and not state["backfill"]:
+            state["backfill"] = {"page": 1, "low": None, "until": 0}
+        if newest > high:
+            self.logger.debug("Newest %s report is now %d (was %d)", mode, newest, high)
+        state["high"] = newest
+
+    def read_old(self, mode, state):
+        """
+        Continues reading older reports of a report tab within the request budget
+        The position is stored so the next run continues where this one stopped
+        """
+        backfill = state["backfill"]
+        budget = self.backfill_budget
+        while budget > 0:
+            if backfill["page"] >= self.backfill_pages:
+                backfill = None
+                break
+            entries = self.list_page(mode, backfill["page"])
+            budget -= 1
+            finished = False
+            for entry in entries:
+                report_id = int(entry["id"])
+                if backfill["low"] and report_id >= backfill["low"]:
+                    # Shifted down by newer reports, already handled
+                    continue
+                if report_id <= backfill["until"]:
+                    finished = True
+                    break
+                if budget <= 0:
+                    break
+                if self.ingest(mode, entry, state):
+                    budget -= 1
+                backfill["low"] = report_id
+            else:
+                backfill["page"] += 1
+                finished = len(entries) < 12
+            if finished:
+                backfill = None
+                break
+        if backfill:
+            self.logger.debug("Reading older %s reports continues at page %d", mode, backfill["page"])
+        else:
+            self.logger.debug("All older %s reports were read", mode)
+        state["backfill"] = backfill
+
+    def ingest(self, mode, entry, state):
+        """
+        Reads a single report from the list
+        Skipped reports are only remembered in the cursor state of the tab
+        Returns True if the full report was requested
+        """
+        report_id = entry["id"]
+        if self.known(report_id, state):
+            return False
+        if not self.consumes(entry):
+            self.logger.debug("Skipped report %s: %s", report_id, entry["subject"])
+            state["skipped"] = sorted(state["skipped"] + [int(report_id)])[-self.max_skipped:]
+            return False
+        url = f"game.php?village={self.village_id}&screen=report&mode={mode}&group_id=0&view={report_id}"
+        data = self.wrapper.get_url(url)
+
+        get_type = re.search(r'class="report_(\w+)', data.text)
+        if get_type:
+            report_type = get_type.group(1)
+            if report_type == "ReportAttack":
+                self.attack_report(data.text, report_id)
+            else:
+                res = self.put(report_id, report_type=report_type)
+                self.last_reports[report_id] = res
+        return True
 
     def re_unit(self, inp):
         """
@@ -288,6 +449,8 @@ class ReportManager:
             "extra": data,
         }
         ReportCache.set_cache(report_id, output)
+        ReportCache.index_report(self.get_index(), report_id, output)
+        self.index_changed = True
         self.logger.info(
             "Processed %s report with id %s", report_type, str(report_id)
         )
@@ -312,6 +475,97 @@ class ReportCache:
         """
         FileManager.save_json_file(entry, f"cache/reports/{report_id}.json")
 
+    @staticmethod
+    def has_cache(report_id):
+        """
+        Checks if a report entry exists without reading it
+        """
+        return FileManager.path_exists(FileManager.get_path(f"cache/reports/{report_id}.json"))
+
+    @staticmethod
+    def get_cursor():
+        """
+        Reads the report cursor (newest report and position of older reports per tab)
+        Stored outside of the reports directory, the webmanager reads every file in there
+        """
+        return FileManager.load_json_file("cache/reports_cursor.json") or {}
+
+    @staticmethod
+    def set_cursor(cursor):
+        """
+        Stores the report cursor
+        """
+        FileManager.save_json_file(cursor, "cache/reports_cursor.json")
+
+    @staticmethod
+    def get_index():
+        """
+        Reads the per village report index, None if it was never stored
+        """
+        return FileManager.load_json_file("cache/reports_index.json")
+
+    @staticmethod
+    def set_index(index):
+        """
+        Stores the per village report index
+        """
+        FileManager.save_json_file(index, "cache/reports_index.json")
+
+    @staticmethod
+    def build_index():
+        """
+        Creates the per village report index from all locally stored reports
+        """
+        index = {}
+        reports = ReportCache.cache_grab()
+        for report_id in sorted(reports, key=lambda x: int(x) if x.isdigit() else 0):
+            ReportCache.index_report(index, report_id, reports[report_id])
+        return index
+
+    @staticmethod
+    def index_report(index, report_id, entry):
+        """
+        Adds a report to the index of the village it is about
+        Keeps the newest report time, the newest seen defence (without its losses) and the newest wall level
+        """
+        if not entry or not entry.get("dest", None):
+            return
+        village = index.setdefault(entry["dest"], {"reports": [], "seen": None, "defence": None, "wall": None})
+        if report_id not in village["reports"]:
+            village["reports"].append(report_id)
+        extra = entry["extra"]
+        if not extra.get("when", None):
+            return
+        when = int(extra["when"])
+        village["seen"] = max(village["seen"] or 0, when)
+        if "defence_units" in extra and (not village["defence"] or when > village["defence"]["when"]):
+            losses = extra.get("defence_losses", {})
+            village["defence"] = {
+                "when": when,
+                "units": {
+                    unit: amount - losses.get(unit, 0)
+                    for unit, amount in extra["defence_units"].items()
+                    if amount - losses.get(unit, 0) > 0
+                },
+            }
+        if "buildings" in extra and (not village["wall"] or when >= village["wall"]["when"]):
+            village["wall"] = {"when": when, "level": extra["buildings"].get("wall", 0)}
+
+    @staticmethod
+    def village_reports(index, vid):
+        """
+        Reads the stored reports on a single village
+        """
+        village = index.get(vid, None)
+        if not village:
+            return {}
+        output = {}
+        for report_id in village["reports"]:
+            entry = ReportCache.get_cache(report_id)
+            if entry:
+                output[report_id] = entry
+        return output
+
     @staticmethod
     def cache_grab():
         """
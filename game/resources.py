@@ -2,6 +2,7 @@
 Anything with resources goes here
 """
 import logging
+import math
 import re
 import time
 
@@ -44,70 +45,210 @@ class PremiumExchange:
 
     def calculate_rate_for_one_point(self, item: str):
         """
-        Math magic
+        The amount of resources that sells for one premium point
+        The cost is quadratic in the amount: (1 + tax) * (p * a + e * a^2 / 2d)
+        so cost(a) = 1 is solved directly instead of searched
         """
-        a = self.stock[item]
-        t = self.capacity[item]
-        n = self.calculate_marginal_price(a, t)
-        r = int(1 / n)
-        c = self.calculate_cost(item, r)
-        i = 0
-
-        while c > 1 and i < 50:
-            r -= 1
-            i += 1
-            c = self.calculate_cost(item, r)
+        t = self.stock[item]
+        n = self.capacity[item]
+        c = self.constants
+        tax = self.tax["sell"]
+        price = self.calculate_marginal_price(t, n)
+        r = int(1 / price)
 
-        return r
+        slope = c["resource_price_elasticity"] / (n + c["stock_size_modifier"])
+        if slope:
+            solved = (math.sqrt(price * price + 2 * slope / (1 + tax)) - price) / slope
+        else:
+            solved = 1 / ((1 + tax) * price)
+        solved = min(r, int(solved))
+        # Correct floating point errors around the root
+        while solved < r and self.calculate_cost(item, solved + 1) <= 1:
+            solved += 1
+        while solved > r - 50 and self.calculate_cost(item, solved) > 1:
+            solved -= 1
+        return max(r - 50, solved)
 
     @staticmethod
     def optimize_n(amount, sell_price, merchants, size=1000):
         """
-        Math magic
+        Finds the amount of points (and merchants) that wastes the least merchant capacity
+        Per merchant count only the largest amount of points that still fits can be the best option
         """
-        def _ratio(a, b, size=1000):
-            a = (size * b) - a
-            return a / size
+        max_points = amount // sell_price
+        best = None
+        for i in range(1, merchants + 1):
+            j = min(max_points, (size * i) // sell_price)
+            r = ((size * i) - j * sell_price) / size
+            # Lowest waste first, more merchants on equal waste
+            if best is None or r <= best[1]:
+                best = (i, r, j)
 
-        offers = []
+        return {
+            "merchants": best[0],
+            "ratio": best[1],
+            "n_to_sell": best[2] - 1
+        }
 
-        for i in range(1, merchants + 1):
-            for j in range(amount // sell_price + 1):
-                r = _ratio(j * sell_price, i, size=size)
-                if r >= 0:
-                    offers.append((i, r, j))
+    def allocate(self, excess: dict, merchants=None, size=1000):
+        """
+        Divides the available merchants over all resources at once
+        Every merchant goes to the resource that gains the most points with it
+        """
+        merchants = self.merchants if merchants is None else merchants
+        rates = {item: self.calculate_rate_for_one_point(item) for item in excess}
+        allocation = {item: 0 for item in excess}
 
-        offers.sort(key=lambda x: (x[1], -x[0]))
+        def points(item, count):
+            carried = min(int(excess[item]), count * size)
+            return carried // rates[item] if rates[item] > 0 else 0
 
-        r = {
-            "merchants": offers[0][0],
-            "ratio": offers[0][1],
-            "n_to_sell": offers[0][2]-1
+        for _ in range(merchants):
+            gains = [
+                (points(item, allocation[item] + 1) - points(item, allocation[item]), item)
+                for item in excess
+            ]
+            gain, item = max(gains)
+            if gain <= 0:
+                break
+            allocation[item] += 1
+
+        return {
+            item: {
+                "merchants": allocation[item],
+                "rate": rates[item],
+                "points": points(item, allocation[item]),
+            }
+            for item in excess
         }
 
-        return r
+
+class ResourceProjection:
+    """
+    Projects the resources of a village in time
+    Based on production rates, the storage capacity, reserved costs and incoming merchants
+    """
+    resources = ["wood", "stone", "iron"]
+
+    def __init__(self):
+        """
+        Create the resource projection
+        """
+        self.amount = {res: 0 for res in self.resources}
+        self.rates = {res: 0.0 for res in self.resources}
+        self.storage = 0
+        self.when = time.time()
+        self.reserved = {}
+        self.incoming = []
+
+    def update(self, game_state):
+        """
+        Takes a new snapshot from the game state
+        Production rates are per second (as reported by the game)
+        """
+        village = game_state["village"]
+        self.when = time.time()
+        self.storage = int(village["storage_max"])
+        for res in self.resources:
+            self.amount[res] = float(village[res])
+            self.rates[res] = float(village.get(f"{res}_prod", 0) or 0)
+        self.incoming = [entry for entry in self.incoming if entry[0] > self.when]
+
+    def reserve(self, source, cost):
+        """
+        Marks resources as already spent (costs not yet taken by the game)
+        """
+        self.reserved[source] = {res: int(cost.get(res, 0)) for res in self.resources}
+
+    def release(self, source):
+        """
+        Removes a reservation
+        """
+        self.reserved.pop(source, None)
+
+    def add_incoming(self, arrival, resources):
+        """
+        Resources arriving by merchant at a certain timestamp
+        """
+        self.incoming.append((arrival, {res: int(resources.get(res, 0)) for res in self.resources}))
+        self.incoming.sort(key=lambda x: x[0])
+
+    def events(self, until):
+        """
+        Incoming merchants arriving between the snapshot and a timestamp
+        """
+        return [entry for entry in self.incoming if self.when < entry[0] <= until]
+
+    def advance(self, amount, seconds):
+        """
+        Adds production over a period of time, capped by the storage
+        """
+        return {
+            res: min(max(self.storage, amount[res]), amount[res] + self.rates[res] * seconds)
+            for res in self.resources
+        }
+
+    def deliver(self, amount, resources):
+        """
+        Adds the resources of a merchant, anything over the storage capacity is lost
+        """
+        return {
+            res: max(amount[res], min(self.storage, amount[res] + resources.get(res, 0)))
+            for res in self.resources
+        }
+
+    def at(self, timestamp, reserved=True):
+        """
+        Projected resources (minus reservations unless reserved is False) at a certain timestamp
+        """
+        amount = dict(self.amount)
+        when = self.when
+        for arrival, resources in self.events(timestamp):
+            amount = self.deliver(self.advance(amount, arrival - when), resources)
+            when = arrival
+        amount = self.advance(amount, max(0, timestamp - when))
+        for cost in self.reserved.values() if reserved else []:
+            for res in self.resources:
+                amount[res] -= cost[res]
+        return {res: int(amount[res]) for res in self.resources}
+
+    def time_until(self, cost, source=None):
+        """
+        Seconds until a cost can be paid (on top of the reservations of other sources), 0 if it can be paid right now
+        None if it will never be reached (storage too small or no production)
+        """
+        need = {}
+        for res in self.resources:
+            need[res] = int(cost.get(res, 0)) + sum(
+                reserved[res] for name, reserved in self.reserved.items() if name != source
+            )
+            if need[res] > self.storage:
+                return None
+        amount = dict(self.amount)
+        when = self.when
+        for arrival, resources in self.events(math.inf) + [(math.inf, {})]:
+            ready = when
+            for res in self.resources:
+                if amount[res] >= need[res]:
+                    continue
+                ready = max(ready, when + (need[res] - amount[res]) / self.rates[res] if self.rates[res] else math.inf)
+            if ready <= arrival and ready != math.inf:
+                return max(0, int(math.ceil(ready - time.time())))
+            amount = self.deliver(self.advance(amount, arrival - when), resources)
+            when = arrival
+        return None
 
 
 class ResourceManager:
     """
     Class to calculate, store and reserve resources for actions
     """
-    actual = {}
-
-    requested = {}
-
-    storage = 0
+    __slots__ = (
+        "actual", "requested", "storage", "projection", "wake_times", "logger", "trade_bias", "last_trade",
+        "trade_max_per_hour", "trade_max_duration", "wrapper", "village_id", "do_premium_trade",
+    )
     ratio = 2.5
     max_trade_amount = 4000
-    logger = None
-    # not allowed to bias
-    trade_bias = 1
-    last_trade = 0
-    trade_max_per_hour = 1
-    trade_max_duration = 2
-    wrapper = None
-    village_id = None
-    do_premium_trade = False
 
     def __init__(self, wrapper=None, village_id=None):
         """
@@ -116,6 +257,32 @@ class ResourceManager:
         """
         self.wrapper = wrapper
         self.village_id = village_id
+        # Per village, the balancer compares the resources of all villages
+        self.actual = {}
+        self.requested = {}
+        self.storage = 0
+        self.projection = ResourceProjection()
+        self.wake_times = {}
+        self.logger = None
+        # not allowed to bias
+        self.trade_bias = 1
+        self.last_trade = 0
+        self.trade_max_per_hour = 1
+        self.trade_max_duration = 2
+        self.do_premium_trade = False
+
+    def get_state(self):
+        """
+        State kept over a restart (checkpoint)
+        """
+        return {"last_trade": self.last_trade, "wake_times": self.wake_times}
+
+    def set_state(self, state):
+        """
+        Restores the state of a checkpoint
+        """
+        self.last_trade = state.get("last_trade", 0)
+        self.wake_times = dict(state.get("wake_times", {}))
 
     def update(self, game_state):
         """
@@ -128,6 +295,7 @@ class ResourceManager:
                 game_state["village"]["pop_max"] - game_state["village"]["pop"]
         )
         self.storage = game_state["village"]["storage_max"]
+        self.projection.update(game_state)
         self.check_state()
         store_state = game_state["village"]["name"]
         self.logger = logging.getLogger(f"Resource Manager: {store_state}")
@@ -174,7 +342,22 @@ class ResourceManager:
         # Choose an order for resources - for example: wood, iron, stone.
         resource_order = ["stone", "wood", "iron"]
 
+        # Divide the merchants over all resources at once
+        allocation = PremiumExchange(
+            wrapper=self.wrapper,
+            stock=data["stock"],
+            capacity=data["capacity"],
+            tax=data["tax"],
+            constants=data["constants"],
+            duration=data["duration"],
+            merchants=available_merchants
+        ).allocate({r: max(0, self.actual.get(r, 0) - baseline) for r in resource_order})
+        self.logger.debug("Premium trade merchant allocation: %s", allocation)
+
         for resource in resource_order:
+            if not allocation[resource]["merchants"]:
+                self.logger.debug("No merchants allocated to %s", resource)
+                continue
             # Refresh market data each time
             url = f"game.php?village={self.village_id}&screen=market&mode=exchange"
             res = self.wrapper.get_url(url=url)
@@ -183,8 +366,8 @@ class ResourceManager:
                 self.logger.warning("Error reading premium data on refresh!")
                 return
 
-            available_merchants = data["merchants"]
-            if available_merchants < 1:
+            available_merchants = min(data["merchants"], allocation[resource]["merchants"])
+            if data["merchants"] < 1:
                 self.logger.info("No more merchants available!")
                 return
 
@@ -300,6 +483,47 @@ class ResourceManager:
         else:
             self.requested[source] = {resource: amount}
 
+    def schedule(self, source, cost):
+        """
+        Records when an action will be affordable so the bot can wake up right on time
+        """
+        seconds = self.projection.time_until(cost, source=source)
+        if seconds is None:
+            self.wake_times.pop(source, None)
+            return None
+        self.wake_times[source] = time.time() + seconds
+        return self.wake_times[source]
+
+    def reserve(self, source, cost):
+        """
+        Keeps the resources of an action that waits for them, recruitment only spends what is left
+        """
+        self.projection.reserve(source, cost)
+        return self.schedule(source, cost)
+
+    def release(self, source):
+        """
+        Removes the reservation and wake-up time of an action
+        """
+        self.projection.release(source)
+        self.wake_times.pop(source, None)
+
+    def incoming_amount(self, resource):
+        """
+        Amount of a resource that is on its way from other own villages
+        """
+        return sum(
+            resources.get(resource, 0) for arrival, resources in self.projection.incoming
+            if arrival > time.time()
+        )
+
+    def next_wake(self):
+        """
+        Timestamp of the first upcoming moment an action becomes affordable
+        """
+        upcoming = [wake for wake in self.wake_times.values() if wake > time.time()]
+        return min(upcoming) if upcoming else None
+
     def can_recruit(self):
         """
         Checks of population is sufficient for recruitment
@@ -481,6 +705,11 @@ class ResourceManager:
 
                 item, how_many = need
                 how_many = round(how_many, -1)
+                if self.incoming_amount(item) >= how_many:
+                    self.logger.info(
+                        "Needed %s is already sent by another village (%d)", item, self.incoming_amount(item)
+                    )
+                    return
                 if item in resource_incoming and resource_incoming[item] >= how_many:
                     self.logger.info(
                         f"Needed {item} already incoming! ({resource_incoming[item]} >= {how_many})"
@@ -601,3 +830,132 @@ class ResourceManager:
                 "".join([s for s in res_wanted_amount if s.isdigit()])
             ),
         }
+
+
+if __name__ == "__main__":
+    # Benchmark and equivalence check of the exchange solver
+    # Usage: python -m game.resources [saved exchange pages or receiveData payloads (json)]
+    # Without arguments the payloads in game/fixtures/premium_exchange.json are checked
+    import json
+    import os
+    import sys
+    import timeit
+
+    def iterative_rate(exchange, item):
+        """
+        The original search for the amount per premium point
+        """
+        n = exchange.calculate_marginal_price(exchange.stock[item], exchange.capacity[item])
+        r = int(1 / n)
+        c = exchange.calculate_cost(item, r)
+        i = 0
+        while c > 1 and i < 50:
+            r -= 1
+            i += 1
+            c = exchange.calculate_cost(item, r)
+        return r
+
+    def exhaustive_optimize_n(amount, sell_price, merchants, size=1000):
+        """
+        The original search over every merchant and point combination
+        """
+        offers = []
+        for i in range(1, merchants + 1):
+            for j in range(amount // sell_price + 1):
+                r = ((size * i) - j * sell_price) / size
+                if r >= 0:
+                    offers.append((i, r, j))
+        offers.sort(key=lambda x: (x[1], -x[0]))
+        return {"merchants": offers[0][0], "ratio": offers[0][1], "n_to_sell": offers[0][2] - 1}
+
+    payloads = []
+    for path in sys.argv[1:]:
+        with open(path, "r") as f:
+            content = f.read()
+        payload = Extractor.premium_data(content)
+        payload = payload if payload else json.loads(content)
+        payloads.extend(payload if type(payload) == list else [payload])
+    if not payloads:
+        with open(os.path.join(os.path.dirname(__file__), "fixtures", "premium_exchange.json"), "r") as f:
+            payloads = json.load(f)
+
+    mismatches = 0
+
+    def check(ok, message, *args):
+        """
+        Counts and prints a failed check
+        """
+        global mismatches
+        if not ok:
+            mismatches += 1
+            print(message % args)
+
+    for payload in payloads:
+        name = payload.get("name", "payload")
+        exchange = PremiumExchange(
+            wrapper=None,
+            stock=payload["stock"],
+            capacity=payload["capacity"],
+            tax=payload["tax"],
+            constants=payload["constants"],
+            duration=payload["duration"],
+            merchants=payload["merchants"],
+        )
+        for item in ["wood", "stone", "iron"]:
+            rate = exchange.calculate_rate_for_one_point(item)
+            expected = iterative_rate(exchange, item)
+            check(rate == expected, "%s: rate mismatch for %s: %d != %d", name, item, rate, expected)
+            # Below one point, exactly at a merchant boundary and beyond what the merchants carry
+            for merchants in sorted({1, 5, max(1, payload["merchants"])}):
+                capacity = merchants * 1000
+                amounts = {0, rate - 1, rate, capacity, capacity - 1, capacity + rate, capacity * 2}
+                amounts.update(range(rate, capacity + 1, max(1, rate // 3)))
+                for amount in sorted(a for a in amounts if a >= 0):
+                    solved = PremiumExchange.optimize_n(amount, rate, merchants)
+                    check(
+                        solved == exhaustive_optimize_n(amount, rate, merchants),
+                        "%s: trade mismatch for %s: %d (%d merchants)", name, item, amount, merchants
+                    )
+                    check(
+                        solved["merchants"] <= merchants and (solved["n_to_sell"] + 1) * rate <= capacity,
+                        "%s: trade of %s exceeds the merchants: %s", name, item, solved
+                    )
+
+            merchants = max(1, payload["merchants"])
+            amount = merchants * 1000
+            solved = timeit.timeit(lambda: exchange.calculate_rate_for_one_point(item), number=1000)
+            searched = timeit.timeit(lambda: iterative_rate(exchange, item), number=1000)
+            optimized = timeit.timeit(lambda: PremiumExchange.optimize_n(amount, rate, merchants), number=100)
+            exhaustive = timeit.timeit(lambda: exhaustive_optimize_n(amount, rate, merchants), number=100)
+            print(
+                "%s: %s rate %d: rate %.1fus (was %.1fus), trade %.1fus (was %.1fus)"
+                % (name, item, rate, solved * 1000, searched * 1000, optimized * 10000, exhaustive * 10000)
+            )
+
+        # Merchant limit: more excess than the merchants carry uses every merchant, nothing to sell uses none
+        for excess in [
+            {item: payload["merchants"] * 400 for item in ["wood", "stone", "iron"]},
+            {item: (payload["merchants"] + 1) * 1000 for item in ["wood", "stone", "iron"]},
+            {item: 0 for item in ["wood", "stone", "iron"]},
+        ]:
+            allocation = exchange.allocate(excess)
+            used = sum(entry["merchants"] for entry in allocation.values())
+            check(
+                used <= payload["merchants"], "%s: %d merchants allocated, %d at home", name, used, payload["merchants"]
+            )
+            for item, entry in allocation.items():
+                check(
+                    entry["points"] * entry["rate"] <= min(excess[item], entry["merchants"] * 1000),
+                    "%s: allocation of %s sells more than available: %s", name, item, entry
+                )
+            if not any(excess.values()):
+                check(used == 0, "%s: merchants allocated without resources", name)
+            elif min(excess.values()) > payload["merchants"] * 1000:
+                check(
+                    used == payload["merchants"], "%s: only %d of %d merchants used", name, used, payload["merchants"]
+                )
+        print("%s: merchant allocation %s" % (name, exchange.allocate(excess={
+            item: payload["merchants"] * 400 for item in ["wood", "stone", "iron"]
+        })))
+    print("%d payloads checked, %d mismatches" % (len(payloads), mismatches))
+    sys.exit(1 if mismatches else 0)
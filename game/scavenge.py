@@ -0,0 +1,441 @@
+"""
+Scavenging troop split
+Divides troops over the scavenging options so they all return at the same time
+"""
+import itertools
+import logging
+import math
+
+from core.extractors import Extractor
+from game.simulator import HAS_NUMPY
+
+
+class ScavengeSolver:
+    """
+    Uses the scavenging formula of the game:
+    loot = capacity * loot_factor
+    duration = ((loot^2 * 100)^duration_exponent + duration_initial_seconds) * duration_factor
+    Equal durations mean equal loot per option, so the capacity per option is proportional to 1 / loot_factor
+    """
+    # Carry capacity per unit used for scavenging
+    carry = {
+        "spear": 25,
+        "sword": 15,
+        "axe": 10,
+        "archer": 10,
+        "light": 80,
+        "marcher": 50,
+        "heavy": 50,
+    }
+
+    # Option data used when the game does not supply it
+    default_base = {
+        1: {"loot_factor": 0.10},
+        2: {"loot_factor": 0.25},
+        3: {"loot_factor": 0.50},
+        4: {"loot_factor": 0.75},
+    }
+
+    def __init__(self, options=None):
+        """
+        Create the solver from the options of the scavenge screen (village_data["options"])
+        """
+        self.base = {}
+        for option, data in (options or {}).items():
+            self.base[int(option)] = data.get("base", None) or self.default_base.get(int(option), {})
+        for option, data in self.default_base.items():
+            self.base.setdefault(option, data)
+
+    def loot_factor(self, option):
+        """
+        Part of the carried capacity that is returned as loot
+        """
+        return float(self.base[option].get("loot_factor", self.default_base[option]["loot_factor"]))
+
+    def duration(self, option, capacity):
+        """
+        Duration of a scavenging run in seconds for a certain carry capacity
+        """
+        base = self.base[option]
+        loot = capacity * self.loot_factor(option)
+        return (
+            math.pow(loot * loot * 100, float(base.get("duration_exponent", 0.45)))
+            + float(base.get("duration_initial_seconds", 1800))
+        ) * float(base.get("duration_factor", 1))
+
+    def capacity(self, troops):
+        """
+        Total carry capacity of a set of troops
+        """
+        return sum(self.carry.get(unit, 0) * int(amount) for unit, amount in troops.items())
+
+    def split_capacity(self, options, capacity):
+        """
+        Capacity per option giving every option the same loot (and duration)
+        """
+        inverse = {option: 1 / self.loot_factor(option) for option in options}
+        total = sum(inverse.values())
+        return {option: capacity * inverse[option] / total for option in options}
+
+    def rate(self, options, capacity):
+        """
+        Resources per hour when all troops are split over a set of options
+        """
+        if not options or not capacity:
+            return 0
+        split = self.split_capacity(options, capacity)
+        loot = sum(split[option] * self.loot_factor(option) for option in options)
+        return loot * 3600 / max(self.duration(option, split[option]) for option in options)
+
+    @staticmethod
+    def subsets(options):
+        """
+        Every non-empty set of options, smallest sets first
+        """
+        return [
+            combination
+            for size in range(1, len(options) + 1)
+            for combination in itertools.combinations(sorted(options), size)
+        ]
+
+    def best_options(self, available, capacity):
+        """
+        The set of available options with the highest resources per hour
+        """
+        best = ()
+        best_rate = 0
+        for options in self.subsets(available):
+            rate = self.rate(options, capacity)
+            if rate > best_rate:
+                best, best_rate = options, rate
+        return list(best)
+
+    def solve(self, troops, available):
+        """
+        Splits the troops over the options, every unit type is divided in the same proportions
+        Returns {option: {unit: amount}}
+        """
+        troops = {unit: int(amount) for unit, amount in troops.items() if unit in self.carry and int(amount) > 0}
+        capacity = self.capacity(troops)
+        options = self.best_options(available, capacity)
+        if not options:
+            return {}
+        return self.distribute(troops, options, self.split_capacity(options, capacity), capacity)
+
+    def solve_batch(self, troops_list, available_list):
+        """
+        Splits the troops of many villages at once (same result as solve for every village)
+        The rate of every set of options is computed for all villages with NumPy
+        Returns a list of {option: {unit: amount}}
+        """
+        import numpy
+
+        troops_list = [
+            {unit: int(amount) for unit, amount in troops.items() if unit in self.carry and int(amount) > 0}
+            for troops in troops_list
+        ]
+        if not troops_list:
+            return []
+        options = sorted(self.base)
+        units = list(self.carry)
+        subsets = self.subsets(options)
+        # Sets of options (rows) and the options in them (columns)
+        mask = numpy.array([[option in subset for option in options] for subset in subsets])
+        available = numpy.array([[option in entry for option in options] for entry in available_list])
+        counts = numpy.array([[troops.get(unit, 0) for unit in units] for troops in troops_list], dtype=float)
+        capacity = counts @ numpy.array([self.carry[unit] for unit in units], dtype=float)
+
+        factor = numpy.array([self.loot_factor(option) for option in options])
+        inverse = 1 / factor
+        exponent = numpy.array([float(self.base[option].get("duration_exponent", 0.45)) for option in options])
+        initial = numpy.array([float(self.base[option].get("duration_initial_seconds", 1800)) for option in options])
+        duration_factor = numpy.array([float(self.base[option].get("duration_factor", 1)) for option in options])
+
+        # villages x sets x options
+        split = capacity[:, None, None] * inverse / (mask * inverse).sum(axis=1)[None, :, None]
+        loot = split * factor
+        duration = (numpy.power(loot * loot * 100, exponent) + initial) * duration_factor
+        longest = numpy.where(mask, duration, 0).max(axis=2)
+        rate = numpy.where(mask, loot, 0).sum(axis=2) * 3600 / longest
+        # Sets holding an option that is not available in the village
+        rate[(mask[None, :, :] & ~available[:, None, :]).any(axis=2)] = -numpy.inf
+        best = rate.argmax(axis=1)
+
+        # Rounded down unit counts per option and the capacity each option still misses
+        chosen_split = split[numpy.arange(len(troops_list)), best]
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            shares = chosen_split / capacity[:, None]
+        rounded = numpy.floor(counts[:, :, None] * numpy.nan_to_num(shares)[:, None, :])
+        carry = numpy.array([self.carry[unit] for unit in units], dtype=float)
+        deficit = (chosen_split - (rounded * carry[None, :, None]).sum(axis=1)).tolist()
+        rounded = rounded.astype(int).tolist()
+        position = {unit: index for index, unit in enumerate(units)}
+
+        output = []
+        for index, troops in enumerate(troops_list):
+            choice = best[index]
+            if not rate[index, choice] > 0:
+                output.append({})
+                continue
+            chosen = subsets[choice]
+            columns = [options.index(option) for option in chosen]
+            output.append(self.distribute(
+                troops, chosen,
+                counts={unit: [rounded[index][position[unit]][column] for column in columns] for unit in troops},
+                deficit=[deficit[index][column] for column in columns],
+            ))
+        return output
+
+    def distribute(self, troops, options, split=None, capacity=None, counts=None, deficit=None):
+        """
+        Divides every unit type over the options in proportion to the capacity per option
+        The rounded down counts and remaining capacity per option are computed unless they are given
+        Returns {option: {unit: amount}}
+        """
+        if counts is None:
+            shares = [split[option] / capacity for option in options]
+            counts = {unit: [int(amount * share) for share in shares] for unit, amount in troops.items()}
+            deficit = [
+                split[option] - sum(self.carry[unit] * counts[unit][i] for unit in troops)
+                for i, option in enumerate(options)
+            ]
+
+        output = {option: {} for option in options}
+        # Hand out the rounding leftovers to the options furthest below their capacity, large units first
+        for unit in sorted(troops, key=lambda u: self.carry[u], reverse=True):
+            for _ in range(troops[unit] - sum(counts[unit])):
+                i = max(range(len(options)), key=lambda x: deficit[x])
+                counts[unit][i] += 1
+                deficit[i] -= self.carry[unit]
+        for unit in troops:
+            for option, count in zip(options, counts[unit]):
+                if count:
+                    output[option][unit] = count
+        return output
+
+
+class MassScavenger:
+    """
+    Sends the scavenging squads of all villages from the mass scavenge page
+    A handful of requests instead of three (or more) per village
+    """
+    logger = logging.getLogger("Scavenging")
+
+    # Squads per send_squads request
+    batch_size = 50
+    # Max amount of mass scavenge pages read per run
+    max_pages = 20
+
+    def __init__(self, wrapper=None):
+        """
+        Create the mass scavenger
+        """
+        self.wrapper = wrapper
+        # None until the mass scavenge page was read once
+        self.supported = None
+
+    def read(self, village_id):
+        """
+        Reads all pages of the mass scavenge screen
+        Returns the option data and the village entries
+        None if the page could not be loaded, False if it loaded without the mass scavenge screen
+        """
+        options = {}
+        villages = []
+        page = 0
+        while True:
+            url = f"game.php?village={village_id}&screen=place&mode=scavenge_mass"
+            if page > 0:
+                url += f"&page={page}"
+            result = self.wrapper.get_url(url)
+            data = Extractor.scavenge_mass_data(result) if result else None
+            if page == 0 and not data:
+                if result and Extractor.game_state(result):
+                    return False
+                return None
+            if not data or not data["villages"]:
+                break
+            options = data["options"] or options
+            villages.extend(data["villages"])
+            page += 1
+            if page > data["pages"] or page >= self.max_pages:
+                break
+        return options, villages
+
+    @staticmethod
+    def squad(village_id, option, units, capacity):
+        """
+        A single squad request, the index is set when the batch is built
+        """
+        entry = {
+            "[village_id]": str(village_id),
+            "[option_id]": str(option),
+            "[use_premium]": "false",
+            "[candidate_squad][carry_max]": str(capacity),
+        }
+        for unit, amount in units.items():
+            entry["[candidate_squad][unit_counts][%s]" % unit] = str(amount)
+        return entry
+
+    def plan(self, options, villages, settings):
+        """
+        Builds the squads for every village with gathering enabled
+        settings: {village_id: {"selection", "disabled_units", "advanced"}}
+        """
+        solver = ScavengeSolver({option: {"base": base} for option, base in options.items()})
+        planned = []
+        for village in villages:
+            village_settings = settings.get(str(village["village_id"]), None)
+            if not village_settings:
+                continue
+            troops = {
+                unit: int(amount) for unit, amount in village.get("unit_counts_home", {}).items()
+                if unit in solver.carry and unit not in village_settings["disabled_units"]
+            }
+            available = [
+                int(option) for option, state in village.get("options", {}).items()
+                if int(option) <= village_settings["selection"]
+                and not state.get("is_locked", True)
+                and state.get("scavenging_squad", None) is None
+            ]
+            if not available or not solver.capacity(troops):
+                continue
+            planned.append((village["village_id"], troops, available, village_settings["advanced"]))
+
+        advanced = [entry for entry in planned if entry[3]]
+        if HAS_NUMPY:
+            solved = solver.solve_batch([entry[1] for entry in advanced], [entry[2] for entry in advanced])
+        else:
+            solved = [solver.solve(entry[1], entry[2]) for entry in advanced]
+        solved = iter(solved)
+
+        squads = []
+        for village_id, troops, available, use_solver in planned:
+            if use_solver:
+                split = next(solved)
+            else:
+                split = {max(available): {unit: amount for unit, amount in troops.items() if amount > 0}}
+            for option, units in split.items():
+                units = dict({unit: 0 for unit in troops}, **units)
+                squads.append(self.squad(village_id, option, units, solver.capacity(units)))
+        return squads
+
+    def send(self, village_id, squads):
+        """
+        Sends the squads in batches
+        """
+        for start in range(0, len(squads), self.batch_size):
+            payload = {}
+            for index, squad in enumerate(squads[start:start + self.batch_size]):
+                for key, value in squad.items():
+                    payload["squad_requests[%d]%s" % (index, key)] = value
+            payload["h"] = self.wrapper.last_h
+            self.wrapper.get_api_action(
+                action="send_squads",
+                params={"screen": "scavenge_api"},
+                data=payload,
+                village_id=village_id,
+            )
+
+    def run(self, village_id, settings):
+        """
+        Mass scavenging for all villages in settings
+        Returns False if the world has no mass scavenging (use the per village gather instead)
+        """
+        if self.supported is False:
+            return False
+        data = self.read(village_id)
+        if data is False:
+            self.logger.info("Mass scavenging not available, gathering per village")
+            self.supported = False
+            return False
+        if not data:
+            # Expired session or a failed request, not a reason to give up on mass scavenging
+            self.logger.warning("Unable to read the mass scavenge screen, trying again next cycle")
+            return True
+        self.supported = True
+        options, villages = data
+        squads = self.plan(options, villages, settings)
+        self.send(village_id, squads)
+        self.logger.info(
+            "Sent %d scavenging squads for %d villages", len(squads), len({s["[village_id]"] for s in squads})
+        )
+        return True
+
+
+if __name__ == "__main__":
+    # Benchmark of the solver against the fixed ratio split it replaced, and of the batch solver
+    import random
+    import timeit
+
+    def fixed_ratio_split(troops, selection=4):
+        """
+        The original split: fixed capacity ratios, filled one unit at a time
+        """
+        selection_map = [15, 21, 24, 26]
+        batch_multiplier = [15, 6, 3, 2]
+        troops = dict(troops)
+        total_carry = sum(ScavengeSolver.carry[unit] * amount for unit, amount in troops.items())
+        gather_batch = math.floor(total_carry / selection_map[selection - 1])
+        output = {}
+        for option in range(selection, 0, -1):
+            temp_haul = gather_batch * batch_multiplier[option - 1]
+            output[option] = {}
+            for unit in troops:
+                selected = 0
+                for _ in range(troops[unit]):
+                    if temp_haul - ScavengeSolver.carry[unit] < 0:
+                        break
+                    selected += 1
+                    temp_haul -= ScavengeSolver.carry[unit]
+                troops[unit] -= selected
+                output[option][unit] = selected
+        return output
+
+    def describe(solver, split):
+        """
+        Resources per hour and the return time of every option
+        """
+        loot = 0
+        durations = {}
+        for option, units in split.items():
+            capacity = solver.capacity(units)
+            if not capacity:
+                continue
+            loot += capacity * solver.loot_factor(option)
+            durations[option] = int(solver.duration(option, capacity))
+        longest = max(durations.values()) if durations else 1
+        return loot * 3600 / longest, durations
+
+    solver = ScavengeSolver()
+    for troops in [{"spear": 300, "axe": 150}, {"spear": 3000, "sword": 2000, "light": 800}]:
+        fixed = fixed_ratio_split(troops)
+        solved = solver.solve(troops, [1, 2, 3, 4])
+        print("Troops: %s" % troops)
+        print("  fixed ratios: %.0f res/h, durations %s" % describe(solver, fixed))
+        print("  solver:       %.0f res/h, durations %s" % describe(solver, solved))
+        print(
+            "  time per split: solver %.1fus, fixed ratios %.1fus" % (
+                timeit.timeit(lambda: solver.solve(troops, [1, 2, 3, 4]), number=1000) * 1000,
+                timeit.timeit(lambda: fixed_ratio_split(troops), number=100) * 10000,
+            )
+        )
+
+    if HAS_NUMPY:
+        random.seed(1)
+        villages = [
+            {unit: random.choice([0, random.randint(0, 20), random.randint(0, 3000)]) for unit in solver.carry}
+            for _ in range(1000)
+        ]
+        unlocked = [random.sample([1, 2, 3, 4], random.randint(1, 4)) for _ in villages]
+        batch = solver.solve_batch(villages, unlocked)
+        mismatches = sum(
+            1 for troops, available, split in zip(villages, unlocked, batch) if solver.solve(troops, available) != split
+        )
+        print("Batch solver: %d villages, %d mismatches" % (len(villages), mismatches))
+        print(
+            "  time for all villages: batch %.1fms, one by one %.1fms" % (
+                timeit.timeit(lambda: solver.solve_batch(villages, unlocked), number=10) * 100,
+                timeit.timeit(lambda: [solver.solve(*entry) for entry in zip(villages, unlocked)], number=10) * 100,
+            )
+        )
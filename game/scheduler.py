@@ -0,0 +1,77 @@
+"""
+Event driven village scheduling
+Every stage of a village cycle is planned at the moment it is expected to have something to do
+"""
+import heapq
+import logging
+import time
+
+
+class TaskScheduler:
+    """
+    Priority queue of (due, priority, village, task)
+    Rescheduling a task leaves the old entry in the queue, it is skipped when popped
+    """
+    logger = logging.getLogger("Scheduler")
+
+    # Stages of a village cycle, in order of priority
+    tasks = ["defence", "build", "recruit", "farm", "gather", "market", "reports"]
+
+    def __init__(self):
+        """
+        Create the scheduler
+        """
+        self.queue = []
+        # Current due time per (village, task)
+        self.due = {}
+        # Villages that had their first (full) run
+        self.villages = set()
+
+    def schedule(self, village_id, task, due):
+        """
+        Plans (or re-plans) a task of a village
+        """
+        self.due[(village_id, task)] = due
+        self.villages.add(village_id)
+        heapq.heappush(self.queue, (due, self.tasks.index(task), village_id, task))
+
+    def known(self, village_id):
+        """
+        Checks if the tasks of a village are planned
+        """
+        return village_id in self.villages
+
+    def remove(self, village_id):
+        """
+        Drops all tasks of a village
+        """
+        self.villages.discard(village_id)
+        for task in self.tasks:
+            self.due.pop((village_id, task), None)
+
+    def pop_due(self, now=None, urgent=()):
+        """
+        All tasks that are due, grouped per village
+        Urgent villages (under attack) come first, then the villages with the longest overdue task
+        """
+        now = now or time.time()
+        output = {}
+        first_due = {}
+        while self.queue and self.queue[0][0] <= now:
+            due, _, village_id, task = heapq.heappop(self.queue)
+            if self.due.get((village_id, task), None) != due:
+                # Rescheduled or removed
+                continue
+            self.due.pop((village_id, task))
+            output.setdefault(village_id, []).append(task)
+            first_due.setdefault(village_id, due)
+        order = sorted(output, key=lambda v: (v not in urgent, first_due[v]))
+        return {village_id: output[village_id] for village_id in order}
+
+    def next_due(self):
+        """
+        The first moment a task is due, None if nothing is planned
+        """
+        while self.queue and self.due.get((self.queue[0][2], self.queue[0][3]), None) != self.queue[0][0]:
+            heapq.heappop(self.queue)
+        return self.queue[0][0] if self.queue else None
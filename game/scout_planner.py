@@ -0,0 +1,86 @@
+"""
+Scouting management
+Collects scout requests during a farm run and sends the most valuable ones
+"""
+import logging
+import time
+
+
+class ScoutPlanner:
+    """
+    Ranks scout requests by staleness of intel, expected value and distance
+    """
+    logger = logging.getLogger("Scouting")
+
+    # Max amount of scouts sent per cycle (every scout costs 3 requests)
+    budget = 5
+    # Intel older than this (hours) is not considered more stale
+    max_staleness = 48
+
+    def __init__(self, repman=None):
+        """
+        Create the scout planner
+        """
+        self.repman = repman
+        self.requested = []
+
+    def request(self, vid):
+        """
+        Queues a scout request, it will be sent (or not) when the cycle is dispatched
+        """
+        if vid not in self.requested:
+            self.requested.append(vid)
+        return False
+
+    def staleness(self, vid):
+        """
+        Age of the newest report on a village in hours
+        """
+        last_seen = self.repman.last_seen(vid) if self.repman else None
+        if not last_seen:
+            return self.max_staleness
+        return min(self.max_staleness, (time.time() - last_seen) / 3600)
+
+    def priority(self, attack, vid):
+        """
+        Stale intel on valuable nearby farms goes first
+        """
+        value = 1.0
+        location = attack.map.map_pos.get(vid, None)
+        distance = attack.map.get_dist(location) if location else attack.farm_radius
+        template = attack.template[0] if type(attack.template) == list else attack.template
+        if attack.loot_model:
+            expected = attack.loot_model.expected_loot(vid, distance, template)
+            if expected is not None:
+                value = max(1.0, expected / max(1, attack.loot_model.carry(template)))
+        duration = None
+        if attack.travel:
+            duration = attack.travel.travel_time(attack.village_id, vid, {"spy": 1})
+        if duration is None:
+            duration = distance * 9 * 60
+        return self.staleness(vid) * value / (1 + duration / 3600)
+
+    def dispatch(self, attack):
+        """
+        Sends the highest ranked scouts within the spy and request budget
+        """
+        if not self.requested:
+            return 0
+        spies = int(attack.troopmanager.troops.get("spy", 0))
+        budget = min(self.budget, spies // max(1, attack.scout_farm_amount))
+        ranked = sorted(self.requested, key=lambda vid: self.priority(attack, vid), reverse=True)
+        self.logger.info(
+            "%d scout requests, sending %d (spies: %d)", len(ranked), min(budget, len(ranked)), spies
+        )
+        sent = 0
+        for vid in ranked[0:budget]:
+            troops = {"spy": attack.scout_farm_amount}
+            result = attack.attack(vid, troops=troops)
+            if result and result != "forced_peace":
+                attack.attacked(vid, scout=True, safe=False)
+                attack.troopmanager.troops["spy"] = str(
+                    int(attack.troopmanager.troops["spy"]) - attack.scout_farm_amount
+                )
+                sent += 1
+        self.requested = []
+        return sent
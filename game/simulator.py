@@ -1,7 +1,11 @@
+import importlib.util
 import math
 
 from core.filemanager import FileManager
 
+# NumPy is optional, only the batch simulator needs it (imported when used, it slows down the start)
+HAS_NUMPY = importlib.util.find_spec("numpy") is not None
+
 
 # Tribalwars simulator class, based on real math stuff I guess
 class Simulator:
@@ -317,11 +321,9 @@ class Simulator:
         luck = 1 + luck / 100
         nightbonus = 2 if nightbonus else 1
 
-        for item in self.pool:
-            if item not in attackerUnits:
-                attackerUnits[item] = 0
-            if item not in defenderUnits:
-                defenderUnits[item] = 0
+        # Work on copies, units that are not simulated (spy, militia) are left out
+        attackerUnits = {unit: attackerUnits.get(unit, 0) for unit in self.pool}
+        defenderUnits = {unit: defenderUnits.get(unit, 0) for unit in self.pool}
 
         attacker = {
             "quantity": {},
@@ -352,7 +354,6 @@ class Simulator:
 
             attackFood = self.attack_sum_food(attackerUnits)
             attackFoodSum = self.get_sum(attackFood)
-            print(attackFood, attackFoodSum)
             defenderUnitsCopy = dict()
 
             for unit in defenderUnits:
@@ -375,15 +376,13 @@ class Simulator:
                     c = math.sqrt(a) * a
                     for unit in defenderUnits:
                         defenderUnits[unit] -= defenderUnitsCopy[unit] * c * ratio
-                    for i in self.attack_units[attackType]:
-                        unit = self.attack_units[attackType][i]
+                    for unit in self.attack_units[attackType]:
                         attackerUnits[unit] = 0
                 else:
                     c = math.sqrt(1 / a) / a
                     for unit in defenderUnits:
                         defenderUnits[unit] -= ratio * defenderUnitsCopy[unit]
-                    for i in self.attack_units[attackType]:
-                        unit = i
+                    for unit in self.attack_units[attackType]:
                         attackerUnits[unit] -= c * attackerUnits[unit]
 
         for unit in self.pool:
@@ -403,6 +402,154 @@ class Simulator:
         }
 
 
+class BatchSimulator:
+    """
+    Simulates many battles at once using NumPy
+    Armies are vectors (or rows of a matrix) in the unit order of the simulator pool
+    """
+    attack_types = ["attack", "attack_cavalry", "attack_archer"]
+    # Battles are decided within a few rounds, this only guards against endless loops
+    max_rounds = 50
+
+    def __init__(self, pool=None):
+        """
+        Create the unit tables, pool defaults to Simulator.pool
+        """
+        import numpy
+
+        self.np = numpy
+        self.pool = pool if pool else Simulator.pool
+        self.units = list(self.pool)
+        self.ram = self.units.index("ram")
+        size = (len(self.units), len(self.attack_types))
+        self.attack = numpy.zeros(size)
+        self.food = numpy.zeros(size)
+        self.defense = numpy.zeros(size)
+        # Attack type of every unit, used to apply the losses per type
+        self.unit_type = numpy.zeros(len(self.units), dtype=int)
+        for index, unit in enumerate(self.units):
+            attack_type = self.attack_types.index(Simulator.attack_pool[unit])
+            self.unit_type[index] = attack_type
+            self.attack[index, attack_type] = self.pool[unit]["attack"]
+            self.food[index, attack_type] = self.pool[unit]["food"]
+            self.defense[index] = [self.pool[unit]["def_inf"], self.pool[unit]["def_kav"], self.pool[unit]["def_arc"]]
+
+    def vector(self, units):
+        """
+        Unit vector of a {unit: amount} dict, units that are not simulated are left out
+        """
+        return self.np.array([units.get(unit, 0) for unit in self.units], dtype=float)
+
+    def matrix(self, armies):
+        """
+        Matrix of a list of {unit: amount} dicts (one row per army), arrays are used as they are
+        """
+        if isinstance(armies, self.np.ndarray):
+            return armies.astype(float).reshape(-1, len(self.units))
+        return self.np.array([self.vector(army) for army in armies]).reshape(-1, len(self.units))
+
+    def simulate_batch(self, attackers, defenders, wall=0, nightbonus=False, moral=100, luck=0):
+        """
+        Simulates every attacker against the defender in the same row
+        A single attacker or defender row is used for every battle
+        wall, nightbonus, moral and luck are values for all battles or arrays with one value per battle
+        """
+        np = self.np
+        attackers = self.matrix(attackers)
+        defenders = self.matrix(defenders)
+        count = max(len(attackers), len(defenders))
+        attackers = np.broadcast_to(attackers, (count, len(self.units)))
+        defenders = np.broadcast_to(defenders, (count, len(self.units)))
+        wall = np.broadcast_to(np.asarray(wall, dtype=float), (count,))
+        night = np.where(np.broadcast_to(np.asarray(nightbonus), (count,)), 2.0, 1.0)
+        strength = np.broadcast_to(np.asarray(moral, dtype=float) / 100, (count,)) * (
+            1 + np.broadcast_to(np.asarray(luck, dtype=float), (count,)) / 100
+        )
+
+        wall_during = np.maximum(0, wall - np.round(attackers[:, self.ram] / (4 * np.power(1.09, wall))))
+        wall_bonus = (1 + wall_during * 0.05) * night
+        wall_defense = np.where(wall_during != 0, np.round(np.power(1.25, wall_during) * 20), 0)
+
+        attack_left = attackers.copy()
+        defend_left = defenders.copy()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for _ in range(self.max_rounds):
+                active = (np.round(attack_left).sum(axis=1) >= 1) & (np.round(defend_left).sum(axis=1) >= 1)
+                if not active.any():
+                    break
+                attack_strength = attack_left @ self.attack
+                defense_strength = defend_left @ self.defense
+                food = attack_left @ self.food
+                food_sum = np.round(food).sum(axis=1, keepdims=True)
+                ratio = np.where(food_sum > 0, food / food_sum, 0)
+                defense = defense_strength * ratio * wall_bonus[:, None] + wall_defense[:, None] * ratio
+                fighting = active[:, None] & (attack_strength > 0) & (defense > 0)
+                a = np.where(fighting, attack_strength * strength[:, None] / defense, 1)
+                won = fighting & (a >= 1)
+                lost = fighting & (a < 1)
+                # Part of the defenders every attack type kills
+                killed = np.where(won, ratio, 0) + np.where(lost, np.power(a, 1.5) * ratio, 0)
+                defend_left = defend_left * (1 - killed.sum(axis=1, keepdims=True))
+                # Part of every attack type that survives
+                survived = np.where(lost, 0, np.where(won, 1 - np.power(a, -1.5), 1))
+                attack_left = attack_left * survived[:, self.unit_type]
+
+        attack_losses = attackers - np.round(attack_left)
+        defend_losses = defenders - np.round(defend_left)
+        return {
+            "attacker": attackers,
+            "defender": defenders,
+            "attacker_losses": attack_losses,
+            "defender_losses": defend_losses,
+            "wall_before": wall,
+            "wall_during": wall_during,
+            "wall_after": self.post_wall(attackers, defenders, attack_losses, defend_losses, wall),
+        }
+
+    def post_wall(self, attackers, defenders, attack_losses, defend_losses, wall):
+        """
+        Wall level after the battles (Simulator.post_wall for every row)
+        """
+        np = self.np
+        rams = attackers[:, self.ram]
+        ram_attack = self.pool["ram"]["attack"]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            def_sum = np.round(defenders).sum(axis=1)
+            lose_def = np.where(def_sum != 0, defend_losses.sum(axis=1) / def_sum, 1)
+            lose_att = attack_losses.sum(axis=1) / np.round(attackers).sum(axis=1)
+            damage = (rams * ram_attack) / (4 * np.power(1.09, wall))
+            resulting = np.where(
+                lose_def == 1,
+                wall - np.round(damage - 0.5 * damage * lose_att),
+                wall - np.round(rams * ram_attack * lose_def / (8 * np.power(1.09, wall))),
+            )
+        resulting = np.where((rams == 0) | (wall == 0), wall, resulting)
+        return np.maximum(0, resulting)
+
+    def simulate(self, attackerUnits, defenderUnits, wall, nightbonus, moral, luck):
+        """
+        Single battle with the arguments and result of Simulator.simulate
+        The unit dicts of the caller are not changed
+        """
+        wall = wall if wall else 0
+        moral = moral if moral else 100
+        luck = luck if luck else 0
+        result = self.simulate_batch(
+            [attackerUnits], [defenderUnits], wall=wall, nightbonus=bool(nightbonus), moral=moral, luck=luck
+        )
+        output = {}
+        for side, units in [("attacker", attackerUnits), ("defender", defenderUnits)]:
+            losses = result[f"{side}_losses"][0]
+            output[side] = {
+                "quantity": {unit: units.get(unit, 0) for unit in self.units},
+                "losses": {unit: int(losses[index]) for index, unit in enumerate(self.units)},
+            }
+        output["wall_before"] = wall
+        output["wall_during"] = int(result["wall_during"][0])
+        output["wall_after"] = int(result["wall_after"][0])
+        return output
+
+
 class SimCache:
     @staticmethod
     def get_cache(world):
@@ -419,7 +566,12 @@ class SimCache:
             return current
         result = session.get_action(village_id=village_id, action="unit_info&ajax=data")
         if result:
-            SimCache.set_cache(world=world, entry=result.json())
+            try:
+                entry = result.json()
+            except ValueError:
+                return None
+            SimCache.set_cache(world=world, entry=entry)
+            return entry
 
     @staticmethod
     def cache_customize(entry):
@@ -428,3 +580,35 @@ class SimCache:
 
         for unit in entry["response"]["unit_data"]:
             return
+
+
+if __name__ == "__main__":
+    # Benchmark: simulated battles per second, scalar simulator against the batch simulator
+    import random
+    import time
+
+    random.seed(1)
+    battles = 20000
+    attack_units = ["axe", "light", "marcher", "ram"]
+    defend_units = ["spear", "sword", "archer", "heavy"]
+    attackers = [{unit: random.randint(0, 500) for unit in attack_units} for _ in range(battles)]
+    defenders = [{unit: random.randint(0, 500) for unit in defend_units} for _ in range(battles)]
+    walls = [random.randint(0, 20) for _ in range(battles)]
+
+    simulator = Simulator()
+    sample = 1000
+    start = time.perf_counter()
+    for index in range(sample):
+        simulator.simulate(attackers[index], defenders[index], walls[index], False, 100, 0)
+    scalar = sample / (time.perf_counter() - start)
+    print(f"Simulator:      {scalar:10.0f} battles/s")
+
+    if not HAS_NUMPY:
+        print("NumPy is not installed, skipping the batch simulator")
+    else:
+        batch = BatchSimulator()
+        attack_matrix, defend_matrix = batch.matrix(attackers), batch.matrix(defenders)
+        start = time.perf_counter()
+        batch.simulate_batch(attack_matrix, defend_matrix, wall=walls)
+        vectorized = battles / (time.perf_counter() - start)
+        print(f"BatchSimulator: {vectorized:10.0f} battles/s ({vectorized / scalar:.0f}x)")
@@ -161,6 +161,10 @@ class SnobManager:
             req = build_item["iron"] - self.resman.actual["iron"]
             self.resman.request(source="snob", resource="iron", amount=req)
             r = False
+        if not r:
+            self.resman.schedule("snob", build_item)
+        else:
+            self.resman.wake_times.pop("snob", None)
         return r
 
     def run(self):
@@ -0,0 +1,48 @@
+"""
+Queue timers of a village
+Keeps track of when the building, recruitment and smith queues free up so they are only checked when needed
+"""
+import time
+
+
+class QueueTimers:
+    """
+    Due time per queue slot of a single village ("build", "smith", "recruit_barracks", ...)
+    A slot without a timer is always due
+    """
+
+    def __init__(self):
+        """
+        Create the timers
+        """
+        self.timers = {}
+
+    def set(self, slot, when):
+        """
+        Sets the moment a slot frees up, None removes the timer
+        """
+        if when:
+            self.timers[slot] = when
+        else:
+            self.timers.pop(slot, None)
+
+    def due(self, slot, at=None):
+        """
+        Checks if a slot is free (or will be at a certain moment)
+        """
+        when = self.timers.get(slot, None)
+        return not when or when <= (at or time.time())
+
+    def remaining(self, slot):
+        """
+        Seconds until a slot frees up
+        """
+        return max(0, self.timers.get(slot, 0) - time.time())
+
+    def next_due(self):
+        """
+        The first moment a busy slot frees up, None if nothing is waiting
+        """
+        now = time.time()
+        upcoming = [when for when in self.timers.values() if when > now]
+        return min(upcoming) if upcoming else None
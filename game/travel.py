@@ -0,0 +1,119 @@
+"""
+Local travel time calculations
+Knowing the duration of a command before sending a single request
+"""
+import math
+
+from game.simulator import Simulator
+
+
+class TravelCalculator:
+    """
+    Calculates travel durations and keeps distance / duration tables per source village
+    """
+    # Minutes per field for units missing from the simulator pool
+    default_speeds = {"spy": 9, "militia": 0}
+
+    def __init__(self, world_speed=1.0, unit_speed=1.0, unit_info=None):
+        """
+        Create the travel calculator
+        unit_info speeds (as reported by the game) already include the world modifiers
+        """
+        self.world_speed = world_speed
+        self.unit_speed = unit_speed
+        self.unit_info = self.speeds_from_unit_info(unit_info)
+        self.tables = {}
+
+    @staticmethod
+    def speeds_from_unit_info(entry):
+        """
+        Reads the speed per unit from the (cached) world unit info
+        """
+        if not entry:
+            return {}
+        if "response" in entry and type(entry["response"]) == dict:
+            entry = entry["response"].get("unit_data", entry["response"])
+        output = {}
+        for unit, data in entry.items():
+            if type(data) == dict and data.get("speed", None):
+                output[unit] = float(data["speed"])
+        return output
+
+    def seconds_per_field(self, unit):
+        """
+        Travel time of a unit over a single field in seconds
+        """
+        if unit in self.unit_info:
+            return self.unit_info[unit] * 60
+        if unit in Simulator.pool:
+            speed = Simulator.pool[unit]["speed"]
+        else:
+            speed = self.default_speeds.get(unit, 0)
+        return speed * 60 / (self.world_speed * self.unit_speed)
+
+    @staticmethod
+    def distance(source, target):
+        """
+        Distance between two map locations in fields
+        """
+        return math.sqrt((source[0] - target[0]) ** 2 + (source[1] - target[1]) ** 2)
+
+    def duration(self, distance, units):
+        """
+        Duration of a command in seconds, the slowest unit sets the pace
+        """
+        per_field = [self.seconds_per_field(u) for u in units if units[u] and int(units[u]) > 0]
+        if not per_field:
+            return 0
+        return int(round(distance * max(per_field)))
+
+    def precompute(self, source, location, villages, version=None):
+        """
+        Builds the distance and per-unit duration tables for a source village
+        Rebuilt only when the map data (version) changes
+        """
+        if source in self.tables and self.tables[source]["version"] == version:
+            return self.tables[source]
+        distances = {}
+        for vid, village in villages.items():
+            distances[vid] = self.distance(location, village["location"])
+        units = list(Simulator.pool) + list(self.default_speeds)
+        durations = {}
+        for unit in units:
+            per_field = self.seconds_per_field(unit)
+            durations[unit] = {vid: int(round(dist * per_field)) for vid, dist in distances.items()}
+        self.tables[source] = {"version": version, "distances": distances, "durations": durations}
+        return self.tables[source]
+
+    def travel_time(self, source, target, units):
+        """
+        Duration of a command from a source village to a target using the tables
+        None if the target is not in the table of the source
+        """
+        table = self.tables.get(source, None)
+        if not table or target not in table["distances"]:
+            return None
+        times = [
+            table["durations"][u][target]
+            for u in units
+            if u in table["durations"] and units[u] and int(units[u]) > 0
+        ]
+        return max(times) if times else 0
+
+    def arrival(self, source, target, units, send_time):
+        """
+        Timestamp the command arrives when sent at send_time
+        """
+        duration = self.travel_time(source, target, units)
+        if duration is None:
+            return None
+        return send_time + duration
+
+    def send_time(self, source, target, units, arrival):
+        """
+        Timestamp a command has to be sent to arrive at a certain time
+        """
+        duration = self.travel_time(source, target, units)
+        if duration is None:
+            return None
+        return arrival - duration
@@ -8,39 +8,19 @@ import time
 
 from core.extractors import Extractor
 from game.resources import ResourceManager
+from game.scavenge import ScavengeSolver
 
 
 class TroopManager:
     """
     Troopmanager class
     """
-    can_recruit = True
-    can_attack = True
-    can_dodge = False
-    can_scout = True
-    can_farm = True
-    can_gather = True
-    can_fix_queue = True
-    randomize_unit_queue = True
-
-    queue = []
-    troops = {}
-
-    total_troops = {}
-
-    _research_wait = 0
-
-    wrapper = None
-    village_id = None
-    recruit_data = {}
-    game_data = {}
-    logger = None
-    max_batch_size = 50
-    wait_for = {}
-
-    _waits = {}
-
-    wanted = {"barracks": {}}
+    __slots__ = (
+        "can_recruit", "can_attack", "can_dodge", "can_scout", "can_farm", "can_gather", "can_fix_queue",
+        "randomize_unit_queue", "troops", "total_troops", "_research_wait", "wrapper", "village_id",
+        "recruit_data", "game_data", "logger", "max_batch_size", "wait_for", "queue_busy", "wanted",
+        "wanted_levels", "last_gather", "resman", "template", "timers",
+    )
 
     # Maps troops to the building they are created from
     unit_building = {
@@ -56,24 +36,41 @@ class TroopManager:
         "catapult": "garage",
     }
 
-    wanted_levels = {}
-
-    last_gather = 0
-
-    resman = None
-    template = None
-
     def __init__(self, wrapper=None, village_id=None):
         """
         Create the troop manager
         """
         self.wrapper = wrapper
         self.village_id = village_id
-        self.wait_for[village_id] = {"barracks": 0, "stable": 0, "garage": 0}
-        if not self.resman:
-            self.resman = ResourceManager(
-                wrapper=self.wrapper, village_id=self.village_id
-            )
+        self.can_recruit = True
+        self.can_attack = True
+        self.can_dodge = False
+        self.can_scout = True
+        self.can_farm = True
+        self.can_gather = True
+        self.can_fix_queue = True
+        self.randomize_unit_queue = True
+
+        self.troops = {}
+        self.total_troops = {}
+        self._research_wait = 0
+        self.recruit_data = {}
+        self.game_data = {}
+        self.logger = None
+        self.max_batch_size = 50
+        # Recruitment queue finish time per building, keyed by village
+        self.wait_for = {village_id: {"barracks": 0, "stable": 0, "garage": 0}}
+        # Queue finish time per building after the last recruitment plan
+        self.queue_busy = {}
+        self.wanted = {"barracks": {}}
+        self.wanted_levels = {}
+        self.last_gather = 0
+        self.template = None
+        # Queue timers of the village, busy recruitment queues and smith are not opened
+        self.timers = None
+        self.resman = ResourceManager(
+            wrapper=self.wrapper, village_id=self.village_id
+        )
 
     def update_totals(self):
         """
@@ -156,6 +153,192 @@ class TroopManager:
         self.logger.info("Recruitment:%s up-to-date", building)
         return False
 
+    def recruit_snapshot(self):
+        """
+        Reads resources, population, unit data and the queues of all buildings from the train screen
+        """
+        data = self.wrapper.get_url(f"game.php?village={self.village_id}&screen=train")
+        recruit_data = Extractor.recruit_data(data)
+        if not recruit_data:
+            return None
+        self.recruit_data = recruit_data
+        self.game_data = Extractor.game_state(data)
+        self.resman.update(self.game_data)
+        return Extractor.recruit_queue_ends(data)
+
+    def plan_recruitment(self, buildings, disabled_units=[], horizon=3600):
+        """
+        Splits units over all buildings so every queue keeps busy until the next wake-up
+        Units are added one at a time to the building with the least queued time,
+        picking the unit furthest away from its template target
+        Returns None if the train screen could not be read
+        """
+        queue_ends = self.recruit_snapshot()
+        if queue_ends is None:
+            return None
+        for building, end in queue_ends.items():
+            if end and building in self.wait_for[self.village_id]:
+                self.set_busy(building, end)
+        # Buildings without a queue on the train screen are idle
+        queue_ends = dict({building: 0 for building in buildings}, **queue_ends)
+        return self.recruitment_orders(buildings, queue_ends, disabled_units, horizon)
+
+    def recruitment_orders(self, buildings, queue_ends, disabled_units=[], horizon=3600):
+        """
+        Computes the recruitment plan from the current unit data, resources and queue finish times
+        Unknown finish times (None or missing) fall back to the last known recruitment
+        """
+        now = time.time()
+        village = self.game_data["village"]
+        available = {res: village[res] for res in ["wood", "stone", "iron"]}
+        for reserved in self.resman.projection.reserved.values():
+            for res in available:
+                available[res] -= reserved[res]
+        available["pop"] = village["pop_max"] - village["pop"]
+
+        busy = {}
+        deficit = {}
+        for building in buildings:
+            if building not in self.wanted:
+                continue
+            end = queue_ends.get(building, None)
+            if end is None:
+                # Unknown finish time, rely on the last known recruitment
+                end = self.wait_for[self.village_id][building]
+            busy[building] = max(now, end or 0)
+            for unit, target in self.wanted[building].items():
+                entry = self.recruit_data.get(unit, None)
+                if unit in disabled_units or not entry or not entry["requirements_met"]:
+                    continue
+                missing = target - int(self.total_troops.get(unit, 0))
+                if missing > 0:
+                    deficit[unit] = missing
+
+        plan = {building: {} for building in busy}
+        blocked = set()
+        while True:
+            open_buildings = [b for b in busy if busy[b] < now + horizon and b not in blocked]
+            if not open_buildings:
+                break
+            building = min(open_buildings, key=lambda b: busy[b])
+            options = [
+                unit for unit in self.wanted[building]
+                if deficit.get(unit, 0) > 0
+                and plan[building].get(unit, 0) < self.max_batch_size
+                and all(available[res] >= self.recruit_data[unit][res] for res in available)
+            ]
+            if not options:
+                blocked.add(building)
+                continue
+            unit = max(options, key=lambda u: deficit[u] / self.wanted[building][u])
+            plan[building][unit] = plan[building].get(unit, 0) + 1
+            deficit[unit] -= 1
+            busy[building] += int(self.recruit_data[unit]["build_time"])
+            for res in available:
+                available[res] -= self.recruit_data[unit][res]
+        self.queue_busy = busy
+
+        for building in plan:
+            waiting = [u for u in self.wanted[building] if deficit.get(u, 0) > 0 and not plan[building].get(u)]
+            if busy[building] < now + horizon and waiting:
+                # Out of resources, reserve a batch of the unit needed most
+                unit = max(waiting, key=lambda u: deficit[u] / self.wanted[building][u])
+                self.reserve_resources(self.recruit_data[unit], min(deficit[unit], self.max_batch_size), 0, unit)
+        return {building: units for building, units in plan.items() if units}
+
+    def recruit_planned(self, buildings, disabled_units=[], horizon=3600):
+        """
+        Plans the recruitment of all buildings from a single snapshot and sends one train request per building
+        Falls back to recruiting building by building if the train screen could not be read
+        """
+        if self.timers and buildings and not any(
+                self.timers.due(f"recruit_{building}", time.time() + horizon) for building in buildings
+        ):
+            self.logger.info("All recruitment queues are busy until after the next run")
+            return False
+        plan = self.plan_recruitment(buildings, disabled_units, horizon)
+        if plan is None:
+            self.logger.debug("Train screen not readable, recruiting per building")
+            for building in buildings:
+                self.start_update(building, disabled_units)
+            return False
+        if not plan:
+            self.logger.info("Recruitment up-to-date or waiting for resources")
+            return False
+
+        self.wrapper.priority_mode = True
+        try:
+            for building, units in plan.items():
+                result = self.wrapper.get_api_action(
+                    village_id=self.village_id,
+                    action="train",
+                    params={"screen": building, "mode": "train"},
+                    data={"units[%s]" % unit: str(amount) for unit, amount in units.items()},
+                )
+                if not result or "game_data" not in result:
+                    self.logger.warning("Recruitment of %s in %s failed", str(units), building)
+                    continue
+                self.resman.update(result["game_data"])
+                self.recruited(building, units, self.queue_busy[building])
+        finally:
+            self.wrapper.priority_mode = False
+        return True
+
+    def recruited(self, building, units, busy_until):
+        """
+        Registers started recruitment of multiple units in a building
+        """
+        self.set_busy(building, busy_until)
+        for unit, amount in units.items():
+            self.troops[unit] = str(int(self.troops.get(unit, 0)) + amount)
+            self.total_troops[unit] = int(self.total_troops.get(unit, 0)) + amount
+            self.resman.requested.pop(f"recruitment_{unit}", None)
+            self.resman.wake_times.pop(f"recruitment_{unit}", None)
+        self.logger.info(
+            "Recruitment of %s started (%s idle till %d)",
+            str(units), building, self.wait_for[self.village_id][building]
+        )
+        self.wrapper.reporter.report(
+            self.village_id,
+            "TWB_RECRUIT",
+            "Recruitment of %s started (%s idle till %d)"
+            % (str(units), building, self.wait_for[self.village_id][building]),
+        )
+
+    def get_state(self):
+        """
+        State kept over a restart (checkpoint)
+        """
+        return {
+            "wait_for": self.wait_for[self.village_id],
+            "research_wait": self._research_wait,
+            "last_gather": self.last_gather,
+        }
+
+    def set_state(self, state):
+        """
+        Restores the state of a checkpoint
+        """
+        self.wait_for[self.village_id].update(state.get("wait_for", {}))
+        self._research_wait = state.get("research_wait", 0)
+        self.last_gather = state.get("last_gather", 0)
+
+    def set_busy(self, building, busy_until):
+        """
+        Registers when the recruitment queue of a building runs empty
+        """
+        self.wait_for[self.village_id][building] = int(busy_until)
+        if self.timers:
+            self.timers.set(f"recruit_{building}", int(busy_until))
+
+    def set_research_busy(self, busy_until):
+        """
+        Registers when the smith finishes its running research
+        """
+        self._research_wait = busy_until
+        if self.timers:
+            self.timers.set("smith", busy_until)
+
     def get_min_possible(self, entry):
         """
         Calculates which units are needed the most
@@ -180,26 +363,12 @@ class TroopManager:
         """
         Read data from templates and determine the troops based op building progression
         """
-        last = None
-        wanted_upgrades = {}
-        for x in self.template:
-            if x["building"] not in levels:
-                return last
-
-            if x["level"] > levels[x["building"]]:
-                return last
-
-            last = x
-            if "upgrades" in x:
-                for unit in x["upgrades"]:
-                    if (
-                            unit not in wanted_upgrades
-                            or x["upgrades"][unit] > wanted_upgrades[unit]
-                    ):
-                        wanted_upgrades[unit] = x["upgrades"][unit]
-
-            self.wanted_levels = wanted_upgrades
-        return last
+        index = self.template.step_index(levels)
+        if index < 0:
+            return None
+        # A copy, the compiled template is shared by all villages and disabled units are removed from it
+        self.wanted_levels = dict(self.template.upgrades[index])
+        return self.template.steps[index]
 
     def research_time(self, time_str):
         """
@@ -227,6 +396,11 @@ class TroopManager:
         if not smith_data:
             self.logger.debug("Error reading smith data")
             return False
+        research_end = Extractor.research_queue_end(result)
+        if research_end and research_end > time.time():
+            self.set_research_busy(research_end)
+            self.logger.debug("Smith busy with another research until %s", self.readable_ts(research_end))
+            return False
         for unit_type in unit_levels:
             if not smith_data or unit_type not in smith_data["available"]:
                 self.logger.warning(
@@ -340,9 +514,7 @@ class TroopManager:
             )
             if res:
                 if "research_time" in data:
-                    self._research_wait = time.time() + self.research_time(
-                        data["research_time"]
-                    )
+                    self.set_research_busy(time.time() + self.research_time(data["research_time"]))
                 self.logger.info("Started research of %s", unit_type)
                 # self.resman.update(res["game_data"])
                 return True
@@ -384,85 +556,48 @@ class TroopManager:
         if "archer" in self.total_troops:
             haul_dict.extend(["archer:10", "marcher:50"])
 
-        # ADVANCED GATHER: Goes from gather_selection to 1, trying the same time (approximately) for every gather. Active hours exclude LC and Axes, at night everything is used for gather (except Paladin)
+        # ADVANCED GATHER: Splits the troops over gather_selection to 1 so every option returns at the same time
 
         if advanced_gather:
-            selection_map = [15, 21, 24,
-                             26]  # Divider in order to split the total carrying capacity of the troops into pieces that can fit into pretty much the same time frame
-
-            batch_multiplier = [15, 6, 3,
-                                2]  # Multiplier for equal distribution of troops. Time(gather1) = Time(gather2) if gather2 = 2.5 * gather1
-
-            troops = {key: int(value) for key, value in troops.items()}
-            total_carry = 0
-            for item in haul_dict:
-                item, carry = item.split(":")
-                if item == "knight":
-                    continue
-                if item in disabled_units:
-                    continue
-                if item in troops and int(troops[item]) > 0:
-                    total_carry += int(carry) * int(troops[item])
-                else:
-                    pass
-            gather_batch = math.floor(total_carry / selection_map[selection - 1])
-
-            for option in list(reversed(sorted(village_data['options'].keys())))[4 - selection:]:
+            # Troops are split so every option returns at the same time (see ScavengeSolver)
+            solver = ScavengeSolver(village_data['options'])
+            available = []
+            for option in village_data['options']:
                 self.logger.debug(
                     f"Option: {option} Locked? {village_data['options'][option]['is_locked']} Is underway? {village_data['options'][option]['scavenging_squad'] != None}")
-                if int(option) <= selection and not village_data['options'][option]['is_locked'] and not \
-                village_data['options'][option]['scavenging_squad'] != None:
-                    available_selection = int(option)
-                    self.logger.info(f"Gather operation {available_selection} is ready to start.")
-
-                    payload = {
-                        "squad_requests[0][village_id]": self.village_id,
-                        "squad_requests[0][option_id]": str(available_selection),
-                        "squad_requests[0][use_premium]": "false",
-                    }
-
-                    curr_haul = gather_batch * batch_multiplier[available_selection - 1]
-                    temp_haul = curr_haul
-
-                    self.logger.debug(
-                        f"Current Haul: {curr_haul} = Gather Batch ({gather_batch}) * Batch Multiplier {available_selection} ({batch_multiplier[available_selection - 1]})")
-
-                    for item in haul_dict:
-                        item, carry = item.split(":")
-                        if item == "knight":
-                            continue
-                        if item in disabled_units:
-                            continue
-
-                        if item in troops and int(troops[item]) > 0:
-                            troops_int = int(troops[item])
-                            troops_selected = 0
-                            for troop in range(troops_int):
-                                if (temp_haul - int(carry) < 0):
-                                    break
-                                else:
-                                    troops_selected += 1
-                                    temp_haul -= int(carry)
-                            troops_int -= troops_selected
-                            troops[item] = str(troops_int)
-                            payload["squad_requests[0][candidate_squad][unit_counts][%s]" % item] = str(troops_selected)
-                        else:
-                            payload["squad_requests[0][candidate_squad][unit_counts][%s]" % item] = "0"
-                    payload["squad_requests[0][candidate_squad][carry_max]"] = str(curr_haul)
-                    payload["h"] = self.wrapper.last_h
-                    self.wrapper.get_api_action(
-                        action="send_squads",
-                        params={"screen": "scavenge_api"},
-                        data=payload,
-                        village_id=self.village_id,
-                    )
-                    sleep += random.randint(1, 5)
-                    time.sleep(sleep)
-                    self.last_gather = int(time.time())
-                    self.logger.info(f"Using troops for gather operation: {available_selection}")
-                else:
-                    # Gathering already exists or locked
-                    break
+                if int(option) <= selection and not village_data['options'][option]['is_locked'] and \
+                        village_data['options'][option]['scavenging_squad'] is None:
+                    available.append(int(option))
+            gather_troops = {
+                item.split(":")[0]: troops.get(item.split(":")[0], 0)
+                for item in haul_dict
+                if item.split(":")[0] not in disabled_units
+            }
+            split = solver.solve(gather_troops, available)
+            self.logger.debug("Gather split over options %s: %s", available, split)
+
+            for available_selection in sorted(split, reverse=True):
+                units = split[available_selection]
+                self.logger.info(f"Gather operation {available_selection} is ready to start.")
+                payload = {
+                    "squad_requests[0][village_id]": self.village_id,
+                    "squad_requests[0][option_id]": str(available_selection),
+                    "squad_requests[0][use_premium]": "false",
+                }
+                for item in gather_troops:
+                    payload["squad_requests[0][candidate_squad][unit_counts][%s]" % item] = str(units.get(item, 0))
+                payload["squad_requests[0][candidate_squad][carry_max]"] = str(solver.capacity(units))
+                payload["h"] = self.wrapper.last_h
+                self.wrapper.get_api_action(
+                    action="send_squads",
+                    params={"screen": "scavenge_api"},
+                    data=payload,
+                    village_id=self.village_id,
+                )
+                sleep += random.randint(1, 5)
+                time.sleep(sleep)
+                self.last_gather = int(time.time())
+                self.logger.info(f"Using troops for gather operation: {available_selection}")
 
         else:
             for option in reversed(sorted(village_data['options'].keys())):
@@ -536,6 +671,10 @@ class TroopManager:
                 % (self.village_id, building)
             )
             if not self.can_fix_queue:
+                queue_end = Extractor.recruit_queue_ends(data).get(building, None)
+                if queue_end:
+                    # Not opened again until the manual queue is done
+                    self.set_busy(building, queue_end)
                 return True
             for entry in existing:
                 self.cancel(building=building, id=entry)
@@ -606,6 +745,7 @@ class TroopManager:
             # No need to reserve resources anymore!
             if f"recruitment_{unit_type}" in self.resman.requested:
                 self.resman.requested.pop(f"recruitment_{unit_type}", None)
+            self.resman.wake_times.pop(f"recruitment_{unit_type}", None)
 
         result = self.wrapper.get_api_action(
             village_id=self.village_id,
@@ -615,9 +755,7 @@ class TroopManager:
         )
         if "game_data" in result:
             self.resman.update(result["game_data"])
-            self.wait_for[self.village_id][building] = int(time.time()) + (
-                    amount * int(resources["build_time"])
-            )
+            self.set_busy(building, int(time.time()) + amount * int(resources["build_time"]))
             self.troops[unit_type] = str((int(self.troops[unit_type]) if unit_type in self.troops else 0) + amount)
             self.logger.info(
                 "Recruitment of %d %s started (%s idle till %d)",
@@ -650,6 +788,10 @@ class TroopManager:
         for res in ["wood", "stone", "iron"]:
             req = resources[res] * (wanted_times - has_times)
             self.resman.request(source=f"recruitment_{unit_type}", resource=res, amount=req)
+        self.resman.schedule(
+            f"recruitment_{unit_type}",
+            {res: resources[res] * create_amount for res in ["wood", "stone", "iron"]}
+        )
 
     def readable_ts(self, seconds):
         """
@@ -4,75 +4,170 @@ import time
 from codecs import decode
 from datetime import datetime
 
+from core.config import ConfigStore
 from core.extractors import Extractor
 from core.filemanager import FileManager
 from core.templates import TemplateManager
 from core.twstats import TwStats
 from game.attack import AttackManager
+from game.build_planner import BuildPlanner
 from game.buildingmanager import BuildingManager
 from game.defence_manager import DefenceManager
+from game.farm_solver import FarmSolver
+from game.loot import LootModel
 from game.map import Map
 from game.reports import ReportManager
 from game.resources import ResourceManager
+from game.simulator import SimCache
+from game.scout_planner import ScoutPlanner
 from game.snobber import SnobManager
+from game.timers import QueueTimers
+from game.travel import TravelCalculator
 from game.troopmanager import TroopManager
 from core.exceptions import *
 
 
 class Village:
-    village_id = None
-    builder = None
-    units = None
-    wrapper = None
-    resources = {}
-    game_data = {}
-    logger = None
-    force_troops = False
-    area = None
-    snobman = None
-    attack = None
-    resman = None
-    def_man = None
-    rep_man = None
-    config = None
-    forced_peace_today = False
-    village_set_name = None
-    last_attack = None
-    build_config = None
-    current_unit_entry = None
-    forced_peace = False
-    forced_peace_today_start = None
-    disabled_units = []
-
+    __slots__ = (
+        "village_id", "builder", "units", "wrapper", "game_data", "logger", "area", "snobman", "attack",
+        "resman", "def_man", "rep_man", "config", "forced_peace_today", "village_set_name", "last_attack",
+        "build_config", "current_unit_entry", "forced_peace", "forced_peace_today_start", "disabled_units",
+        "travel", "mass_gather", "mass_recruit", "farm_planner", "timers", "configured", "restored",
+    )
+
+    # Shared by all villages, the world data is the same for every village
     twp = TwStats()
 
+    # Config keys every manager is set up from, ("village", parameter) is a key of the village entry
+    manager_config = {
+        "builder": [
+            ("building", "max_lookahead"), ("building", "max_queued_items"), ("building", "build_planner"),
+            ("building", "plan_lookahead"),
+        ],
+        "units": [
+            ("units", "batch_size"), ("units", "remove_manual_queued"), ("units", "randomize_unit_queue"),
+            ("farms", "force_scout_if_available"), ("village", "gather_enabled"),
+        ],
+        "def_man": [
+            ("world", "flags_enabled"), ("village", "support_others_factor"), ("village", "support_others"),
+            ("village", "request_support_on_attack"), ("village", "evacuate_fragile_units_on_attack"),
+        ],
+        "attack": [
+            ("farms", "attack_higher_points"), ("farms", "min_points"), ("farms", "max_points"),
+            ("farms", "search_radius"), ("farms", "default_away_time"), ("farms", "full_loot_away_time"),
+            ("farms", "low_loot_away_time"), ("farms", "farm_scout_amount"), ("farms", "use_farm_assistant"),
+            ("farms", "scout_planner"), ("farms", "scout_budget"), ("farms", "use_loot_model"),
+            ("farms", "farm_solver"), ("farms", "max_farms"), ("farms", "ignored_villages"), ("village", "additional_farms"),
+            ("world", "speed"),
+        ],
+        "resman": [
+            ("market", "trade_max_per_hour"), ("market", "max_trade_duration"), ("market", "trade_multiplier"),
+            ("market", "trade_multiplier_value"), ("market", "do_premium_trade"),
+        ],
+        "travel": [("world", "speed"), ("world", "unit_speed")],
+    }
+
     def __init__(self, village_id=None, wrapper=None):
         self.village_id = village_id
         self.wrapper = wrapper
+        self.builder = None
+        self.units = None
+        self.game_data = {}
+        self.logger = None
+        self.area = None
+        self.snobman = None
+        self.attack = None
+        self.resman = None
+        self.def_man = None
+        # Shared by all villages of the account (set by TWB)
+        self.rep_man = None
+        self.config = None
+        self.forced_peace_today = False
+        self.village_set_name = None
+        self.last_attack = None
+        self.build_config = None
+        self.current_unit_entry = None
+        self.forced_peace = False
+        self.forced_peace_today_start = None
+        self.disabled_units = []
+        self.travel = None
+        self.mass_gather = False
+        self.mass_recruit = False
+        # Account wide farm planner (game.farm_planner.FarmPlanner), set by the bot
+        self.farm_planner = None
+        self.timers = QueueTimers()
+        # Managers that are set up with the current config
+        self.configured = set()
+        # Checkpoint state of the managers that were not created yet
+        self.restored = {}
 
     def get_config(self, section, parameter, default=None):
-        if section not in self.config:
-            self.logger.warning("Configuration section %s does not exist!" % section)
-            return default
-        if parameter not in self.config[section]:
-            self.logger.warning(
-                "Configuration parameter %s:%s does not exist!" % (section, parameter)
-            )
-            return default
-        return self.config[section][parameter]
+        return ConfigStore.value(self.config, section, parameter, default, logger=self.logger)
 
     def get_village_config(self, village_id, parameter, default=None):
         if village_id not in self.config["villages"]:
             return default
         vdata = self.config["villages"][village_id]
         if parameter not in vdata:
-            self.logger.warning(
-                "Village %s configuration parameter %s does not exist!",
-                village_id, parameter
+            ConfigStore.warn(
+                ("villages", village_id, parameter),
+                "Village %s configuration parameter %s does not exist!", village_id, parameter,
+                logger=self.logger
             )
             return default
         return vdata[parameter]
 
+    def config_changed(self, changes):
+        """
+        Sets up the managers that use a changed config key again before they are used next
+        """
+        keys = set()
+        for change in changes:
+            if change[0] != "villages":
+                keys.add(change)
+            elif len(change) == 3 and change[1] == self.village_id:
+                keys.add(("village", change[2]))
+        for manager, manager_keys in self.manager_config.items():
+            if keys.intersection(manager_keys):
+                self.configured.discard(manager)
+
+    def get_state(self):
+        """
+        State of the village and its managers for the checkpoint
+        """
+        state = {"timers": self.timers.timers}
+        for name in ["resman", "builder", "units", "area", "attack"]:
+            manager = getattr(self, name)
+            if manager:
+                state[name] = manager.get_state()
+            elif name in self.restored:
+                # Not used since the restart
+                state[name] = self.restored[name]
+        return state
+
+    def set_state(self, state):
+        """
+        Restores a checkpoint, the managers get their state when they are created
+        """
+        self.timers.timers.update(state.get("timers", {}))
+        self.restored = {name: value for name, value in state.items() if name != "timers"}
+
+    def restore(self, name, manager):
+        """
+        Applies the checkpoint state of a manager that was just created
+        """
+        if name in self.restored:
+            manager.set_state(self.restored.pop(name))
+
+    def needs_setup(self, manager):
+        """
+        Checks if a manager still has to be set up with the current config, only true once
+        """
+        if manager in self.configured:
+            return False
+        self.configured.add(manager)
+        return True
+
     def village_init(self):
         """
         Init the village entry and send first request
@@ -129,7 +224,7 @@ class Village:
         ):
             self.twp.run(world=self.get_config(section="server", parameter="server"))
 
-    def update_pre_run(self):
+    def update_pre_run(self, read_reports=True):
         """
         Manage defence, resources and reports
         """
@@ -137,6 +232,7 @@ class Village:
             self.resman = ResourceManager(
                 wrapper=self.wrapper, village_id=self.village_id
             )
+            self.restore("resman", self.resman)
 
         self.resman.update(self.game_data)
         self.wrapper.reporter.report(
@@ -147,7 +243,8 @@ class Village:
             self.rep_man = ReportManager(
                 wrapper=self.wrapper, village_id=self.village_id
             )
-        self.rep_man.read(full_run=False)
+        if read_reports:
+            self.rep_man.read(full_run=False)
 
         if not self.def_man:
             self.def_man = DefenceManager(
@@ -162,22 +259,23 @@ class Village:
         """
         Set-up the defence manager
         """
-        self.def_man.manage_flags_enabled = self.get_config(
-            section="world", parameter="flags_enabled", default=False
-        )
-        self.def_man.support_factor = self.get_village_config(
-            self.village_id, "support_others_factor", default=0.25
-        )
+        if self.needs_setup("def_man"):
+            self.def_man.manage_flags_enabled = self.get_config(
+                section="world", parameter="flags_enabled", default=False
+            )
+            self.def_man.support_factor = self.get_village_config(
+                self.village_id, "support_others_factor", default=0.25
+            )
 
-        self.def_man.allow_support_send = self.get_village_config(
-            self.village_id, parameter="support_others", default=False
-        )
-        self.def_man.allow_support_recv = self.get_village_config(
-            self.village_id, parameter="request_support_on_attack", default=False
-        )
-        self.def_man.auto_evacuate = self.get_village_config(
-            self.village_id, parameter="evacuate_fragile_units_on_attack", default=False
-        )
+            self.def_man.allow_support_send = self.get_village_config(
+                self.village_id, parameter="support_others", default=False
+            )
+            self.def_man.allow_support_recv = self.get_village_config(
+                self.village_id, parameter="request_support_on_attack", default=False
+            )
+            self.def_man.auto_evacuate = self.get_village_config(
+                self.village_id, parameter="evacuate_fragile_units_on_attack", default=False
+            )
         self.def_man.update(
             data.text,
             with_defence=self.get_config(
@@ -214,9 +312,10 @@ class Village:
         if not self.units:
             self.units = TroopManager(wrapper=self.wrapper, village_id=self.village_id)
             self.units.resman = self.resman
-        self.units.max_batch_size = self.get_config(
-            section="units", parameter="batch_size", default=25
-        )
+            self.units.timers = self.timers
+            self.restore("units", self.units)
+        if self.needs_setup("units"):
+            self.set_unit_options()
 
         # set village templates
         unit_config = self.get_village_config(
@@ -230,15 +329,33 @@ class Village:
                 section="units", parameter="default", default="basic"
             )
         try:
-            self.units.template = TemplateManager.get_template(
-                category="troops", template=unit_config, output_json=True
-            )
+            self.units.template = TemplateManager.troops(unit_config)
         except Exception as e:
             self.logger.error(
                 "Looks like the unit template file %s is either missing or corrupted", unit_config
             )
             raise InvalidUnitTemplateException
 
+    def set_unit_options(self):
+        """
+        Sets the recruitment, scouting and gathering options of the troop manager
+        """
+        self.units.max_batch_size = self.get_config(
+            section="units", parameter="batch_size", default=25
+        )
+        self.units.can_fix_queue = self.get_config(
+            section="units", parameter="remove_manual_queued", default=False
+        )
+        self.units.randomize_unit_queue = self.get_config(
+            section="units", parameter="randomize_unit_queue", default=True
+        )
+        self.units.can_scout = self.get_config(
+            section="farms", parameter="force_scout_if_available", default=True
+        )
+        self.units.can_gather = self.get_village_config(
+            self.village_id, parameter="gather_enabled", default=False
+        )
+
     def run_builder(self):
         """
         Run building construction actions
@@ -248,12 +365,15 @@ class Village:
                 wrapper=self.wrapper, village_id=self.village_id
             )
             self.builder.resman = self.resman
+            self.builder.timers = self.timers
+            self.restore("builder", self.builder)
             # manage buildings (has to always run because recruit check depends on building levels)
         self.build_config = self.get_village_config(
             self.village_id, parameter="building", default=None
         )
         if self.build_config is False:
             self.logger.debug("Builder is disabled for village %s", self.village_id)
+            self.resman.release("building")
             return
         if not self.build_config:
             self.logger.warning(
@@ -262,24 +382,28 @@ class Village:
             self.build_config = self.get_config(
                 section="building", parameter="default", default="purple_predator"
             )
-        new_queue = TemplateManager.get_template(
-            category="builder", template=self.build_config
-        )
-        if not self.builder.raw_template or self.builder.raw_template != new_queue:
-            self.builder.queue = new_queue
-            self.builder.raw_template = new_queue
+        template = TemplateManager.builder(self.build_config)
+        if self.builder.template is not template:
+            # The compiled template only changes when the file does
+            skip = []
             if not self.get_config(
                     section="world", parameter="knight_enabled", default=False
             ):
-                self.builder.queue = [
-                    x for x in self.builder.queue if "statue" not in x
-                ]
-        self.builder.max_lookahead = self.get_config(
-            section="building", parameter="max_lookahead", default=2
-        )
-        self.builder.max_queue_len = self.get_config(
-            section="building", parameter="max_queued_items", default=2
-        )
+                skip.append("statue")
+            self.builder.queue = template.queue(skip)
+            self.builder.template = template
+        if self.needs_setup("builder"):
+            self.builder.max_lookahead = self.get_config(
+                section="building", parameter="max_lookahead", default=2
+            )
+            self.builder.max_queue_len = self.get_config(
+                section="building", parameter="max_queued_items", default=2
+            )
+            self.builder.planner = None
+            if self.get_config(section="building", parameter="build_planner", default=False):
+                self.builder.planner = BuildPlanner(
+                    lookahead=self.get_config(section="building", parameter="plan_lookahead", default=4)
+                )
         self.builder.start_update(
             build=self.get_config(
                 section="building", parameter="manage_buildings", default=True
@@ -321,8 +445,8 @@ class Village:
             end_dt = datetime.strptime(time_pairs["end"], "%d.%m.%y %H:%M:%S")
             now = datetime.now()
             if start_dt.date() == datetime.today().date():
-                forced_peace_today = True
-                forced_peace_today_start = start_dt
+                self.forced_peace_today = True
+                self.forced_peace_today_start = start_dt
             if start_dt < now < end_dt:
                 self.logger.debug("Currently in a forced peace time! No attacks will be send.")
                 self.forced_peace = True
@@ -359,17 +483,34 @@ class Village:
         ):
             self.units.attempt_upgrade()
 
+    def recruit_buildings(self):
+        """
+        Buildings that can recruit right now, None if recruitment is disabled or on hold
+        """
+        if not self.get_config(section="units", parameter="recruit", default=False):
+            return None
+        # prioritize_building: will only recruit when builder has sufficient funds for queue items
+        if (
+                self.get_village_config(
+                    self.village_id, parameter="prioritize_building", default=False
+                )
+                and not self.resman.can_recruit()
+        ) or (
+                self.get_village_config(
+                    self.village_id, parameter="prioritize_snob", default=False
+                )
+                and self.snobman
+                and self.snobman.can_snob
+                and self.snobman.is_incomplete
+        ):
+            return None
+        return [b for b in self.units.wanted if self.builder.get_level(b)]
+
     def do_recruit(self):
         """
         Recruits new units
         """
         if self.get_config(section="units", parameter="recruit", default=False):
-            self.units.can_fix_queue = self.get_config(
-                section="units", parameter="remove_manual_queued", default=False
-            )
-            self.units.randomize_unit_queue = self.get_config(
-                section="units", parameter="randomize_unit_queue", default=True
-            )
             # prioritize_building: will only recruit when builder has sufficient funds for queue items
             if (
                     self.get_village_config(
@@ -395,6 +536,13 @@ class Village:
                 for x in list(self.resman.requested.keys()):
                     if "recruitment_" in x:
                         self.resman.requested.pop(f"{x}", None)
+            elif self.mass_recruit:
+                self.logger.debug("Recruitment is done for all villages at once")
+            elif self.get_config(section="units", parameter="recruit_planner", default=False):
+                buildings = [b for b in self.units.wanted if self.builder.get_level(b)]
+                # Keep the queues busy until the next run
+                horizon = self.get_config(section="bot", parameter="active_delay", default=600) + 120
+                self.units.recruit_planned(buildings, self.disabled_units, horizon=horizon)
             else:
                 # do a build run for every
                 for building in self.units.wanted:
@@ -446,21 +594,72 @@ class Village:
         self.attack.scout_farm_amount = self.get_config(
             section="farms", parameter="farm_scout_amount", default=5
         )
-        if self.current_unit_entry:
-            self.attack.template = self.current_unit_entry["farm"]
+        self.attack.use_farm_assistant = self.get_config(
+            section="farms", parameter="use_farm_assistant", default=False
+        )
+        self.attack.max_farms = self.get_config(
+            section="farms", parameter="max_farms", default=25
+        )
+        self.attack.ignored_villages = self.get_config(
+            section="farms", parameter="ignored_villages", default=[]
+        )
+        self.attack.extra_farm = self.get_village_config(
+            self.village_id, parameter="additional_farms", default=[]
+        )
+        if self.get_config(section="farms", parameter="scout_planner", default=False):
+            if not self.attack.scout_planner:
+                self.attack.scout_planner = ScoutPlanner(repman=self.rep_man)
+            self.attack.scout_planner.budget = self.get_config(
+                section="farms", parameter="scout_budget", default=5
+            )
+        else:
+            self.attack.scout_planner = None
+        if self.get_config(section="farms", parameter="use_loot_model", default=False):
+            if not self.attack.loot_model:
+                self.attack.loot_model = LootModel(repman=self.rep_man, travel=self.travel)
+            self.attack.loot_model.world_speed = self.travel.world_speed
+        else:
+            self.attack.loot_model = None
+        if self.get_config(section="farms", parameter="farm_solver", default=False):
+            if not self.attack.farm_solver:
+                self.attack.farm_solver = FarmSolver(repman=self.rep_man)
+            self.attack.farm_solver.loot_model = self.attack.loot_model
+        else:
+            self.attack.farm_solver = None
+
+    def update_travel_tables(self):
+        """
+        Keeps the local travel time tables of the village in sync with the map
+        """
+        if not self.travel:
+            world = self.get_config(section="server", parameter="server")
+            self.travel = TravelCalculator(
+                unit_info=SimCache.grab_cache(world, self.wrapper, self.village_id)
+            )
+        if self.needs_setup("travel"):
+            self.travel.world_speed = self.get_config(
+                section="world", parameter="speed", default=1.0
+            )
+            self.travel.unit_speed = self.get_config(
+                section="world", parameter="unit_speed", default=1.0
+            )
+        if self.area.my_location:
+            self.travel.precompute(
+                self.village_id, self.area.my_location, self.area.villages, version=self.area.last_fetch
+            )
 
     def run_farming(self):
         """
         Runs the farming logic
         """
+        self.check_forced_peace()
         if not self.forced_peace and self.units.can_attack:
             if not self.area:
                 self.area = Map(wrapper=self.wrapper, village_id=self.village_id)
+                self.restore("area", self.area)
             self.area.get_map()
+            self.update_travel_tables()
             if self.area.villages:
-                self.units.can_scout = self.get_config(
-                    section="farms", parameter="force_scout_if_available", default=True
-                )
                 self.logger.info(
                     "%d villages from map cache, (your location: %s)",
                         len(self.area.villages),
@@ -474,34 +673,46 @@ class Village:
                         map=self.area,
                     )
                     self.attack.repman = self.rep_man
+                    self.restore("attack", self.attack)
 
+                self.attack.forced_peace_time = None
                 if self.forced_peace_today:
                     self.logger.info("Forced peace time coming up today!")
                     self.attack.forced_peace_time = self.forced_peace_today_start
-                self.set_farm_options()
+                if self.current_unit_entry:
+                    self.attack.template = self.current_unit_entry["farm"]
+                self.attack.travel = self.travel
+                self.attack.farm_planner = self.farm_planner
+                if self.needs_setup("attack"):
+                    self.set_farm_options()
 
                 if (
                         self.get_config(section="farms", parameter="farm", default=False)
                         and not self.def_man.under_attack
                 ):
-                    self.attack.extra_farm = self.get_village_config(
-                        self.village_id, parameter="additional_farms", default=[]
-                    )
-                    self.attack.max_farms = self.get_config(
-                        section="farms", parameter="max_farms", default=25
-                    )
-                    self.attack.ignored_villages = self.get_config(
-                        section="farms", parameter="ignored_villages", default=[]
-                    )
                     self.attack.run()
 
+    def gather_settings(self):
+        """
+        Gather settings used by mass scavenging, None if the village should not gather
+        """
+        if not self.get_village_config(self.village_id, parameter="gather_enabled", default=False):
+            return None
+        if self.def_man and self.def_man.under_attack:
+            return None
+        return {
+            "selection": self.get_village_config(self.village_id, parameter="gather_selection", default=1),
+            "disabled_units": self.disabled_units,
+            "advanced": self.get_village_config(self.village_id, parameter="advanced_gather", default=1),
+        }
+
     def do_gather(self):
         """
         Runs gathering if unlocked and active
         """
-        self.units.can_gather = self.get_village_config(
-            self.village_id, parameter="gather_enabled", default=False
-        )
+        if self.mass_gather:
+            self.logger.debug("Gathering is done for all villages at once")
+            return
         if not self.def_man or not self.def_man.under_attack:
             self.units.gather(
                 selection=self.get_village_config(
@@ -519,18 +730,8 @@ class Village:
                 section="market", parameter="auto_trade", default=False
         ) and self.builder.get_level("market"):
             self.logger.info("Managing market")
-            self.resman.trade_max_per_hour = self.get_config(
-                section="market", parameter="trade_max_per_hour", default=1
-            )
-            self.resman.trade_max_duration = self.get_config(
-                section="market", parameter="max_trade_duration", default=1
-            )
-            if self.get_config(
-                    section="market", parameter="trade_multiplier", default=False
-            ):
-                self.resman.trade_bias = self.get_config(
-                    section="market", parameter="trade_multiplier_value", default=1.0
-                )
+            if self.needs_setup("resman"):
+                self.set_market_options()
             self.resman.manage_market(
                 drop_existing=self.get_config(
                     section="market", parameter="auto_remove", default=True
@@ -545,12 +746,36 @@ class Village:
         ) and self.get_village_config(
             self.village_id, parameter="trade_for_premium", default=False
         ):
-            self.resman.do_premium_trade = self.get_config(
-                section="market", parameter="do_premium_trade", default=False
-            )
+            if self.needs_setup("resman"):
+                self.set_market_options()
             self.resman.do_premium_stuff()
 
-    def run(self, config=None, first_run=False):
+    def set_market_options(self):
+        """
+        Sets the trading options of the resource manager
+        """
+        self.resman.trade_max_per_hour = self.get_config(
+            section="market", parameter="trade_max_per_hour", default=1
+        )
+        self.resman.trade_max_duration = self.get_config(
+            section="market", parameter="max_trade_duration", default=1
+        )
+        self.resman.trade_bias = 1
+        if self.get_config(
+                section="market", parameter="trade_multiplier", default=False
+        ):
+            self.resman.trade_bias = self.get_config(
+                section="market", parameter="trade_multiplier_value", default=1.0
+            )
+        self.resman.do_premium_trade = self.get_config(
+            section="market", parameter="do_premium_trade", default=False
+        )
+
+    def prepare_run(self, config, read_reports=True):
+        """
+        Reads the village state and sets up the managers every stage depends on
+        Returns the village config, False if the village is not managed
+        """
         # setup and check if village still exists / is accessible
         self.config = config
         self.wrapper.delay = self.get_config(
@@ -578,9 +803,15 @@ class Village:
         if not self.game_data:
             raise InvalidGameStateException
 
-        self.update_pre_run()
+        self.update_pre_run(read_reports=read_reports)
 
         self.setup_defence_manager(data=data)
+        return vdata
+
+    def run(self, config=None, first_run=False):
+        vdata = self.prepare_run(config)
+        if vdata is False:
+            return False
         self.run_quest_actions(config=config)
 
         self.run_builder()
@@ -598,6 +829,87 @@ class Village:
         self.do_gather()
         self.go_manage_market()
 
+        self.finish_run(vdata)
+
+    def run_tasks(self, config, tasks):
+        """
+        Runs only the given stages of the village cycle (scheduler)
+        The defence check is part of every run because it comes with the overview page
+        """
+        vdata = self.prepare_run(config, read_reports="reports" in tasks)
+        if vdata is False:
+            return False
+        if "build" in tasks:
+            self.run_quest_actions(config=config)
+            self.run_builder()
+        if {"recruit", "farm", "gather"} & set(tasks):
+            self.units_get_template()
+            self.set_unit_wanted_levels()
+            self.units.update_totals()
+        if "recruit" in tasks:
+            self.run_unit_upgrades()
+            self.run_snob_recruit()
+            self.do_recruit()
+            self.manage_local_resources()
+        if "farm" in tasks:
+            self.run_farming()
+        if "gather" in tasks:
+            self.do_gather()
+        if "market" in tasks:
+            self.go_manage_market()
+        self.finish_run(vdata)
+
+    def scheduled_tasks(self):
+        """
+        Stages of the village cycle the scheduler has to plan for this village
+        Reports are account wide and planned for a single village by the scheduler
+        """
+        tasks = []
+        if self.get_config(section="units", parameter="manage_defence", default=False):
+            tasks.append("defence")
+        if self.get_village_config(self.village_id, parameter="building", default=None) is not False:
+            tasks.append("build")
+        if (
+                self.get_config(section="units", parameter="recruit", default=False)
+                or self.get_config(section="units", parameter="upgrade", default=False)
+                or self.get_village_config(self.village_id, parameter="snobs", default=0)
+        ):
+            tasks.append("recruit")
+        if self.get_config(section="farms", parameter="farm", default=False):
+            tasks.append("farm")
+        if self.get_village_config(self.village_id, parameter="gather_enabled", default=False):
+            tasks.append("gather")
+        if self.get_config(section="market", parameter="auto_trade", default=False) or self.get_village_config(
+                self.village_id, parameter="trade_for_premium", default=False
+        ):
+            tasks.append("market")
+        return tasks
+
+    def next_task_time(self, task, delay):
+        """
+        When a stage of the village cycle has something to do again (scheduler)
+        Busy queues and actions waiting for resources wake up at their own time, the rest after the delay
+        """
+        now = time.time()
+        if task == "defence" and self.def_man and self.def_man.under_attack:
+            # Incoming attacks are checked more often
+            return now + delay / 4
+        candidates = []
+        if task == "build":
+            candidates = [self.timers.timers.get("build", None), self.resman.wake_times.get("building", None)]
+        elif task == "recruit":
+            candidates = [self.timers.timers.get(f"recruit_{b}", None) for b in self.units.wanted] + [
+                self.timers.timers.get("smith", None)
+            ] + [
+                wake for source, wake in self.resman.wake_times.items()
+                if source == "snob" or source.startswith("recruitment_")
+            ]
+        return min([now + delay] + [when for when in candidates if when and when > now])
+
+    def finish_run(self, vdata):
+        """
+        Stores the village state after a run
+        """
         self.set_cache_vars()
         self.logger.info("Village cycle done, returning to overview")
         self.wrapper.reporter.report(
@@ -677,7 +989,7 @@ class Village:
             "required_resources": self.resman.requested,
             "available_troops": self.units.troops,
             "buidling_levels": self.builder.levels,
-            "building_queue": self.builder.queue,
+            "building_queue": ["%s:%d" % entry for entry in self.builder.queue],
             "troops": self.units.total_troops,
             "under_attack": self.def_man.under_attack,
             "last_run": int(time.time()),
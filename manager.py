@@ -1,8 +1,8 @@
-import json
 import logging
 import os
 import sys
 
+from core.filemanager import FileManager
 from game.attack import AttackCache
 from game.reports import ReportCache
 
@@ -11,16 +11,16 @@ class VillageManager:
     @staticmethod
     def farm_manager(verbose=False, clean_reports=False):
         logger = logging.getLogger("FarmManager")
-        with open("config.json", "r") as f:
-            config = json.load(f)
+        config = FileManager.load_json_file("config.json")
 
         if verbose:
             logger.info("Villages: %d", len(config["villages"]))
         attacks = AttackCache.cache_grab()
-        reports = ReportCache.cache_grab()
+        # Only the reports on farms are read, through the per village report index
+        index = ReportCache.get_index() or ReportCache.build_index()
 
         if verbose:
-            logger.info("Reports: %d", len(reports))
+            logger.info("Reports: %d", sum(len(village["reports"]) for village in index.values()))
             logger.info("Farms: %d", len(attacks))
         t = {"wood": 0, "iron": 0, "stone": 0}
         for farm in attacks:
@@ -30,6 +30,7 @@ class VillageManager:
             loot = {"wood": 0, "iron": 0, "stone": 0}
             total_loss_count = 0
             total_sent_count = 0
+            reports = ReportCache.village_reports(index, farm)
             for rep in reports:
                 if reports[rep]["dest"] == farm and reports[rep]["type"] == "attack":
                     for unit in reports[rep]["extra"]["units_sent"]:
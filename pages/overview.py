@@ -2,7 +2,6 @@ import dataclasses
 import re
 from typing import Dict, Optional, Tuple
 
-from bs4 import BeautifulSoup
 from requests import Response
 
 from core.request import WebWrapper
@@ -216,6 +215,9 @@ class OverviewPage:
         self.wrapper: WebWrapper = wrapper
         self.world_settings: WorldSettings = WorldSettings()
         self.result_get: Response = self._get_overview_villages_data()
+        # Imported on first use, bs4 is slow to import and only used here
+        from bs4 import BeautifulSoup
+
         self.soup = BeautifulSoup(self.result_get.text, "html.parser")
         self.header_info = self.soup.find("table", id="header_info")
         self.production_table = self.soup.find("table", id="production_table")
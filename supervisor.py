@@ -0,0 +1,226 @@
+"""
+TWB supervisor - runs multiple accounts, every account in its own process
+
+Usage: python supervisor.py [account directory ...]
+Every account directory holds the config.json of the account, its cache is stored next to it.
+World data (cache/world) is shared between all accounts.
+Without arguments every directory in accounts/ that holds a config.json is started.
+
+Workers can not ask for the cookie string, log in once with: python supervisor.py --setup <account directory>
+"""
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+
+from core.filemanager import FileManager
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+
+
+def run_account(name, root, stats):
+    """
+    Worker process: runs the bot of a single account
+    The bot is imported after the account directory is set so all its files are read from that directory
+    """
+    FileManager.account_root = root
+    from twb import TWB
+
+    bot = TWB()
+
+    def report():
+        while True:
+            stats.put({
+                "account": name,
+                "pid": os.getpid(),
+                "time": time.time(),
+                "runs": bot.runs,
+                "requests": bot.wrapper.requests_made if bot.wrapper else 0,
+            })
+            time.sleep(Supervisor.stats_interval)
+
+    threading.Thread(target=report, daemon=True).start()
+    bot.start()
+
+
+class Supervisor:
+    """
+    Starts a worker process per account and restarts crashed workers with an increasing delay
+    """
+    logger = logging.getLogger("Supervisor")
+
+    # Restart delay after a worker stopped (seconds), doubled for every stop in a row
+    backoff = 30
+    max_backoff = 3600
+    # A worker that ran this long before crashing starts over with the shortest delay
+    stable_after = 1800
+    # Seconds between statistics of a worker and between health reports
+    stats_interval = 60
+    report_interval = 300
+
+    def __init__(self, accounts):
+        """
+        Create the supervisor for {name: account directory}
+        """
+        self.accounts = accounts
+        self.stats = multiprocessing.Queue()
+        self.workers = {}
+        self.health = {
+            name: {
+                "pid": None,
+                "alive": False,
+                "started": None,
+                "restarts": 0,
+                "crashes_in_row": 0,
+                "last_exit": None,
+                "restart_at": 0,
+                "runs": 0,
+                "requests": 0,
+                "requests_per_hour": 0,
+            }
+            for name in accounts
+        }
+        self.should_run = True
+
+    def start_worker(self, name):
+        """
+        Starts the worker process of an account
+        """
+        worker = multiprocessing.Process(
+            target=run_account, args=(name, self.accounts[name], self.stats), name=f"TWB-{name}", daemon=True
+        )
+        worker.start()
+        self.workers[name] = worker
+        self.health[name].update(pid=worker.pid, alive=True, started=time.time(), runs=0, requests=0)
+        self.logger.info("Started account %s (pid %d)", name, worker.pid)
+
+    def check_workers(self):
+        """
+        Restarts stopped workers once their backoff delay passed
+        The bot also returns normally when the game can not be reached or the config is incomplete,
+        so only stop() ends an account on purpose
+        """
+        now = time.time()
+        for name in self.accounts:
+            health = self.health[name]
+            worker = self.workers.get(name, None)
+            if worker and worker.is_alive():
+                continue
+            if worker:
+                self.workers.pop(name)
+                health.update(alive=False, pid=None, last_exit=worker.exitcode)
+                if now - health["started"] > self.stable_after:
+                    health["crashes_in_row"] = 0
+                health["crashes_in_row"] += 1
+                delay = min(self.max_backoff, self.backoff * 2 ** (health["crashes_in_row"] - 1))
+                health["restart_at"] = now + delay
+                self.logger.warning(
+                    "Account %s %s (exit code %s), restarting in %d seconds",
+                    name, "stopped" if worker.exitcode == 0 else "crashed", worker.exitcode, delay
+                )
+                continue
+            if now >= health["restart_at"]:
+                if health["started"]:
+                    health["restarts"] += 1
+                self.start_worker(name)
+
+    def collect(self):
+        """
+        Reads the statistics the workers sent
+        """
+        while not self.stats.empty():
+            entry = self.stats.get()
+            health = self.health.get(entry["account"], None)
+            if not health or entry["pid"] != health["pid"]:
+                continue
+            health["runs"] = entry["runs"]
+            health["requests"] = entry["requests"]
+            hours = max(entry["time"] - health["started"], 1) / 3600
+            health["requests_per_hour"] = int(entry["requests"] / hours)
+
+    def report(self):
+        """
+        Logs the health of all accounts and stores it in accounts/health.json
+        """
+        alive = [name for name, health in self.health.items() if health["alive"]]
+        self.logger.info(
+            "%d/%d accounts running, %d requests per hour in total",
+            len(alive), len(self.accounts), sum(h["requests_per_hour"] for h in self.health.values())
+        )
+        for name, health in self.health.items():
+            self.logger.info(
+                "%s: %s, %d runs, %d requests/hour, %d restarts",
+                name, "running" if health["alive"] else "down", health["runs"],
+                health["requests_per_hour"], health["restarts"]
+            )
+        FileManager.create_directories(["accounts"])
+        FileManager.save_json_file(
+            {"time": int(time.time()), "accounts": self.health}, "accounts/health.json"
+        )
+
+    def stop(self, *args):
+        """
+        Stops all workers
+        """
+        self.should_run = False
+        for worker in self.workers.values():
+            worker.terminate()
+
+    def run(self):
+        """
+        Supervises the workers until stopped
+        """
+        last_report = time.time()
+        while self.should_run:
+            self.check_workers()
+            self.collect()
+            if time.time() - last_report > self.report_interval:
+                self.report()
+                last_report = time.time()
+            time.sleep(1)
+
+
+def find_accounts(paths):
+    """
+    Account directories from the arguments, all directories in accounts/ if none are given
+    """
+    if not paths:
+        base = FileManager.get_path("accounts")
+        if not os.path.isdir(base):
+            return {}
+        paths = [os.path.join(base, entry) for entry in sorted(os.listdir(base))]
+    accounts = {}
+    for path in paths:
+        path = os.path.abspath(path)
+        if not os.path.isfile(os.path.join(path, "config.json")):
+            if os.path.isdir(path):
+                logging.warning("Skipping %s because it has no config.json", path)
+            continue
+        accounts[os.path.basename(path)] = path
+    return accounts
+
+
+if __name__ == "__main__":
+    if "--setup" in sys.argv:
+        # Runs a single account in the foreground so the session can be set up
+        setup = find_accounts([arg for arg in sys.argv[1:] if arg != "--setup"][:1])
+        if not setup:
+            logging.error("Account directory with a config.json required")
+            sys.exit(1)
+        name, root = list(setup.items())[0]
+        run_account(name, root, multiprocessing.Queue())
+        sys.exit(0)
+    found = find_accounts(sys.argv[1:])
+    if not found:
+        logging.error("No accounts found, create a directory per account with its config.json in accounts/")
+        sys.exit(1)
+    supervisor = Supervisor(found)
+    signal.signal(signal.SIGINT, supervisor.stop)
+    signal.signal(signal.SIGTERM, supervisor.stop)
+    supervisor.run()
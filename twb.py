@@ -25,27 +25,43 @@ import json
 import logging
 import os
 import random
+import re
 import sys
 import signal
+import subprocess
+import threading
 import time
 import traceback
-import coloredlogs
 import requests
 
+from core.config import ConfigStore
 from core.notification import Notification
-from core.updater import check_update
+from core.updater import check_update_background
 from core.filemanager import FileManager
 from core.request import WebWrapper
+from game.balancer import ResourceBalancer
+from game.farm_planner import FarmPlanner
+from game.mass_recruit import MassRecruiter
+from game.scavenge import MassScavenger
+from game.scheduler import TaskScheduler
 from game.village import Village
 from manager import VillageManager
 from pages.overview import OverviewPage
-from core.exceptions import UnsupportedPythonVersion
+from core.exceptions import InvalidJSONException, UnsupportedPythonVersion
 from core.extractors import Extractor
 
-coloredlogs.install(
-    level=logging.DEBUG if "-q" not in sys.argv else logging.INFO,
-    fmt="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-)
+
+def setup_logging():
+    """
+    Colored console logging, only installed when the bot is started from the command line
+    """
+    import coloredlogs
+
+    coloredlogs.install(
+        level=logging.DEBUG if "-q" not in sys.argv else logging.INFO,
+        fmt="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+
 
 logging.getLogger("requests").setLevel(logging.WARNING)
 logging.getLogger("urllib3").setLevel(logging.WARNING)
@@ -70,11 +86,32 @@ class TWB:
     Also verifies, merges and updates the config file automatically
     """
     res = None
-    villages = []
     wrapper = None
     should_run = True
     runs = 0
-    found_villages = []
+    farm_planner = None
+    balancer = None
+    scavenger = None
+    recruiter = None
+    scheduler = None
+    # Village the account wide report reading is planned for
+    reports_village = None
+    # Never wake up earlier than this (seconds) for an affordable action
+    min_sleep = 60
+
+    def __init__(self):
+        """
+        Create the bot, every instance manages its own villages
+        """
+        self.villages = []
+        self.found_villages = []
+        # Parsed config, only read again when the file changes
+        self.config_store = ConfigStore()
+        # Internet check running in the background (started with the bot)
+        self.online_check = None
+        self.online = True
+        # State of the last run, restored when the villages are created
+        self.checkpoint = {}
 
     @staticmethod
     def internet_online():
@@ -84,13 +121,125 @@ class TWB:
         try:
             requests.get("https://github.com/stefan2200/TWB", timeout=(10, 60))
             return True
-        except requests.Timeout:
+        except requests.RequestException:
             return False
 
+    def start_online_check(self):
+        """
+        Checks the internet access in the background so the first game request is not delayed
+        """
+        def check():
+            self.online = self.internet_online()
+
+        self.online_check = threading.Thread(target=check, name="OnlineCheck", daemon=True)
+        self.online_check.start()
+
+    def is_online(self):
+        """
+        Result of the background check if one is running, a new check otherwise
+        """
+        if self.online_check:
+            self.online_check.join()
+            self.online_check = None
+            return self.online
+        return self.internet_online()
+
+    def offline_sleep(self, config):
+        """
+        Waits for the next run while the internet is down
+        """
+        print("Internet seems to be down, waiting till its back online...")
+        sleep = 0
+        if self.is_active_hours(config=config):
+            sleep = config["bot"]["active_delay"]
+        else:
+            if config["bot"]["inactive_still_active"]:
+                sleep = config["bot"]["inactive_delay"]
+
+        sleep += random.randint(20, 120)
+        dtn = datetime.datetime.now()
+        dt_next = dtn + datetime.timedelta(0, sleep)
+        print(
+            "Dead for %.2f minutes (next run at: %s)" % (sleep / 60, dt_next.time())
+        )
+        time.sleep(sleep)
+
+    def resource_wake_up(self, sleep):
+        """
+        Wakes up earlier when a village can afford its next action or a queue frees up before the regular delay
+        """
+        wake_times = [
+            v.resman.next_wake() for v in self.villages if v.resman and v.resman.next_wake()
+        ] + [
+            v.timers.next_due() for v in self.villages if v.timers and v.timers.next_due()
+        ]
+        if not wake_times:
+            return sleep
+        wake = min(wake_times) - time.time() + random.randint(5, 30)
+        if wake < sleep:
+            print("Waking up early for an affordable action or free queue in %.2f minutes" % (wake / 60))
+            return int(max(self.min_sleep, wake))
+        return sleep
+
+    def run_scheduled(self, village, config, tasks, delay):
+        """
+        Runs the due stages of a village and plans them again
+        A village that was not seen before gets a full run
+        Returns the stages that were run
+        """
+        planned = village.scheduled_tasks()
+        if self.reports_village in (None, village.village_id):
+            self.reports_village = village.village_id
+            planned.append("reports")
+        if not self.scheduler.known(village.village_id):
+            village.run(config=config)
+            self.scheduler.villages.add(village.village_id)
+            tasks = planned
+        elif tasks:
+            village.run_tasks(config, tasks)
+        else:
+            tasks = []
+        for task in planned:
+            # Tasks that ran, the defence check that comes with every run and newly enabled tasks
+            if task in tasks or (task == "defence" and tasks) or (village.village_id, task) not in self.scheduler.due:
+                self.scheduler.schedule(village.village_id, task, village.next_task_time(task, delay))
+        return tasks
+
+    def save_checkpoint(self):
+        """
+        Stores the state of all villages so a restart continues where the bot left off
+        """
+        FileManager.save_json_file_atomic(
+            {
+                "time": int(time.time()),
+                "villages": {village.village_id: village.get_state() for village in self.villages},
+            },
+            "cache/checkpoint.json",
+        )
+
+    def load_checkpoint(self):
+        """
+        Reads the state of the last run, an unreadable checkpoint is ignored
+        """
+        try:
+            self.checkpoint = FileManager.load_json_file("cache/checkpoint.json") or {}
+        except InvalidJSONException:
+            self.checkpoint = {}
+        if self.checkpoint:
+            logging.info(
+                "Restoring the state of %d villages from %s",
+                len(self.checkpoint.get("villages", {})),
+                datetime.datetime.fromtimestamp(self.checkpoint.get("time", 0)),
+            )
+
     def manual_config(self):
         """
         Runs through manual steps of configuring the bot
+        Not available for accounts of the supervisor, their config.json is created by hand
         """
+        if FileManager.account_root:
+            logging.error("No config.json in account directory %s", FileManager.account_root)
+            return False
         logging.info(
             "Hello and welcome, it looks like you don't have a config file (yet)"
         )
@@ -159,17 +308,17 @@ class TWB:
         Fetches the config file
         Or the example one of it doesn't exist
         Also updates config file with template data in case of an update
+        The file is only parsed again when it changed
         """
-        template = FileManager.load_json_file("config.example.json")
-
-        if not FileManager.path_exists("config.json"):
+        if not FileManager.path_exists(FileManager.get_path("config.json")):
             if self.manual_config():
                 return self.config()
 
             print("No config file found. Exiting")
             sys.exit(1)
 
-        config = FileManager.load_json_file("config.json", object_pairs_hook=collections.OrderedDict)
+        config = self.config_store.load()
+        template = self.config_store.template
 
         if template and config["build"]["version"] != template["build"]["version"]:
             print(
@@ -178,8 +327,8 @@ class TWB:
             )
             FileManager.copy_file("config.json", "config.bak")
 
-            config = self.merge_configs(config, template)
-            FileManager.save_json_file(config, "config.json")
+            config = self.merge_configs(config, copy.deepcopy(template))
+            self.config_store.save(config)
 
             print("Deployed new configuration file")
 
@@ -234,9 +383,9 @@ class TWB:
             print(f"Village entry {village_id} could not be added to the config file!")
             return
 
-        original["villages"][village_id] = template if template else original["village_template"]
+        original["villages"][village_id] = copy.deepcopy(template if template else original["village_template"])
 
-        FileManager.save_json_file(original, "config.json")
+        self.config_store.save(original)
         print("Deployed new configuration file")
         return original
 
@@ -283,23 +432,15 @@ class TWB:
         """
         Notification.send("TWB is starting up")
         config = self.config()
-        if not self.internet_online():
-            print("Internet seems to be down, waiting till its back online...")
-            sleep = 0
-            if self.is_active_hours(config=config):
-                sleep = config["bot"]["active_delay"]
-            else:
-                if config["bot"]["inactive_still_active"]:
-                    sleep = config["bot"]["inactive_delay"]
-
-            sleep += random.randint(20, 120)
-            dtn = datetime.datetime.now()
-            dt_next = dtn + datetime.timedelta(0, sleep)
+        if not config["bot"].get("user_agent", None):
             print(
-                "Dead for %.2f minutes (next run at: %s)" % (sleep / 60, dt_next.time())
+                "No custom user agent was supplied, this will likely get you banned."
+                "Please set the bot -> user_agent parameter to your browsers one. "
+                "Just google what is my user agent"
             )
-            time.sleep(sleep)
-            return False
+            return
+        # The first run uses this result, the session check does not wait for it
+        self.start_online_check()
 
         self.wrapper = WebWrapper(
             config["server"]["endpoint"],
@@ -308,39 +449,23 @@ class TWB:
             reporter_enabled=config["reporting"]["enabled"],
             reporter_constr=config["reporting"]["connection_string"],
         )
-
-        self.wrapper.start()
-        if not config["bot"].get("user_agent", None):
-            print(
-                "No custom user agent was supplied, this will likely get you banned."
-                "Please set the bot -> user_agent parameter to your browsers one. "
-                "Just google what is my user agent"
-            )
-            return
         self.wrapper.headers["user-agent"] = config["bot"]["user_agent"]
+
+        if self.wrapper.start() is False:
+            # The game could not be reached
+            self.offline_sleep(config)
+            return False
         for vid in config["villages"]:
             v = Village(wrapper=self.wrapper, village_id=vid)
-            self.villages.append(copy.deepcopy(v))
+            if vid in self.checkpoint.get("villages", {}):
+                v.set_state(self.checkpoint["villages"][vid])
+            self.villages.append(v)
         # setup additional builder
         rm = None
         defense_states = {}
         while self.should_run:
-            if not self.internet_online():
-                print("Internet seems to be down, waiting till its back online...")
-                sleep = 0
-                if self.is_active_hours(config=config):
-                    sleep = config["bot"]["active_delay"]
-                else:
-                    if config["bot"]["inactive_still_active"]:
-                        sleep = config["bot"]["inactive_delay"]
-
-                sleep += random.randint(20, 120)
-                dtn = datetime.datetime.now()
-                dt_next = dtn + datetime.timedelta(0, sleep)
-                print(
-                    "Dead for %.2f minutes (next run at: %s)" % (sleep / 60, dt_next.time())
-                )
-                time.sleep(sleep)
+            if not self.is_online():
+                self.offline_sleep(config)
             else:
                 config = self.config()
                 overview_page, config = self.get_overview(config)
@@ -348,10 +473,60 @@ class TWB:
                 if has_changed:
                     print("Updated world options")
                     config = self.merge_configs(config, new_cf)
-                    FileManager.save_json_file(config, "config.json")
+                    self.config_store.save(config)
                     print("Deployed new configuration file")
-                village_number = 1
+                # Managers that use a changed setting are set up again
+                changes = self.config_store.pop_changes()
                 for village in self.villages:
+                    village.config_changed(changes)
+                if config["market"].get("balance_villages", False) and len(self.villages) > 1:
+                    # Own villages help each other out before the market is used
+                    if not self.balancer:
+                        self.balancer = ResourceBalancer(
+                            wrapper=self.wrapper, world_speed=config["world"].get("speed", 1.0)
+                        )
+                    self.balancer.max_duration = config["market"].get("max_trade_duration", 2)
+                    self.balancer.run([v for v in self.villages if v.village_id in self.found_villages])
+                mass_gather = config["units"].get("mass_gather", False)
+                if mass_gather and not self.scavenger:
+                    self.scavenger = MassScavenger(wrapper=self.wrapper)
+                mass_recruit = config["units"].get("mass_recruit", False)
+                if mass_recruit and not self.recruiter:
+                    self.recruiter = MassRecruiter(wrapper=self.wrapper)
+                if config["farms"]["farm"] and config["farms"].get("account_farm_planner", False):
+                    if not self.farm_planner:
+                        self.farm_planner = FarmPlanner()
+                    # Farms are assigned right before every village farms
+                    self.farm_planner.start_cycle(
+                        [v.attack for v in self.villages if v.attack and v.village_id in self.found_villages]
+                    )
+                else:
+                    self.farm_planner = None
+                villages = self.villages
+                if config["bot"].get("scheduler", False):
+                    if not self.scheduler:
+                        self.scheduler = TaskScheduler()
+                    delay = config["bot"]["active_delay"]
+                    if not self.is_active_hours(config=config):
+                        delay = config["bot"]["inactive_delay"]
+                    due = self.scheduler.pop_due(
+                        urgent=[v.village_id for v in self.villages if v.def_man and v.def_man.under_attack]
+                    )
+                    # Villages under attack and with expiring queues first
+                    order = list(due)
+                    villages = sorted(
+                        self.villages, key=lambda v: order.index(v.village_id) if v.village_id in due else len(order)
+                    )
+                else:
+                    self.scheduler = None
+                # Village names are numbered in config order
+                numbers = [v.village_id for v in self.villages if v.village_id in self.found_villages]
+                cycle_tasks = set()
+                ran = False
+                for village in villages:
+                    village.mass_gather = mass_gather and self.scavenger.supported is not False
+                    village.mass_recruit = mass_recruit and self.recruiter.supported is not False
+                    village.farm_planner = self.farm_planner
                     if village.village_id not in self.found_villages:
                         print(
                             "Village %s will be ignored because it is not available anymore"
@@ -372,11 +547,17 @@ class TWB:
                                 + str(config["bot"]["village_name_number_length"])
                                 + "d"
                         )
-                        num_pad = fs % village_number
+                        num_pad = fs % (numbers.index(village.village_id) + 1)
                         template = template.replace("{num}", num_pad)
                         village.village_set_name = template
 
-                    village.run(config=config)
+                    if self.scheduler:
+                        tasks = self.run_scheduled(village, config, due.get(village.village_id, None), delay)
+                        cycle_tasks.update(tasks)
+                        ran = ran or bool(tasks)
+                    else:
+                        village.run(config=config)
+                        ran = True
 
                     if (
                             village.get_config(
@@ -389,13 +570,35 @@ class TWB:
                             if village.def_man.allow_support_recv
                             else False
                         )
-                    village_number += 1
+
+                if ran:
+                    # Once per cycle and only when a village did something
+                    self.save_checkpoint()
 
                 if len(defense_states) and config["farms"]["farm"]:
                     for village in self.villages:
                         print("Syncing attack states")
                         village.def_man.my_other_villages = defense_states
 
+                if mass_recruit and (not self.scheduler or "recruit" in cycle_tasks):
+                    active = [v for v in self.villages if v.village_id in self.found_villages and v.units]
+                    # Keep the queues busy until the next run
+                    horizon = config["bot"]["active_delay"] + 120
+                    if not self.recruiter.run(active, horizon=horizon):
+                        # No mass recruitment (premium) on this account, recruit per village
+                        for village in active:
+                            village.mass_recruit = False
+                            village.do_recruit()
+
+                if mass_gather and (not self.scheduler or "gather" in cycle_tasks):
+                    active = [v for v in self.villages if v.village_id in self.found_villages and v.units]
+                    settings = {v.village_id: v.gather_settings() for v in active if v.gather_settings()}
+                    if settings and not self.scavenger.run(active[0].village_id, settings):
+                        # No mass scavenging on this world, gather per village
+                        for village in active:
+                            village.mass_gather = False
+                            village.do_gather()
+
                 sleep = 0
                 if self.is_active_hours(config=config):
                     sleep = config["bot"]["active_delay"]
@@ -404,6 +607,12 @@ class TWB:
                         sleep = config["bot"]["inactive_delay"]
 
                 sleep += random.randint(20, 120)
+                if config["bot"].get("resource_wake_up", False):
+                    sleep = self.resource_wake_up(sleep)
+                if self.scheduler and self.scheduler.next_due():
+                    # Sleep until the next village has something to do
+                    wake = self.scheduler.next_due() - time.time() + random.randint(5, 30)
+                    sleep = int(min(sleep, max(self.min_sleep, wake)))
                 dtn = datetime.datetime.now()
                 dt_next = dtn + datetime.timedelta(0, sleep)
                 self.runs += 1
@@ -431,6 +640,7 @@ class TWB:
         ]
         FileManager.create_directories(directories)
 
+        self.load_checkpoint()
         self.run()
 
 
@@ -438,7 +648,7 @@ def main():
     """
     Python main entry function
     """
-    check_update()
+    check_update_background()
     for _ in range(3):
         t = TWB()
         try:
@@ -450,6 +660,38 @@ def main():
             traceback.print_exc()
 
     Notification.send("TWB has crashed 3 times, exiting")
+    Notification.flush()
+
+
+def startup_benchmark(top=15):
+    """
+    Measures the import time of the bot using python -X importtime
+    Prints the total and the modules that take the most time themselves
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import twb"],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.realpath(__file__)),
+        check=False,
+    )
+    total = 0
+    modules = []
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)", line)
+        if not match:
+            continue
+        own, cumulative, indent, name = match.groups()
+        modules.append((int(own), name))
+        if not indent:
+            total += int(cumulative)
+    if result.returncode:
+        logging.error("Importing the bot failed:\n%s", result.stderr.strip().splitlines()[-1])
+        return None
+    print("Startup imports: %.1f ms" % (total / 1000))
+    for own, name in sorted(modules, reverse=True)[:top]:
+        print("%8.1f ms  %s" % (own / 1000, name))
+    return total / 1000000
 
 
 def self_config_test():
@@ -472,6 +714,10 @@ def self_config_test():
 
 
 if __name__ == "__main__":
+    setup_logging()
+    if "-b" in sys.argv:
+        startup_benchmark()
+        sys.exit(0)
     if "-i" in sys.argv:
         logging.info("Bot integrity check passed")
         check_conf = self_config_test()
@@ -17,11 +17,15 @@ help_file = {
     'bot.village_name_number_length': 'The number length, lower will be prefixed with zeroes',
     'bot.auto_set_village_names': 'Automatically set villages names',
     'bot.user_agent': 'Set this to the browser agent your session is using (otherwise could cause ban)',
+    'bot.scheduler': 'Only run the parts of a village (building, recruiting, farming, ...) that have something to do, villages under attack first',
+    'bot.resource_wake_up': 'Wake up before the active delay when a village can afford its next building, recruitment or snob or a queue frees up',
     'building.manage_buildings': 'Automatically manage buildings',
     'building': 'The automatic creation of buildings',
     'building.default': 'The default template to use, village configs override this variable',
     'building.max_lookahead': 'The max amount of items in queue to check before stopping',
     'building.max_queued_items': 'Max amount of queued items, default: 2 premium: 5',
+    'building.build_planner': 'Reorder the next template entries to the order that finishes them first',
+    'building.plan_lookahead': 'The amount of template entries the build planner may reorder (max 6)',
     'units': 'Enable automatic recruitment of units',
     'units.recruit': 'Automatically recruit units',
     'units.upgrade': 'Automatically upgrade units (only for level 1-3, 1-10 smith systems)',
@@ -30,6 +34,9 @@ help_file = {
     'units.manage_defence': 'Manage defence between villages (experimental)',
     'units.remove_manual_queued': 'Remove manual queued recruitment entries',
     'units.randomize_unit_queue': 'Randomize unit queue, allows a more wide variety in units',
+    'units.mass_gather': 'Gather with all villages at once from the mass scavenge screen (falls back to gathering per village)',
+    'units.mass_recruit': 'Recruit for all villages at once from the mass recruitment screen (premium, falls back to recruiting per village)',
+    'units.recruit_planner': 'Plan recruitment of all buildings at once, keeping every queue busy until the next run',
     'farms': 'Automatic farming of nearby (barbarian) villages',
     'farms.farm': 'Enable automatic farming',
     'farms.min_points': 'The minimum points of villages to attack (also checks custom_farms)',
@@ -43,6 +50,12 @@ help_file = {
     'farms.attack_higher_points': 'If enabled villages with higher points than the current one will automatically be ignored',
     'farms.force_scout_if_available': 'Will only attack villages that have either been attacked before or it will automatically scout them',
     'farms.farm_scout_amount': 'Sets the amount of spies used to determine if a village is safe to farm',
+    'farms.use_farm_assistant': 'Send farms using the A/B templates of the farm assistant (falls back to the rally point if not available)',
+    'farms.use_loot_model': 'Rank farms by expected loot per troop-hour and size farm templates to the predicted haul',
+    'farms.account_farm_planner': 'Assign every farm to a single village each cycle (closest village with enough troops)',
+    'farms.scout_planner': 'Collect scout requests during a farm run and only send the most valuable ones (stale intel, high loot, close by)',
+    'farms.scout_budget': 'Max amount of scouts sent per village per run when the scout planner is enabled',
+    'farms.farm_solver': 'Send the cheapest troops that beat the scouted defence of a farm without losses (skips farms that can not be farmed without losses)',
     'market': 'Automatic management of market trading',
     'market.auto_trade': 'Enable automated trading',
     'market.max_trade_duration': 'Max duration of trades (hours)',
@@ -50,12 +63,15 @@ help_file = {
     'market.trade_multiplier': 'Set to true if the world supports uneven trade ratios',
     'market.trade_multiplier_value': 'Multiplier value (lower is more gain)',
     'market.trade_max_per_hour': 'The amount of trades the bot can do in 1 hour',
+    'market.balance_villages': 'Send resources between own villages before trading with other players',
     'world.knight_enabled': 'The world has knights enabled',
     'world.flags_enabled': 'Allows automatic management of flags (upgrading and defence)',
     'world.quests_enabled': 'World has quests enabled (bot will automatically finish them)',
     'world.trade_for_premium': 'World has the premium market enabled (doing this too much could result in ban)',
     'world.archers_enabled': 'Are archers / marchers enabled on the world',
     'world.building_destruction_enabled': 'Are rams / catpults enabled on the world',
+    'world.speed': 'The speed of the world (production and travel times)',
+    'world.unit_speed': 'The unit speed modifier of the world',
     'village_template': 'The default template for villages to use',
     'village.building': 'Override build template',
     'village.units': 'Override recruitment / farm template',